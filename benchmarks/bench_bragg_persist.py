@@ -0,0 +1,75 @@
+"""
+File: bench_bragg_persist.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Benchmark of the persistence of a bragg file into the bragg and scientist cloud volumes.
+Compares writing the file twice with writing it once and linking (or copying) it into the second volume.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+from volume_writer import persist  # noqa: E402
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "fixtures", "bragg_volume", "1743619484_NOM168366tof.gsa"
+)
+
+
+def double_write(data: bytes, paths, durability: str):
+    """the original persistence: one open and write per volume"""
+    with open(paths[0], "wb") as f, open(paths[1], "wb") as s:
+        f.write(data)
+        s.write(data)
+        if durability != "none":
+            f.flush()
+            s.flush()
+            os.fsync(f.fileno())
+            os.fsync(s.fileno())
+
+
+def bench(fn, data: bytes, paths, durability: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(data, [f"{p}.{i}" for p in paths], durability)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bragg file persistence benchmark")
+    parser.add_argument("--sizes", default="1,8,32", help="comma separated file sizes in MB")
+    parser.add_argument("--repeat", default=10, type=int, help="files written per measurement")
+    parser.add_argument("--durability", default="none", choices=["none", "file", "full"])
+    parser.add_argument("--dir", default=None, help="directory for the volumes (default = a temporary directory)")
+    args = parser.parse_args()
+
+    with open(FIXTURE, "rb") as f:
+        fixture = f.read()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        paths = []
+        for volume in ["bragg_volume", "scientist_cloud_volume"]:
+            os.makedirs(os.path.join(tmp, volume))
+            paths.append(os.path.join(tmp, volume, "NOM168366tof.gsa"))
+
+        for size_mb in [int(s) for s in args.sizes.split(",")]:
+            data = (fixture * (size_mb * 1024 * 1024 // len(fixture) + 1))[: size_mb * 1024 * 1024]
+            print(f"bragg file {size_mb} MB, durability {args.durability}")
+            for name, fn in [
+                ("double write", double_write),
+                ("write + link", lambda d, p, dur: persist(d, p, "link", dur)),
+                ("write + copy", lambda d, p, dur: persist(d, p, "copy", dur)),
+            ]:
+                elapsed = bench(fn, data, paths, args.durability, args.repeat)
+                print(f"  {name:<15} {elapsed * 1e3:>10.2f} ms {size_mb / elapsed:>10.0f} MB/s")
+                for volume in os.listdir(tmp):
+                    for file in os.listdir(os.path.join(tmp, volume)):
+                        os.remove(os.path.join(tmp, volume, file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+File: bench_last_record.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Microbenchmark of the last record lookup on multi-MB andie.txt files.
+Compares iterating over the lines, seeking backwards one byte at a time and the block-wise reverse reader.
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+from record_reader import read_last_line  # noqa: E402
+
+
+def iterate_lines(path: str) -> str:
+    last_measure = ""
+    with open(path, "r") as f:
+        for record in f:
+            last_measure = record
+    return last_measure
+
+
+def seek_bytes(path: str) -> str:
+    with open(path, "rb") as f:
+        f.seek(-2, os.SEEK_END)
+        while f.read(1) != b"\n":
+            f.seek(-2, os.SEEK_CUR)
+        return f.readline().decode()
+
+
+def write_andie_file(path: str, size_mb: int):
+    cid = str(uuid.uuid4())
+    with open(path, "w") as f:
+        timestamp = 1743619342
+        while f.tell() < size_mb * 1024 * 1024:
+            timestamp += 2
+            f.write(f"{cid},{uuid.uuid4()},{timestamp},{timestamp % 500}.25\n")
+
+
+def bench(fn, path: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(path)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Last record lookup microbenchmark")
+    parser.add_argument("--sizes", default="1,8,64", help="comma separated andie.txt sizes in MB")
+    parser.add_argument("--repeat", default=20, type=int, help="lookups per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in [int(s) for s in args.sizes.split(",")]:
+            path = os.path.join(tmp, "andie.txt")
+            write_andie_file(path, size_mb)
+            assert iterate_lines(path) == seek_bytes(path) == read_last_line(path)
+            print(f"andie.txt {size_mb} MB")
+            for name, fn in [
+                ("iterate lines", iterate_lines),
+                ("seek bytes", seek_bytes),
+                ("reverse blocks", read_last_line),
+            ]:
+                print(f"  {name:<15} {bench(fn, path, args.repeat) * 1e6:>12.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+File: bench_payload_encoding.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Benchmark of the bragg file messages on the GSAS/ corpus, for every FileType encoding and version.
+Measures the size of the serialized messages (broker bandwidth), the time to build them on the client
+and the time to validate, decompress and write them on the service. The transfer time is estimated
+for the given broker bandwidth.
+"""
+
+import os
+import sys
+import time
+import base64
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "clients"))
+from pydantic import TypeAdapter  # noqa: E402
+from intersect_sdk._internal.generic_serializer import GENERIC_MESSAGE_SERIALIZER  # noqa: E402
+from dashboard_service import FileType  # noqa: E402
+from schema import FileType as ClientFileType  # noqa: E402
+from payload_codec import encode, iter_decoded, zstandard  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bragg file message encoding benchmark")
+    parser.add_argument("--corpus", default="GSAS", help="directory with the gsa files")
+    parser.add_argument("--bandwidth", default=100.0, type=float, help="broker bandwidth in Mbit/s")
+    args = parser.parse_args()
+
+    files = []
+    for file in sorted(os.listdir(args.corpus)):
+        with open(os.path.join(args.corpus, file), "rb") as f:
+            files.append((file, f.read()))
+    raw = sum(len(data) for _, data in files)
+    print(f"{len(files)} files, {raw / 1e6:.1f} MB, broker at {args.bandwidth:.0f} Mbit/s")
+
+    adapter = TypeAdapter(FileType)
+    encodings = ["none", "gzip"] + (["zstd"] if zstandard is not None else [])
+    with tempfile.TemporaryDirectory() as tmp:
+        for encoding, version in [(e, v) for e in encodings for v in (1, 2)]:
+            size, client, service = 0, 0.0, 0.0
+            for file, data in files:
+                start = time.perf_counter()
+                content = encode(data, encoding)
+                if version == 1:
+                    content = base64.b64encode(content)
+                msg = ClientFileType(filename=file, file=content, encoding=encoding, version=version)
+                wire = GENERIC_MESSAGE_SERIALIZER.dump_json(msg, warnings=False)
+                client += time.perf_counter() - start
+                size += len(wire)
+
+                start = time.perf_counter()
+                received = adapter.validate_json(wire)
+                with open(os.path.join(tmp, file), "wb") as f:
+                    for block in iter_decoded(received.content(), received.encoding):
+                        f.write(block)
+                service += time.perf_counter() - start
+
+            transfer = size * 8 / (args.bandwidth * 1e6)
+            print(
+                f"  {encoding:<5} v{version} {size / 1e6:>8.1f} MB on the wire ({size / raw:>5.0%} of raw)"
+                f"  client {client * 1e3 / len(files):>6.1f} ms/file"
+                f"  service {service * 1e3 / len(files):>6.1f} ms/file"
+                f"  transfer {transfer * 1e3 / len(files):>7.1f} ms/file"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+File: bench_upload_checksum.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Benchmark of the checksum of the files uploaded by the storage service, on the GSAS corpus.
+Compares running cksum in a shell, and then reading the file again to upload it, with reading the file
+once and computing its CRC32 in-process.
+"""
+
+import io
+import os
+import sys
+import time
+import zlib
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+from storage_service import checksum  # noqa: E402
+
+GSAS = os.path.join(os.path.dirname(__file__), "..", "GSAS")
+
+
+def shell_cksum(path: str) -> int:
+    """the original checksum: cksum in a shell, then the file is read again by the upload"""
+    crc = int(subprocess.check_output(f"cksum {path}", shell=True, text=True).split()[0])
+    with open(path, "rb") as f:
+        io.BytesIO(f.read())
+    return crc
+
+
+def streamed_crc32(path: str) -> int:
+    """CRC32 read in blocks, then the file is read again by the upload (the files over IN_MEMORY_MAX)"""
+    with open(path, "rb") as f:
+        crc = checksum(f)
+    with open(path, "rb") as f:
+        io.BytesIO(f.read())
+    return crc
+
+
+def in_memory_crc32(path: str) -> int:
+    """the file is read once, and checksummed and uploaded from memory"""
+    with open(path, "rb") as f:
+        data = f.read()
+    crc = zlib.crc32(data)
+    io.BytesIO(data)
+    return crc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload checksum benchmark")
+    parser.add_argument("--dir", default=GSAS, help="directory of the files (default = the GSAS corpus)")
+    parser.add_argument("--repeat", default=5, type=int, help="passes over the files per measurement")
+    args = parser.parse_args()
+
+    paths = [os.path.join(args.dir, f) for f in sorted(os.listdir(args.dir))]
+    size_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+    print(f"{len(paths)} files, {size_mb:.1f} MB")
+    for name, fn in [
+        ("cksum + read", shell_cksum),
+        ("crc32 + read", streamed_crc32),
+        ("read + crc32", in_memory_crc32),
+    ]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for path in paths:
+                fn(path)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(f"  {name:<15} {elapsed * 1e3:>10.1f} ms {elapsed / len(paths) * 1e3:>8.2f} ms/file {size_mb / elapsed:>8.0f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+File: bench_upload_transfer.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Benchmark of the uploads of the storage service: a burst of the GSAS corpus together with one large file.
+Compares the default transfer settings with multipart uploads, a bandwidth limit and a budget of bytes in flight.
+Runs against moto in-process by default, or against a MinIO/S3 endpoint (credentials as for the storage service).
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+import storage_service  # noqa: E402
+from transfer_limits import MB, Transfer  # noqa: E402
+
+GSAS = os.path.join(os.path.dirname(__file__), "..", "GSAS")
+BUCKET = "nsdf-intersect-bench"
+
+
+class PeakBudget:
+    """wraps the budget of a transfer to record the peak of the bytes in flight"""
+
+    def __init__(self, transfer: Transfer):
+        self.peak = 0
+        acquire = transfer.budget.acquire
+
+        def acquired(nbytes):
+            acquire(nbytes)
+            self.peak = max(self.peak, transfer.budget.in_flight)
+
+        transfer.budget.acquire = acquired
+
+
+def run(paths, transfer: Transfer, max_workers: int):
+    storage_service._transfer = transfer
+    peak = PeakBudget(transfer)
+    config = {"volumes": {"scientist_cloud_volume": os.path.dirname(paths[0])}}
+    durations = {}
+
+    def upload(path):
+        start = time.perf_counter()
+        storage_service.upload_with_retry(path, f"bench/{os.path.basename(path)}", config)
+        durations[path] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(upload, paths))
+    elapsed = time.perf_counter() - start
+
+    # Jain's index of the throughput of the files, 1 if they all progressed at the same rate
+    rates = [os.path.getsize(p) / durations[p] for p in paths]
+    fairness = sum(rates) ** 2 / (len(rates) * sum(r * r for r in rates))
+    return elapsed, durations, fairness, peak.peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage service upload benchmark")
+    parser.add_argument("--endpoint", default=None, help="S3 endpoint, e.g., http://localhost:9000 (default = moto)")
+    parser.add_argument("--large-mb", default=64, type=int, help="size of the large file in MB")
+    parser.add_argument("--max-workers", default=8, type=int, help="files uploaded in parallel")
+    parser.add_argument("--bandwidth-mb", default=50, type=float, help="bandwidth limit in MB/s")
+    parser.add_argument("--in-flight-mb", default=64, type=float, help="budget of bytes in flight in MB")
+    args = parser.parse_args()
+
+    if args.endpoint is None:
+        from moto import mock_aws
+
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        mock = mock_aws()
+        mock.start()
+    else:
+        os.environ["ENDPOINT_URL"] = args.endpoint
+    os.environ["BUCKET_NAME"] = BUCKET
+    client = storage_service.get_client(max_pool_connections=args.max_workers * 4)
+    try:
+        client.create_bucket(Bucket=BUCKET)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        large = os.path.join(tmp, "large.gsa")
+        with open(large, "wb") as f:
+            f.write(os.urandom(args.large_mb * MB))
+        paths = [large] + [os.path.join(GSAS, f) for f in sorted(os.listdir(GSAS))]
+        size_mb = sum(os.path.getsize(p) for p in paths) / MB
+        print(f"{len(paths)} files, {size_mb:.1f} MB, {args.max_workers} workers")
+
+        for name, transfer in [
+            ("default", Transfer()),
+            ("multipart", Transfer.from_config({"multipart_chunksize_mb": 8, "max_concurrency": 4})),
+            (
+                f"{args.bandwidth_mb:g} MB/s, {args.in_flight_mb:g} MB",
+                Transfer.from_config(
+                    {
+                        "multipart_chunksize_mb": 8,
+                        "max_concurrency": 4,
+                        "max_bandwidth_mb": args.bandwidth_mb,
+                        "max_in_flight_mb": args.in_flight_mb,
+                    }
+                ),
+            ),
+        ]:
+            elapsed, durations, fairness, peak = run(paths, transfer, args.max_workers)
+            small = [durations[p] for p in paths[1:]]
+            print(
+                f"  {name:<22} {elapsed:>7.2f} s {size_mb / elapsed:>8.1f} MB/s"
+                f"  large file {durations[large]:>6.2f} s"
+                f"  gsa p50 {sorted(small)[len(small) // 2] * 1e3:>7.1f} ms max {max(small) * 1e3:>7.1f} ms"
+                f"  fairness {fairness:.2f}  peak in flight {peak / MB:>6.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
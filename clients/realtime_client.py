@@ -5,7 +5,7 @@ License: BSD-3
 Description: Test client for all the plots, simulating realtime.
 """
 
-import base64
+import argparse
 import logging
 import time
 import os
@@ -21,7 +21,7 @@ from intersect_sdk import (
     default_intersect_lifecycle_loop,
 )
 
-from schema import FileType, TransitionData, NextTemperature, FinishCampaignMsg
+from schema import FileType, TransitionData, NextTemperature, FinishCampaignMsg, encode_file
 
 logging.basicConfig(level=logging.INFO)
 
@@ -68,7 +68,7 @@ DATA_PATH = os.path.join(os.getcwd(), "clients/short_list_of_data.txt")
 
 
 class SampleOrchestrator:
-    def __init__(self) -> None:
+    def __init__(self, encoding: str = "gzip") -> None:
         """ "Load all gsa files to simulate a stream of data coming in"""
         self.message_stack = []
         id_campaign = str(uuid4())
@@ -80,7 +80,8 @@ class SampleOrchestrator:
                 with open(filepath, "rb") as file:
                     msg = FileType(
                         filename=os.path.basename(filepath),
-                        file=base64.b64encode(file.read()),
+                        file=encode_file(file.read(), encoding),
+                        encoding=encoding,
                     )
                     # wait 5 seconds for each message
                     self.message_stack.append(
@@ -170,7 +171,16 @@ if __name__ == "__main__":
     with open(CONFIG_CLIENT) as f:
         from_config_file = yaml.safe_load(f)
 
-    orchestrator = SampleOrchestrator()
+    parser = argparse.ArgumentParser(description="Dashboard real-time client")
+    parser.add_argument(
+        "--encoding",
+        default="gzip",
+        choices=["none", "gzip", "zstd"],
+        help="compression of the bragg files (zstd requires the zstandard package)",
+    )
+    args = parser.parse_args()
+
+    orchestrator = SampleOrchestrator(args.encoding)
     config = IntersectClientConfig(
         initial_message_event_config=IntersectClientCallback(
             messages_to_send=[orchestrator.message_stack.pop()[0]]
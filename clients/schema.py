@@ -1,6 +1,8 @@
+import base64
+import gzip
 from typing_extensions import Annotated
-from pydantic import BaseModel, Field
-from typing import List
+from pydantic import BaseModel, Field, field_serializer
+from typing import List, Literal
 
 
 SerializedBase64 = Annotated[bytes, Field(json_schema_extra={"format": "base64"})]
@@ -13,10 +15,72 @@ class FileType(BaseModel):
     Attributes:
         filename (str): The name of the file.
         file (SerializedBase64): The file content serialized in Base64 format.
+            With version 1 file holds the Base64 text, encoded by the sender.
+            With version 2 file holds the raw content, encoded once when the message is serialized.
+        encoding (str): The compression of the file content: none, gzip or zstd (default = none).
+        version (int): The version of the message (default = 2).
     """
 
     filename: str
     file: SerializedBase64
+    encoding: Literal["none", "gzip", "zstd"] = "none"
+    version: Literal[1, 2] = 2
+
+    @field_serializer("file", when_used="json")
+    def serialize_file(self, file: bytes) -> str:
+        return base64.b64encode(file).decode() if self.version == 2 else file.decode()
+
+
+def encode_file(data: bytes, encoding: str) -> bytes:
+    """compresses the content of a file for FileType.encoding (zstd requires the zstandard package)"""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+class BraggUploadBegin(BaseModel):
+    """
+    Represents the start (or the resumption) of a chunked upload of a gsa file.
+
+    Attributes:
+        filename (str): The name of the file.
+        size (int): The size of the file in bytes.
+        checksum (str): The SHA-256 hex digest of the file.
+    """
+
+    filename: str
+    size: int
+    checksum: str
+
+
+class BraggChunk(BaseModel):
+    """
+    Represents a chunk of a gsa file.
+
+    Attributes:
+        upload_id (str): The id of the upload, as returned by begin_bragg_upload.
+        offset (int): The offset of the chunk in the file.
+        data (SerializedBase64): The content of the chunk serialized in Base64 format.
+    """
+
+    upload_id: str
+    offset: int
+    data: SerializedBase64
+
+
+class BraggUploadCommit(BaseModel):
+    """
+    Represents the end of a chunked upload of a gsa file.
+
+    Attributes:
+        upload_id (str): The id of the upload, as returned by begin_bragg_upload.
+    """
+
+    upload_id: str
 
 
 class TransitionData(BaseModel):
@@ -34,6 +98,17 @@ class TransitionData(BaseModel):
     ylist: List[float]
 
 
+class TransitionDataBatch(BaseModel):
+    """
+    Represents a batch of transition data records.
+
+    Attributes:
+        records (List[TransitionData]): The transition data records, possibly of several campaigns, in order.
+    """
+
+    records: List[TransitionData]
+
+
 class NextTemperature(BaseModel):
     """
     Represents the next temperature record (ANDiE prediction).
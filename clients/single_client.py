@@ -7,6 +7,7 @@ Granular control over endpoint hit (bragg, transition, next_temperature)
 """
 
 import base64
+import hashlib
 import time
 import logging
 import os
@@ -23,7 +24,15 @@ from intersect_sdk import (
     default_intersect_lifecycle_loop,
 )
 
-from schema import FileType, TransitionData, NextTemperature
+from schema import (
+    FileType,
+    encode_file,
+    TransitionData,
+    NextTemperature,
+    BraggUploadBegin,
+    BraggChunk,
+    BraggUploadCommit,
+)
 
 logging.basicConfig(level=logging.INFO)
 CONFIG_CLIENT = "config/config_client.yaml"
@@ -65,14 +74,14 @@ transition_data = [
 ]
 
 
-def prepare_bragg_messages(n: int = 1):
+def prepare_bragg_messages(n: int = 1, encoding: str = "gzip"):
     messages = []
     files = os.listdir("GSAS")
     for i in range(min(n, len(files))):
         file_bytes = ""
         with open(f"./GSAS/{files[i]}", "rb") as f:
-            file_bytes = base64.b64encode(f.read())
-        msg = FileType(filename=files[i], file=file_bytes)
+            file_bytes = encode_file(f.read(), encoding)
+        msg = FileType(filename=files[i], file=file_bytes, encoding=encoding)
         messages.append(
             IntersectDirectMessageParams(
                 destination="nsdf.cloud.diffraction.dashboard.dashboard-service",
@@ -83,6 +92,78 @@ def prepare_bragg_messages(n: int = 1):
     return messages
 
 
+class ChunkedBraggUpload:
+    """
+    Uploads gsa files in chunks of chunk_size bytes, one file after the other.
+    Every reply of the service tells the offset of the next chunk to send, so an interrupted
+    upload is resumed by running the client again.
+    """
+
+    def __init__(self, n: int = 1, chunk_size: int = 256 * 1024) -> None:
+        self.chunk_size = chunk_size
+        self.files = [f"./GSAS/{file}" for file in os.listdir("GSAS")[:n]]
+        self.files.reverse()
+        self.path = ""
+
+    def _message(self, operation: str, payload) -> IntersectDirectMessageParams:
+        return IntersectDirectMessageParams(
+            destination="nsdf.cloud.diffraction.dashboard.dashboard-service",
+            operation=f"NSDFDashboard.{operation}",
+            payload=payload,
+        )
+
+    def next_file(self) -> IntersectDirectMessageParams:
+        self.path = self.files.pop()
+        checksum = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(self.chunk_size), b""):
+                checksum.update(block)
+        return self._message(
+            "begin_bragg_upload",
+            BraggUploadBegin(
+                filename=os.path.basename(self.path),
+                size=os.path.getsize(self.path),
+                checksum=checksum.hexdigest(),
+            ),
+        )
+
+    def client_callback(
+        self,
+        _source: str,
+        _operation: str,
+        has_error: bool,
+        payload: INTERSECT_JSON_VALUE,
+    ) -> IntersectClientCallback:
+        if has_error:
+            print(payload)
+            raise Exception
+
+        if payload["committed"]:
+            print(f"uploaded {self.path}")
+            if not self.files:
+                # break out of pub/sub loop
+                raise Exception
+            return IntersectClientCallback(messages_to_send=[self.next_file()])
+
+        if payload["offset"] == payload["size"]:
+            message = self._message(
+                "commit_bragg_upload", BraggUploadCommit(upload_id=payload["upload_id"])
+            )
+        else:
+            with open(self.path, "rb") as f:
+                f.seek(payload["offset"])
+                data = f.read(self.chunk_size)
+            message = self._message(
+                "upload_bragg_chunk",
+                BraggChunk(
+                    upload_id=payload["upload_id"],
+                    offset=payload["offset"],
+                    data=base64.b64encode(data),
+                ),
+            )
+        return IntersectClientCallback(messages_to_send=[message])
+
+
 def prepare_transition_message():
     return IntersectDirectMessageParams(
         destination="nsdf.cloud.diffraction.dashboard.dashboard-service",
@@ -129,11 +210,27 @@ def main():
     )
     parser.add_argument("--n", default=1, help="number of bragg files to send")
     parser.add_argument("--val", default=225.0, help="next temperature custom value")
+    parser.add_argument(
+        "--encoding",
+        default="gzip",
+        choices=["none", "gzip", "zstd"],
+        help="compression of the bragg files (zstd requires the zstandard package)",
+    )
+    parser.add_argument(
+        "--chunk-kb",
+        default=0,
+        help="send the bragg files in chunks of this size (0 = one message per file)",
+    )
     args = parser.parse_args()
 
     initial_messages = []
-    if args.bragg:
-        for msg in prepare_bragg_messages(args.n):
+    user_callback = simple_client_callback
+    if args.bragg and int(args.chunk_kb) > 0:
+        upload = ChunkedBraggUpload(int(args.n), int(args.chunk_kb) * 1024)
+        initial_messages.append(upload.next_file())
+        user_callback = upload.client_callback
+    elif args.bragg:
+        for msg in prepare_bragg_messages(int(args.n), args.encoding):
             initial_messages.append(msg)
     if args.transition:
         initial_messages.append(prepare_transition_message())
@@ -152,7 +249,7 @@ def main():
 
     client = IntersectClient(
         config=config,
-        user_callback=simple_client_callback,
+        user_callback=user_callback,
     )
 
     default_intersect_lifecycle_loop(
@@ -23,7 +23,7 @@ from intersect_sdk import (
     default_intersect_lifecycle_loop,
 )
 
-from schema import TransitionData, NextTemperature, FinishCampaignMsg
+from schema import TransitionData, TransitionDataBatch, NextTemperature, FinishCampaignMsg
 
 logging.basicConfig(level=logging.INFO)
 
@@ -113,6 +113,24 @@ def generate_transition_msg(
     )
 
 
+def generate_transition_batch_msg(
+    id: str, temps: List[float], ylen: int, wait_time: float
+) -> Tuple[IntersectDirectMessageParams, float]:
+    return (
+        IntersectDirectMessageParams(
+            destination="nsdf.cloud.diffraction.dashboard.dashboard-service",
+            operation="NSDFDashboard.get_transition_data_batch",
+            payload=TransitionDataBatch(
+                records=[
+                    TransitionData(id=id, temp=temp, ylist=generate_y_list(ylen))
+                    for temp in temps
+                ],
+            ),
+        ),
+        wait_time,
+    )
+
+
 def generate_next_temp_msg(id: str, temp: float, base_time: int):
     return (
         IntersectDirectMessageParams(
@@ -129,7 +147,7 @@ def generate_next_temp_msg(id: str, temp: float, base_time: int):
 
 
 def generate_campaign(
-    npoints: int, ylen: int
+    npoints: int, ylen: int, batch: int = 0, wait_time: float = 2.0
 ) -> List[Tuple[IntersectDirectMessageParams, float]]:
     if npoints < 1 or ylen < 1:
         raise RuntimeError(
@@ -141,11 +159,20 @@ def generate_campaign(
 
     temps = generate_temperatures(npoints)
     base_time = int(time.time())
-    for i in range(npoints):
-        base_time = base_time + 2
-        next_temp = temps[i + 1] if i + 1 < npoints else temps[i]
-        campaign.append(generate_transition_msg(id, temps[i], ylen))
-        campaign.append(generate_next_temp_msg(id, next_temp, base_time))
+    if batch > 0:
+        # one get_transition_data_batch message per batch points, and the next temperature after it
+        for i in range(0, npoints, batch):
+            j = min(i + batch, npoints)
+            base_time = base_time + 2
+            next_temp = temps[j] if j < npoints else temps[j - 1]
+            campaign.append(generate_transition_batch_msg(id, temps[i:j], ylen, wait_time))
+            campaign.append(generate_next_temp_msg(id, next_temp, base_time))
+    else:
+        for i in range(npoints):
+            base_time = base_time + 2
+            next_temp = temps[i + 1] if i + 1 < npoints else temps[i]
+            campaign.append(generate_transition_msg(id, temps[i], ylen))
+            campaign.append(generate_next_temp_msg(id, next_temp, base_time))
 
     campaign.append(
         (
@@ -164,9 +191,9 @@ def generate_campaign(
 
 
 class SampleOrchestrator:
-    def __init__(self, npoint, ylen) -> None:
+    def __init__(self, npoint, ylen, batch=0, wait_time=2.0) -> None:
         """ "Load all gsa files to simulate a stream of data coming in"""
-        self.message_stack = generate_campaign(npoint, ylen)
+        self.message_stack = generate_campaign(npoint, ylen, batch, wait_time)
         self.message_stack.reverse()
 
     def client_callback(
@@ -192,9 +219,17 @@ def main():
     parser = argparse.ArgumentParser(description="Campaign")
     parser.add_argument("--n", default=10, help="number of points")
     parser.add_argument("--ny", default=3, help="number of y's")
+    parser.add_argument(
+        "--batch", default=0, help="number of points per batch message (0 = one message per point)"
+    )
+    parser.add_argument(
+        "--wait", default=2.0, help="seconds to wait before sending each batch message"
+    )
     args = parser.parse_args()
 
-    orchestrator = SampleOrchestrator(int(args.n), int(args.ny))
+    orchestrator = SampleOrchestrator(
+        int(args.n), int(args.ny), int(args.batch), float(args.wait)
+    )
     initial_messages = [orchestrator.message_stack.pop()[0]]
 
     config = IntersectClientConfig(
@@ -0,0 +1,188 @@
+"""
+File: campaign_bundle.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Packs the files of a finished campaign into one compressed tar archive with an index.
+"""
+
+import io
+import os
+import gzip
+import json
+import time
+import zlib
+import tarfile
+import logging
+from typing import List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index.json"
+BLOCK_SIZE = 1024 * 1024
+
+
+def bundle_encoding(encoding: Optional[str] = None) -> str:
+    """returns the encoding of the bundles: the one asked, zstd if zstandard is installed, gzip otherwise"""
+    if encoding not in (None, "zstd", "gzip"):
+        raise ValueError(f"unknown bundle encoding: {encoding}")
+    if encoding == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, the bundles are compressed with gzip")
+        return "gzip"
+    return encoding or ("zstd" if zstandard is not None else "gzip")
+
+
+def bundle_name(cid: str, encoding: str) -> str:
+    """returns the name of the bundle of a campaign"""
+    return f"{cid}_bundle.tar.{'zst' if encoding == 'zstd' else 'gz'}"
+
+
+def campaign_start(volume: str, cid: str) -> Optional[float]:
+    """
+    returns the start of a campaign recorded by the dashboard service in <cid>.start, on the
+    clock of the names of the GSAS files, None if it was not recorded
+    """
+    try:
+        with open(os.path.join(volume, f"{cid}.start"), "rb") as f:
+            return float(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def campaign_files(volume: str, cid: str, end: Optional[float] = None) -> Tuple[bytes, List[str], tuple]:
+    """
+    Finds the files of a campaign in the scientist cloud volume. The GSAS files are not tagged
+    with their campaign, they are the ones received (the timestamp prefix of their name) between
+    the start of the campaign and its end. The start is the one recorded by the dashboard
+    service (see campaign_start); without it, the timestamp of the first ANDiE record of the
+    campaign, which is set by the client and may be skewed.
+
+    Args:
+        volume (str): The scientist cloud volume.
+        cid (str): The id of the campaign.
+        end (Optional[float]): The end of the campaign (default = now).
+
+    Returns:
+        tuple: The ANDiE records of the campaign, the names of its GSAS files, and the (start, end)
+            window of the GSAS files, start is None without a recorded start nor ANDiE records.
+    """
+    end = time.time() if end is None else end
+    andie = []
+    try:
+        with open(os.path.join(volume, "andie.txt"), "rb") as f:
+            andie = [line for line in f if line.startswith(f"{cid},".encode()) and line.endswith(b"\n")]
+    except FileNotFoundError:
+        pass
+
+    start = campaign_start(volume, cid)
+    if start is None:
+        timestamps = []
+        for line in andie:
+            try:
+                timestamps.append(float(line.split(b",")[2]))
+            except (IndexError, ValueError):
+                continue
+        if not timestamps:
+            logger.warning(f"no start nor ANDiE records for the campaign {cid}, its GSAS files are not bundled")
+            return b"".join(andie), [], (None, end)
+        start = min(timestamps)
+
+    gsas = []
+    for name in os.listdir(volume):
+        if name.startswith(".") or not name.endswith(".gsa"):
+            continue
+        try:
+            timestamp = float(name.split("_", 1)[0])
+        except ValueError:
+            continue
+        if start <= timestamp <= end:
+            gsas.append(name)
+    return b"".join(andie), sorted(gsas), (start, end)
+
+
+def _checksum(path: str) -> int:
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes, mtime: float):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(mtime)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_bundle(volume: str, cid: str, dst: str, encoding: str, end: Optional[float] = None) -> dict:
+    """
+    Writes the bundle of a campaign: index.json (first, so it can be read without the rest of the
+    archive), the transition file, the ANDiE records of the campaign (andie.txt) and its GSAS
+    files (gsas/), in a tar archive compressed with zstd or gzip.
+
+    Args:
+        volume (str): The scientist cloud volume.
+        cid (str): The id of the campaign.
+        dst (str): The path of the bundle.
+        encoding (str): "zstd" or "gzip".
+        end (Optional[float]): The end of the campaign (default = now).
+
+    Returns:
+        dict: The index of the bundle, with the size of its files (raw_size) and of the bundle (size).
+
+    Raises:
+        FileNotFoundError: If the transition file of the campaign does not exist.
+    """
+    transition = f"{cid}_transition.txt"
+    andie, gsas, window = campaign_files(volume, cid, end)
+
+    members = [(transition, os.path.join(volume, transition))]
+    members += [(f"gsas/{name}", os.path.join(volume, name)) for name in gsas]
+    files = []
+    for name, path in members:
+        stat = os.stat(path)
+        files.append({"name": name, "size": stat.st_size, "mtime": stat.st_mtime, "crc32": _checksum(path)})
+    files.append({"name": "andie.txt", "size": len(andie), "mtime": window[1], "crc32": zlib.crc32(andie)})
+
+    index = {
+        "campaign": cid,
+        "encoding": encoding,
+        "created": time.time(),
+        "window": list(window),
+        "files": files,
+        "raw_size": sum(f["size"] for f in files),
+    }
+
+    with open(dst, "wb") as f:
+        if encoding == "zstd":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=False)
+        else:
+            stream = gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+        with stream, tarfile.open(fileobj=stream, mode="w|") as tar:
+            _add_bytes(tar, INDEX_NAME, json.dumps(index, indent=1).encode(), index["created"])
+            for name, path in members:
+                tar.add(path, arcname=name)
+            _add_bytes(tar, "andie.txt", andie, window[1])
+
+    index["size"] = os.path.getsize(dst)
+    return index
+
+
+def read_index(path: str) -> dict:
+    """returns the index of a bundle, decompressing only the start of the archive"""
+    with open(path, "rb") as f:
+        if path.endswith(".zst"):
+            stream = zstandard.ZstdDecompressor().stream_reader(f)
+        else:
+            stream = gzip.GzipFile(fileobj=f, mode="rb")
+        with stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+            member = tar.next()
+            if member is None or member.name != INDEX_NAME:
+                raise ValueError(f"{path} does not start with an index")
+            return json.load(tar.extractfile(member))
@@ -10,7 +10,7 @@ License: BSD-3
 ##############################
 
 # FILES
-RETRY_FILE = "retry.txt"
+RETRY_FILE = ".storage_retry.sqlite3"  # the failed uploads, relative to the scientist cloud volume
 
 ############################
 ########## CONFIG ##########
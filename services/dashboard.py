@@ -15,7 +15,9 @@ import plotly.graph_objects as go
 from datetime import datetime, timezone
 import numpy as np
 import yaml
-from gsa_loader import load_gsa_file
+from functools import partial
+from gsa_loader import load_gsa_file, load_gsa_workspace, workspace_cache
+from volume_monitor import VolumeSnapshot, get_volume_monitor
 from constants import INTERSECT_DASHBOARD_CONFIG
 
 
@@ -32,7 +34,7 @@ class AppState:
         # config
         self.config = {'volumes': {'bragg_volume': '', 'transition_volume': '', 'andie_volume': '','scientist_cloud_volume': ''}, 'scan_period': {
             'bragg_scan_period': 2, 'transition_scan_period': 2, 'select_scan_period': 45
-        }}
+        }, 'cache': {'sidecar': False, 'memory_budget_mb': 512}}
         # data
         self.files = defaultdict()
         self.bragg_data = defaultdict()
@@ -40,6 +42,8 @@ class AppState:
         self.id_campaign = ""
         self.id_transition = ""
         self.id_andie = ""
+        self.transition_temp = np.empty(0)
+        self.transition_ylist = np.empty((0, 0))
         self.lastUpdate = datetime.now().strftime("%B %d, %Y %I:%M:%S %p UTC")
         self.next_temperature = 0.00
         self.next_temperature_timestamp = 0
@@ -134,61 +138,26 @@ class AppState:
 
         self._render_information_content()
 
-    def _load_stateful_files(self) -> DefaultDict[str, str]:
-        """load files as timestamp/filename pair from the scientist cloud volume"""
-        stateful_files = defaultdict()
-        files = os.listdir(self.config['volumes']['scientist_cloud_volume'])
-        if files:
-            for file in files:
-                if file.endswith(".gsa"):
-                    epoch = int(file.split("_")[0])
-                    human_readable_timestamp = datetime.fromtimestamp(
-                        epoch, tz=timezone.utc
-                    ).strftime("%B %d, %Y %I:%M:%S %p UTC")
-                    stateful_files[human_readable_timestamp] = file
-
-        return stateful_files
-
-    def _load_workspace(self, filename: str):
-        """load a gsas file into a workspace"""
-        self.bragg_data = load_gsa_file(os.path.join(self.config['volumes']['bragg_volume'], filename))
-
-    def _render_transition_content(self):
-        """renders the transition plot using transition volume"""
-        temp, ylist, traces = [], [], []
-        maxY = 0.0
-        with open(os.path.join(self.config['volumes']['transition_volume'], f"{self.id_campaign}_transition.txt")) as f:
-            for line in f:
-                data_tuple = line.strip().split(",")
-                temp.append(float(data_tuple[1]))
-                ylist.append([float(y) for y in data_tuple[2:]])
-                maxY = max(maxY, max(ylist[-1]))
-
-        # create traces
-        N = len(ylist[0])
-        for i in range(N):
-            traces.append(
-                go.Scatter(
-                    mode="lines+markers",
-                    x=temp,
-                    y=[row[i] for row in ylist],
-                    name=f"Peak {i+1}",
-                    marker=dict(size=np.linspace(5, 35, len(temp))),
-                    line=dict(width=1),
-                )
-            )
-        # ANDiE trace
-        traces.append(
-            go.Scatter(
-                mode="lines",
-                x=[self.next_temperature, self.next_temperature],
-                y=[0.0, maxY],
-                name="Next Temperature",
-                line=dict(width=3, color="green", dash="dash"),
-            )
+    def _load_gsa(self, path: str) -> DefaultDict:
+        """
+        load a gsas file through the workspace cache shared by all sessions,
+        and through its binary sidecar if enabled in the configuration
+        """
+        loader = load_gsa_workspace if self.config.get('cache', {}).get('sidecar', False) else load_gsa_file
+        return workspace_cache.get(path, loader)
+
+    def _render_transition_traces(self, traces: List[go.Scatter], maxY: float):
+        """renders the transition plot from the traces of its peaks, they are not modified"""
+        # ANDiE trace, the only trace modified by the session
+        andie_trace = go.Scatter(
+            mode="lines",
+            x=[self.next_temperature, self.next_temperature],
+            y=[0.0, maxY],
+            name="Next Temperature",
+            line=dict(width=3, color="green", dash="dash"),
         )
         # patching transition plot
-        self.transition_data_dict["data"] = traces
+        self.transition_data_dict["data"] = traces + [andie_trace]
         self.transition_data_dict["layout"].title.text = f"Campaign: {self.id_campaign}"
         self.transition_plot.object = self.transition_data_dict
 
@@ -218,6 +187,7 @@ class AppState:
 
     def _render_information_content(self):
         """renders information content for the information tab"""
+        cache_stats = workspace_cache.stats()
         self.information_md.object = f"""
         <style>
         .field {{
@@ -248,68 +218,44 @@ class AppState:
             <div class="field">Bragg Plot Update Cycle: {self.config['scan_period']['bragg_scan_period']}s </div>
             <div class="field">Transition Plot Update Cycle: {self.config['scan_period']['transition_scan_period']}s </div>
             <div class="field">Stateful Plot Update Cycle: {self.config['scan_period']['select_scan_period']}s </div>
+            <div class="field">Volume Updates: {self.config.get('watch', {}).get('mode', 'poll')}</div>
+            <div class="field">Workspace Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses,
+                {cache_stats['evictions']} evictions ({cache_stats['nbytes'] / 2**20:.1f}/{cache_stats['max_bytes'] / 2**20:.0f} MB)</div>
         </div>
         """
 
-    def _render_bragg_plot(self):
-        """renders a gsas workspace in the bragg plot and by bank tabs"""
-        if self.current_bragg_file != "":
-            self.lastUpdate = datetime.now().strftime("%B %d, %Y %I:%M:%S %p UTC")
-            # patching header
-            self.all_banks_header_md.object = f"""
-            <div style="border: 4px solid #00662c; padding: 8px; background-color: #e0f7e0; display: inline-block;
-                border-radius: 15px; font-size: 18px; font-family: Arial, sans-serif;">
-            🔴 <strong>Live:</strong> {self.lastUpdate}
-            </div>
-            """
-
-            traces, self.maxX, self.maxY = [], 0.0, 0.0
-            self.bragg_data_by_bank.clear()
-
-            for wksp_index, arr in self.bragg_data.items():
-                scatter_line = go.Scatter(
-                    x=arr[0],
-                    y=arr[1],
-                    name=f"Bank {wksp_index}",
-                    line=dict(width=2),
-                )
-                # setting plot limits
-                self.minX = min(self.minX, np.min(arr[0]))
-                self.maxX = max(self.maxX, np.max(arr[0]))
-                self.minY = min(self.minX, np.min(arr[1]))
-                self.maxY = max(self.maxY, np.max(arr[1]))
-
-                # patching individual bank plot
-                self.bragg_data_by_bank.append(
-                    pn.pane.Plotly(dict(
-                        data=scatter_line,
-                        layout=go.Layout(
-                            title=dict(text=f"Bank {wksp_index}", font=dict(size=26, weight="bold")),
-                            xaxis=dict(title=dict(text="d-Spacing", font=dict(size=22)), tickfont=dict(size=18)),
-                            yaxis=dict(title=dict(text="Intensity", font=dict(size=22)), tickfont=dict(size=18)),)
-                    ), sizing_mode='stretch_width'))
-
-                traces.append(scatter_line)
-
-            self.by_bank_plot.objects = self.bragg_data_by_bank
-            # setting slider limits
-            self.xlim_slider.start = self.minX
-            self.xlim_slider.end = self.xlim_slider.value = self.maxX
-            self.ylim_slider.start = self.minY
-            self.ylim_slider.end = self.ylim_slider.value = self.maxY
-            # patching bragg data plot
-            self.bragg_data_dict["data"] = traces
-            self.bragg_data_dict["layout"].xaxis.range = [0, self.maxX]
-            self.bragg_data_dict["layout"].yaxis.range = [0, 80]
-            self.bragg_data_dict["layout"].title.text = self.current_bragg_file.split(".")[0]
-            self.bragg_data_plot.object = self.bragg_data_dict
-
-    def _render_bragg_content(self, name):
-        """
-        renders the bragg content by loading the workspace and rendering the plot
+    def _render_bragg_figures(self, traces: List[go.Scatter], figures: List[dict], limits: tuple):
+        """renders the traces and figures of a gsas workspace, they are not modified"""
+        self.lastUpdate = datetime.now().strftime("%B %d, %Y %I:%M:%S %p UTC")
+        # patching header
+        self.all_banks_header_md.object = f"""
+        <div style="border: 4px solid #00662c; padding: 8px; background-color: #e0f7e0; display: inline-block;
+            border-radius: 15px; font-size: 18px; font-family: Arial, sans-serif;">
+        🔴 <strong>Live:</strong> {self.lastUpdate}
+        </div>
         """
-        self._load_workspace(name)
-        self._render_bragg_plot()
+
+        # setting plot limits
+        self.minX = min(self.minX, limits[0])
+        self.maxX = limits[1]
+        self.minY = min(self.minX, limits[2])
+        self.maxY = limits[3]
+
+        # patching individual bank plots
+        self.bragg_data_by_bank.clear()
+        self.bragg_data_by_bank.extend(pn.pane.Plotly(figure, sizing_mode='stretch_width') for figure in figures)
+        self.by_bank_plot.objects = self.bragg_data_by_bank
+        # setting slider limits
+        self.xlim_slider.start = self.minX
+        self.xlim_slider.end = self.xlim_slider.value = self.maxX
+        self.ylim_slider.start = self.minY
+        self.ylim_slider.end = self.ylim_slider.value = self.maxY
+        # patching bragg data plot
+        self.bragg_data_dict["data"] = traces
+        self.bragg_data_dict["layout"].xaxis.range = [0, self.maxX]
+        self.bragg_data_dict["layout"].yaxis.range = [0, 80]
+        self.bragg_data_dict["layout"].title.text = self.current_bragg_file.split(".")[0]
+        self.bragg_data_plot.object = self.bragg_data_dict
 
     def gen_figure_data(self, wksp_index: int, name: str):
         bank_data = dict(
@@ -338,7 +284,7 @@ class AppState:
         """updates the stateful plot when the select widget is triggered"""
         if file != "":
             traces = []
-            bragg_data = load_gsa_file(os.path.join(self.config['volumes']['scientist_cloud_volume'], file))
+            bragg_data = self._load_gsa(os.path.join(self.config['volumes']['scientist_cloud_volume'], file))
             for wksp_index, data in bragg_data.items():
                 name = file.split(".")[0]
                 traces.append(
@@ -368,141 +314,37 @@ class AppState:
             )
             self.stateful_plot.object = self.stateful_plot_data_dict
 
-    def _last_id(self, plot: str, filename: str) -> str:
-        """
-        Returns the id of the last record of a given file.
-
-        Args:
-            plot(str): the plot that we want the last record (TRANSITION or ANDIE).
-            filename(str): the name of the file to retrieve the record from.
-
-        Returns:
-            str: the id of the last record
-        """
-
-        match plot:
-            case "TRANSITION":
-                transition_state_path = os.path.join(self.config['volumes']['transition_volume'], filename)
-                if not os.path.exists(transition_state_path):
-                    return self.id_transition
-
-                last_measure = ""
-                with open(transition_state_path, 'r') as f:
-                    for record in f:
-                        last_measure = record
-
-                return last_measure.strip().split(",")[0] if last_measure != "" else self.id_transition
-
-            case "ANDIE":
-                andie_state_path = os.path.join(self.config['volumes']['andie_volume'], "andie.txt")
-                if not os.path.exists(andie_state_path):
-                    return self.id_andie
-
-                last_measure = ""
-                with open(andie_state_path, 'r') as f:
-                    for record in f:
-                        last_measure = record
-
-                if last_measure == "":
-                    return self.id_andie
-
-                last_measure = last_measure.strip().split(",")
-                id, timestamp, next_temp = last_measure[1], int(last_measure[2]), float(last_measure[3])
-                self.next_temperature_timestamp = timestamp
-                self.next_temperature = next_temp
-                return id
-
-            case _:
-                return ""
-
-    # POLLING METHODS
-    def poll_bragg(self):
-        """
-        Polling method to check, update, and render the bragg plot on an interval.
-        """
-        # Check volume and return if does not exist
-        if not os.path.isdir(self.config['volumes']['bragg_volume']):
-            logger.warning(f"Bragg volume: {self.config['volumes']['bragg_volume']} not found, skipping checks...")
-            return
-
-        files = os.listdir(self.config['volumes']['bragg_volume'])
-        if files:
-            files = sorted(files, key=lambda f: int(f.split("_")[0]))
-            if files[-1] != self.current_bragg_file:
-                self.current_bragg_file = files[-1]
-                self._render_bragg_content(files[-1])
-
-            if len(files) > 1:
-                for i in range(len(files) - 1):
-                    filepath = os.path.join(self.config['volumes']['bragg_volume'], files[i])
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-
-    def poll_transition(self):
-        """
-        Polling method to check, update, and render the transition plot on an interval.
-        """
-        # Check volume and return if does not exist
-        if not os.path.isdir(self.config['volumes']['transition_volume']):
-            logger.warning(f"Transition volume: {self.config['volumes']['transition_volume']} not found, skipping checks...")
-            return
-
-        files = os.listdir(self.config['volumes']['transition_volume'])
-        if files:
-            if len(files) > 1:
-                # change campaign id
-                # NOTE: No support for parallel campaign (sequential only)
-                prev_cid = self.id_campaign
-                for file in files:
-                    cid = file.split("_")[0]
-                    if cid != self.id_campaign:
-                        self.id_campaign = cid
-                os.remove(os.path.join(self.config['volumes']['transition_volume'], f"{prev_cid}_transition.txt"))
-            else:
-                self.id_campaign = files[0].split("_")[0]
-
-            id = self._last_id("TRANSITION", f"{self.id_campaign}_transition.txt")
-            if id != self.id_transition:
-                self.id_transition = id
-                self._render_transition_content()
-
-    def poll_andie(self):
+    def apply_snapshot(self, snapshot: VolumeSnapshot):
         """
-        Polling method to check, update, and render the ANDiE prediction on the transition plot on an interval.
+        Renders the changes of a snapshot of the volumes scanned by the shared volume monitor.
+        Only the plots whose data changed since the last snapshot are patched, with the traces
+        and figures built once by the monitor for all the sessions.
         """
-        # Check volume and return if does not exist
-        if not os.path.isdir(self.config['volumes']['andie_volume']):
-            logger.warning(f"ANDiE volume: {self.config['volumes']['andie_volume']} not found, skipping checks...")
-            return
-
-        id = self._last_id("ANDIE", "andie.txt")
-        if id != self.id_andie:
-            self.id_andie = id
+        if snapshot.bragg_file != "" and snapshot.bragg_file != self.current_bragg_file:
+            self.current_bragg_file = snapshot.bragg_file
+            self.bragg_data = snapshot.bragg_data
+            self._render_bragg_figures(snapshot.bragg_traces, snapshot.bank_figures, snapshot.bragg_limits)
+
+        if len(snapshot.transition_temp) != 0 and (snapshot.id_campaign, snapshot.id_transition) != (
+            self.id_campaign,
+            self.id_transition,
+        ):
+            self.id_campaign = snapshot.id_campaign
+            self.id_transition = snapshot.id_transition
+            self.transition_temp = snapshot.transition_temp
+            self.transition_ylist = snapshot.transition_ylist
+            self._render_transition_traces(snapshot.transition_traces, snapshot.transition_max)
+
+        if snapshot.id_andie != self.id_andie:
+            self.id_andie = snapshot.id_andie
+            self.next_temperature = snapshot.next_temperature
+            self.next_temperature_timestamp = snapshot.next_temperature_timestamp
             self._render_andie_content()
 
-    def poll_transition_and_andie(self):
-        """
-        Synchronize polling of transition and ANDiE prediction on the same interval.
-        """
-        # update both to render ANDiE next temperature in transition
-        self.poll_transition()
-        self.poll_andie()
-
-    def poll_stateful_files(self):
-        """
-        Polling method to check, update, and render the files available on the
-        scientist cloud volume as options to a select widget on the controls on an interval.
-        """
-        # Check volume and return if does not exist
-        if not os.path.isdir(self.config['volumes']['scientist_cloud_volume']):
-            logger.warning(
-                f"Scientist cloud volume: {self.config['volumes']['scientist_cloud_volume']} not found, "
-                "skipping load stateful files..."
-            )
-            return
-
-        self.files = self._load_stateful_files()
-        self.select_bragg_file.options = self.files
+        if snapshot.stateful_files is not None and snapshot.stateful_files != self.files:
+            self.files = snapshot.stateful_files
+            self.select_bragg_file.options = self.files
+            self._render_information_content()
 
 
 def App() -> MaterialTemplate:
@@ -518,6 +360,7 @@ def App() -> MaterialTemplate:
         raise FileNotFoundError(f"could to initialize dashboard, configuration path does not exists {e}")
 
     logger.info("initialized dashboard configuration")
+    workspace_cache.resize(int(app_state.config.get('cache', {}).get('memory_budget_mb', 512) * 1024 * 1024))
 
     bragg_data_tab = pn.Column(
         pn.Row(app_state.all_banks_header_md),
@@ -573,18 +416,19 @@ def App() -> MaterialTemplate:
         collapsed_sidebar=True
     )
 
-    # Listen to changes in volumes in an interval which use polling methods
-    pn.state.add_periodic_callback(
-        callback=app_state.poll_bragg, period=app_state.config['scan_period']['bragg_scan_period'] * 1000
-    )
-    pn.state.add_periodic_callback(
-        callback=app_state.poll_transition_and_andie,
-        period=app_state.config['scan_period']['transition_scan_period'] * 1000,
-    )
+    # Listen to changes in volumes through the volume monitor shared by all the sessions,
+    # the updates are applied on the document of this session
+    doc = pn.state.curdoc
 
-    pn.state.add_periodic_callback(
-        callback=app_state.poll_stateful_files, period=app_state.config['scan_period']['select_scan_period']* 1000
-    )
+    def push_snapshot(snapshot: VolumeSnapshot):
+        if doc is not None and doc.session_context is not None:
+            doc.add_next_tick_callback(partial(app_state.apply_snapshot, snapshot))
+        else:
+            app_state.apply_snapshot(snapshot)
+
+    monitor = get_volume_monitor(app_state.config)
+    monitor.subscribe(push_snapshot)
+    pn.state.on_session_destroyed(lambda _: monitor.unsubscribe(push_snapshot))
     return template
 
 
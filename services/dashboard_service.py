@@ -5,27 +5,33 @@ License: BSD-3
 Description: The service component. It uses intersect-sdk to get all messages from the broker.
 """
 
+import atexit
 import logging
 import os
 import base64
+import hashlib
 import time
-from typing import List
+from typing import Any, Dict, List, Literal, Optional
 import yaml
 import uuid
 from constants import (
     INTERSECT_SERVICE_CONFIG,
     INTERSECT_DASHBOARD_CONFIG,
 )
+from record_reader import count_lines, read_last_line
+from volume_writer import WriterQueue, temp_path, discard
+from payload_codec import iter_decoded
 
 from intersect_sdk import (
     IntersectBaseCapabilityImplementation,
     IntersectService,
     IntersectServiceConfig,
+    default_intersect_lifecycle_loop,
     intersect_message,
     intersect_status,
 )
 from typing_extensions import Annotated
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -41,10 +47,86 @@ class FileType(BaseModel):
     Attributes:
         filename (str): The name of the file.
         file (SerializedBase64): The file content serialized in Base64 format.
+            Version 1 senders encode the content themselves, so file holds the Base64 text.
+            Version 2 senders put the raw content in file, it is decoded once when the message is validated.
+        encoding (str): The compression of the file content: none, gzip or zstd (default = none).
+        version (int): The version of the message (default = 1).
     """
 
     filename: str
     file: SerializedBase64
+    encoding: Literal["none", "gzip", "zstd"] = "none"
+    version: Literal[1, 2] = 1
+
+    @model_validator(mode="before")
+    @classmethod
+    def decode_file(cls, data: Any) -> Any:
+        """decodes the Base64 text of the file of a version 2 message received as JSON"""
+        if isinstance(data, dict) and data.get("version") == 2 and isinstance(data.get("file"), str):
+            data = {**data, "file": base64.b64decode(data["file"], validate=True)}
+        return data
+
+    def content(self) -> bytes:
+        """returns the (possibly compressed) content of the file"""
+        return self.file if self.version == 2 else base64.decodebytes(self.file)
+
+
+class BraggUploadBegin(BaseModel):
+    """
+    Represents the start (or the resumption) of a chunked upload of a gsa file.
+
+    Attributes:
+        filename (str): The name of the file.
+        size (int): The size of the file in bytes.
+        checksum (str): The SHA-256 hex digest of the file.
+    """
+
+    filename: str
+    size: int
+    checksum: str
+
+
+class BraggChunk(BaseModel):
+    """
+    Represents a chunk of a gsa file.
+
+    Attributes:
+        upload_id (str): The id of the upload, as returned by begin_bragg_upload.
+        offset (int): The offset of the chunk in the file.
+        data (SerializedBase64): The content of the chunk serialized in Base64 format.
+    """
+
+    upload_id: str
+    offset: int
+    data: SerializedBase64
+
+
+class BraggUploadCommit(BaseModel):
+    """
+    Represents the end of a chunked upload of a gsa file.
+
+    Attributes:
+        upload_id (str): The id of the upload, as returned by begin_bragg_upload.
+    """
+
+    upload_id: str
+
+
+class BraggUploadStatus(BaseModel):
+    """
+    Represents the state of a chunked upload of a gsa file.
+
+    Attributes:
+        upload_id (str): The id of the upload.
+        offset (int): The number of bytes received, the offset of the next chunk to send.
+        size (int): The size of the file in bytes.
+        committed (bool): True once the file is written to the volumes.
+    """
+
+    upload_id: str
+    offset: int
+    size: int
+    committed: bool = False
 
 
 class TransitionData(BaseModel):
@@ -62,6 +144,17 @@ class TransitionData(BaseModel):
     ylist: List[float]
 
 
+class TransitionDataBatch(BaseModel):
+    """
+    Represents a batch of transition data records.
+
+    Attributes:
+        records (List[TransitionData]): The transition data records, possibly of several campaigns, in order.
+    """
+
+    records: List[TransitionData]
+
+
 class NextTemperature(BaseModel):
     """
     Represents the next temperature record (ANDiE prediction).
@@ -77,6 +170,23 @@ class NextTemperature(BaseModel):
     timestamp: int
 
 
+class CampaignStatus(BaseModel):
+    """
+    Represents the state of a campaign.
+
+    Attributes:
+        id (str): The campaign id.
+        width (int): The number of peaks (d-Spacing) of every record of the campaign.
+        temp (float): The temperature of the last record.
+        records (int): The number of records of the campaign, 0 if the campaign is unknown.
+    """
+
+    id: str
+    width: int = 0
+    temp: float = 0
+    records: int = 0
+
+
 class FinishCampaignMsg(BaseModel):
     """
     Represents a message to signal the end of a campaign
@@ -93,10 +203,12 @@ def last_record(volume: str, cid: str) -> TransitionData:
     Retrieve the last record from the transition file for the given cid.
 
     Args:
+        volume (str): The volume with the transition files.
         cid (str): The campaign ID.
 
     Returns:
-        TransitionData: The last transition data record.
+        TransitionData: The last transition data record, its id is the campaign ID.
+            The id is empty if the campaign has no records yet.
 
     Raises:
         OSError: If an error occurs while retrieving the last record on the file.
@@ -106,44 +218,246 @@ def last_record(volume: str, cid: str) -> TransitionData:
     if not os.path.exists(transition_state_path):
         return tdata
 
-    with open(transition_state_path, "rb") as f:
-        try:
-            f.seek(-2, os.SEEK_END)
-            while f.read(1) != b"\n":
-                f.seek(-2, os.SEEK_CUR)
-        except OSError:
-            raise OSError(
-                f"file: {transition_state_path} failed to process the last record"
-            )
-
-        last_measure = f.readline().decode()
-        if last_measure == "":
-            return tdata
+    try:
+        last_measure = read_last_line(transition_state_path, complete=True)
+    except OSError:
+        raise OSError(
+            f"file: {transition_state_path} failed to process the last record"
+        )
 
-        fields = last_measure.split(",")
-        tdata.id = fields[0]
-        tdata.temp = float(fields[1])
-        tdata.ylist = [float(y) for y in fields[2:]]
+    if last_measure == "":
         return tdata
 
+    # the first field is the id of the record, the file itself belongs to the campaign
+    fields = last_measure.split(",")
+    tdata.id = cid
+    tdata.temp = float(fields[1])
+    tdata.ylist = [float(y) for y in fields[2:]]
+    return tdata
+
 
-def isValidTransitionRecord(prev: TransitionData, new: TransitionData) -> bool:
+def isValidTransitionRecord(prev: CampaignStatus, new: TransitionData) -> bool:
     """
     Checks if a received TransitionData is a valid record.
 
     Args:
-        prev(TransitionData): The latest TransitionData record.
+        prev(CampaignStatus): The state of the campaign of the record.
         new(TransitionData): The received TransitionData record.
 
     Returns:
         bool: True, if it is a valid record. Otherwise, False.
 
     """
-    return prev.id == new.id and len(prev.ylist) == len(new.ylist)
+    return prev.id == new.id and prev.width == len(new.ylist)
+
+
+class CampaignIndex:
+    """
+    In-memory index of the active campaigns, so validating a transition record is a dict lookup.
+    It is rebuilt from the transition volume at startup, kept up to date by the writes of the
+    service, and a campaign is evicted when it finishes.
+
+    Attributes:
+        volume (str): The volume with the transition files.
+    """
+
+    def __init__(self, volume: str):
+        self.volume = volume
+        self._campaigns: Dict[str, CampaignStatus] = {}
+
+    def __len__(self) -> int:
+        return len(self._campaigns)
+
+    def __contains__(self, cid: str) -> bool:
+        return cid in self._campaigns
+
+    def rebuild(self) -> int:
+        """
+        Rebuilds the index from the transition files of the volume.
+
+        Returns:
+            int: The number of campaigns in the index.
+        """
+        self._campaigns.clear()
+        if not os.path.isdir(self.volume):
+            return 0
+        for file in os.listdir(self.volume):
+            if file.endswith("_transition.txt"):
+                self.load(file[: -len("_transition.txt")])
+        return len(self)
+
+    def get(self, cid: str) -> Optional[CampaignStatus]:
+        """returns the state of a campaign, None if it is not in the index"""
+        return self._campaigns.get(cid)
+
+    def load(self, cid: str) -> Optional[CampaignStatus]:
+        """
+        Reads the state of a campaign from its transition file and adds it to the index.
+
+        Args:
+            cid (str): The campaign ID.
+
+        Returns:
+            Optional[CampaignStatus]: The state of the campaign, None if it has no records.
+        """
+        tdata = last_record(self.volume, cid)
+        if tdata.id == "":
+            return None
+        status = CampaignStatus(
+            id=cid,
+            width=len(tdata.ylist),
+            temp=tdata.temp,
+            records=count_lines(os.path.join(self.volume, f"{cid}_transition.txt")),
+        )
+        self._campaigns[cid] = status
+        return status
+
+    def add(self, record: TransitionData):
+        """updates the state of the campaign of a record that was written"""
+        status = self._campaigns.get(record.id)
+        if status is None:
+            self._campaigns[record.id] = CampaignStatus(
+                id=record.id, width=len(record.ylist), temp=record.temp, records=1
+            )
+        else:
+            status.temp = record.temp
+            status.records += 1
+
+    def evict(self, cid: str) -> bool:
+        """removes a campaign from the index, returns True if it was in it"""
+        return self._campaigns.pop(cid, None) is not None
+
+
+class BraggUploads:
+    """
+    The chunked uploads of gsa files in progress. The chunks are appended to a <upload_id>.part
+    file of the upload directory, whose size is the offset to resume from, so an interrupted
+    upload resumes after a restart of the client or of the service.
+
+    Attributes:
+        directory (str): The directory of the partial files (on the filesystem of the bragg volume).
+        max_age (float): The seconds after which an abandoned upload is removed.
+    """
+
+    def __init__(self, directory: str, max_age: float = 24 * 3600):
+        self.directory = directory
+        self.max_age = max_age
+        self._uploads: Dict[str, BraggUploadBegin] = {}
+        self._offsets: Dict[str, int] = {}
+
+    @staticmethod
+    def upload_id(begin: BraggUploadBegin) -> str:
+        """returns the id of an upload, the same for every attempt to upload the same file"""
+        key = f"{begin.filename}:{begin.size}:{begin.checksum}"
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def part_path(self, upload_id: str) -> str:
+        """returns the path of the partial file of an upload"""
+        return os.path.join(self.directory, f"{upload_id}.part")
+
+    def begin(self, begin: BraggUploadBegin) -> BraggUploadStatus:
+        """
+        Registers an upload, or returns the offset to resume it from. The offset is the size of
+        the partial file, the chunks accounted for but not written (a failed write) are sent again.
+        """
+        self.remove_abandoned()
+        upload_id = self.upload_id(begin)
+        if upload_id not in self._uploads:
+            os.makedirs(self.directory, exist_ok=True)
+            self._uploads[upload_id] = begin
+        self._offsets[upload_id] = self._written(upload_id)
+        return self.status(upload_id)
+
+    def _written(self, upload_id: str) -> int:
+        """returns the size of the partial file of an upload"""
+        path = self.part_path(upload_id)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def get(self, upload_id: str) -> BraggUploadBegin:
+        """
+        Returns the upload registered with upload_id.
+
+        Raises:
+            KeyError: If there is no such upload, it has to be begun (again).
+        """
+        if upload_id not in self._uploads:
+            raise KeyError(f"unknown upload {upload_id}, begin it again to resume it")
+        return self._uploads[upload_id]
+
+    def status(self, upload_id: str) -> BraggUploadStatus:
+        """returns the state of an upload"""
+        return BraggUploadStatus(
+            upload_id=upload_id,
+            offset=self._offsets[upload_id],
+            size=self.get(upload_id).size,
+        )
+
+    def advance(self, chunk: BraggChunk, nbytes: int) -> bool:
+        """
+        Accounts for a chunk, which is only accepted at the current offset of its upload.
+
+        Returns:
+            bool: True if the chunk has to be written.
+        """
+        upload = self.get(chunk.upload_id)
+        offset = self._offsets[chunk.upload_id]
+        if chunk.offset != offset or offset + nbytes > upload.size:
+            return False
+        self._offsets[chunk.upload_id] = offset + nbytes
+        return True
+
+    def verify(self, upload_id: str, block_size: int = 1024 * 1024):
+        """
+        Checks the size and the checksum of a complete partial file, reading it in blocks.
+
+        Raises:
+            ValueError: If the file is incomplete, the upload resumes from the end of the partial
+                file, or if its checksum does not match, the partial file is removed.
+        """
+        upload = self.get(upload_id)
+        path = self.part_path(upload_id)
+        size = self._written(upload_id)
+        if size != upload.size:
+            # the offset counts the chunks when they are queued, some of them may not be written
+            self._offsets[upload_id] = size
+            raise ValueError(f"upload {upload_id} of {upload.filename} has {size} of {upload.size} bytes")
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        if digest.hexdigest() != upload.checksum.lower():
+            self.discard(upload_id)
+            os.remove(path)
+            raise ValueError(f"upload {upload_id} of {upload.filename} does not match its checksum")
+
+    def discard(self, upload_id: str):
+        """forgets an upload"""
+        self._uploads.pop(upload_id, None)
+        self._offsets.pop(upload_id, None)
+
+    def remove_abandoned(self):
+        """removes the partial files not written to for max_age seconds"""
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        for file in os.listdir(self.directory):
+            path = os.path.join(self.directory, file)
+            try:
+                if file.endswith(".part") and now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+                    self.discard(file[: -len(".part")])
+            except FileNotFoundError:
+                continue
 
 
 class DashboardCapability(IntersectBaseCapabilityImplementation):
-    """DashboardCapability"""
+    """
+    DashboardCapability
+
+    The message handlers validate the messages and enqueue their writes to the volumes in a
+    WriterQueue, they only block on the disk while the queue is full.
+    """
 
     intersect_sdk_capability_name = "NSDFDashboard"
 
@@ -160,12 +474,52 @@ class DashboardCapability(IntersectBaseCapabilityImplementation):
             logger.error(
                 f"could not initialize dashboard service, configuration path of dashboard does not exists: {e}"
             )
+        self.campaigns = CampaignIndex(
+            self.config.get("volumes", {}).get("transition_volume", "")
+        )
+        logger.info(f"indexed {self.campaigns.rebuild()} campaigns")
+        # the receive time of the first bragg file since no campaign was active, the start of the
+        # next campaign: its first measurements arrive before its first transition record
+        self.idle_bragg_time: Optional[int] = None
+
+        # the files are written on a background thread, drained when the service exits
+        persistence = self.config.get("persistence", {})
+        writer = self.config.get("writer", {})
+        self.writer = WriterQueue(
+            max_bytes=int(writer.get("max_queued_mb", 64) * 1024 * 1024),
+            flush_bytes=int(writer.get("flush_kb", 256) * 1024),
+            flush_interval=writer.get("flush_interval", 0.05),
+            durability=persistence.get("durability", "none"),
+            mode=persistence.get("mode", "link"),
+        )
+        atexit.register(self.writer.close)
+
+        upload = self.config.get("upload", {})
+        self.uploads = BraggUploads(
+            os.path.join(
+                self.config.get("volumes", {}).get("bragg_volume", ""), ".uploads"
+            ),
+            max_age=upload.get("max_age_hours", 24) * 3600,
+        )
 
     @intersect_status()
     def status(self) -> str:
         """Basic status function which returns a hard-coded string."""
         return "Up"
 
+    @intersect_message()
+    def get_campaign_status(self, cid: str) -> CampaignStatus:
+        """
+        Endpoint to return the state of an active campaign, from memory
+
+        Args:
+            cid(str): the campaign id
+
+        Returns:
+            CampaignStatus: the state of the campaign, with no records if the campaign is not active
+        """
+        return self.campaigns.get(cid) or CampaignStatus(id=cid)
+
     @intersect_message()
     def get_bragg_data(self, bragg_file: FileType) -> None:
         """
@@ -177,8 +531,12 @@ class DashboardCapability(IntersectBaseCapabilityImplementation):
         Side Effects:
             - Creates the bragg volume, if it does not exists
             - Creates the scientist cloud volume, if it does not exists
+            - decompresses a compressed file into the uploads directory of the bragg volume
             - writes the file to the ephemeral bragg volume (stateless)
-            - writes the file to the scientist cloud volume (stateful)
+            - links (or copies) the file to the scientist cloud volume (stateful)
+
+        Raises:
+            ValueError: If the encoding of the file is not available or its content is not valid.
         """
         timestamp = int(time.time())
         path = os.path.join(
@@ -189,13 +547,99 @@ class DashboardCapability(IntersectBaseCapabilityImplementation):
             f"{timestamp}_{bragg_file.filename}",
         )
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        os.makedirs(os.path.dirname(storage_path), exist_ok=True)
+        self._bragg_received(timestamp)
+        data = bragg_file.content()
+        if bragg_file.encoding == "none":
+            self.writer.persist(data, [path, storage_path])
+            return
+
+        # decompressed block by block into a temporary file here, so an invalid content is
+        # reported to the sender, only the move into the volumes is done by the writer
+        os.makedirs(self.uploads.directory, exist_ok=True)
+        tmp = temp_path(os.path.join(self.uploads.directory, bragg_file.filename))
+        try:
+            with open(tmp, "wb") as f:
+                for block in iter_decoded(data, bragg_file.encoding):
+                    f.write(block)
+        except BaseException:
+            # the temporary file does not exist if it could not be created
+            discard(tmp)
+            raise
+        self.writer.place(tmp, [path, storage_path])
+
+    @intersect_message()
+    def begin_bragg_upload(self, begin: BraggUploadBegin) -> BraggUploadStatus:
+        """
+        Endpoint to begin, or resume, a chunked upload of a .gsa file with bragg data
+
+        Args:
+            begin(BraggUploadBegin): the name, size and checksum of the gsa file
+
+        Returns:
+            BraggUploadStatus: the id of the upload and the offset of the first chunk to send
+        """
+        # the chunks still queued are part of the offset
+        self.writer.flush()
+        return self.uploads.begin(begin)
+
+    @intersect_message()
+    def upload_bragg_chunk(self, chunk: BraggChunk) -> BraggUploadStatus:
+        """
+        Endpoint to receive a chunk of a .gsa file. A chunk which is not at the offset of the
+        upload is ignored, the returned offset tells the client what to send next.
+
+        Args:
+            chunk(BraggChunk): the chunk of the gsa file
+
+        Returns:
+            BraggUploadStatus: the offset of the next chunk to send
+
+        Side Effects:
+            - appends the chunk to the partial file of the upload
+        """
+        data = base64.decodebytes(chunk.data)
+        if self.uploads.advance(chunk, len(data)):
+            self.writer.append(self.uploads.part_path(chunk.upload_id), data)
+        return self.uploads.status(chunk.upload_id)
+
+    @intersect_message()
+    def commit_bragg_upload(self, commit: BraggUploadCommit) -> BraggUploadStatus:
+        """
+        Endpoint to end a chunked upload of a .gsa file with bragg data
+
+        Args:
+            commit(BraggUploadCommit): the upload to end
+
+        Returns:
+            BraggUploadStatus: the committed upload
+
+        Raises:
+            ValueError: If the file is incomplete or does not match its checksum,
+                an upload with a wrong checksum has to be begun again from the start.
+
+        Side Effects:
+            - moves the file to the ephemeral bragg volume (stateless)
+            - links (or copies) the file to the scientist cloud volume (stateful)
+        """
+        upload = self.uploads.get(commit.upload_id)
+        self.writer.flush()
+        self.uploads.verify(commit.upload_id)
 
-        with open(path, "wb") as f, open(storage_path, "wb") as s:
-            bytes_data = base64.decodebytes(bragg_file.file)
-            f.write(bytes_data)
-            s.write(bytes_data)
+        status = self.uploads.status(commit.upload_id)
+        timestamp = int(time.time())
+        self._bragg_received(timestamp)
+        self.writer.place(
+            self.uploads.part_path(commit.upload_id),
+            [
+                os.path.join(
+                    self.config["volumes"][volume], f"{timestamp}_{upload.filename}"
+                )
+                for volume in ["bragg_volume", "scientist_cloud_volume"]
+            ],
+        )
+        self.uploads.discard(commit.upload_id)
+        status.committed = True
+        return status
 
     @intersect_message()
     def get_transition_data_single(self, transition_data: TransitionData) -> None:
@@ -210,33 +654,107 @@ class DashboardCapability(IntersectBaseCapabilityImplementation):
             - Creates the scientist cloud volume, if it does not exists
             - writes the file to the ephemeral transition volume (stateless)
             - writes the file to the scientist cloud volume (stateful)
+            - writes the <cid>.start file of a new campaign to the scientist cloud volume
         """
 
-        file_id = f"{transition_data.id}_transition.txt"
-        ephemeral_vol_path = os.path.join(
-            self.config["volumes"]["transition_volume"], file_id
-        )
-        storage_path = os.path.join(
-            self.config["volumes"]["scientist_cloud_volume"], file_id
-        )
-        os.makedirs(os.path.dirname(ephemeral_vol_path), exist_ok=True)
-        os.makedirs(os.path.dirname(storage_path), exist_ok=True)
-
         try:
-            latest_record = last_record(
-                self.config["volumes"]["transition_volume"], file_id
-            )
-            ylist = ",".join(map(str, transition_data.ylist))
-
-            if latest_record.id == "" or isValidTransitionRecord(
-                latest_record, transition_data
-            ):
-                with open(ephemeral_vol_path, "a") as e, open(storage_path, "a") as s:
-                    e.write(f"{uuid.uuid4()},{transition_data.temp},{ylist}\n")
-                    s.write(f"{uuid.uuid4()},{transition_data.temp},{ylist}\n")
+            if self._accept_transition(transition_data):
+                record = self._transition_record(transition_data)
+                for path in self._transition_paths(transition_data.id):
+                    self.writer.append(path, record)
         except Exception as e:
             logger.error(e)
 
+    @intersect_message()
+    def get_transition_data_batch(self, batch: TransitionDataBatch) -> int:
+        """
+        Endpoint to return several points of the transition plots at once
+
+        Args:
+            batch(TransitionDataBatch): the transition data to process, in order
+
+        Returns:
+            int: the number of valid records, which are written
+
+        Side Effects:
+            - Creates the transition volume, if it does not exists
+            - Creates the scientist cloud volume, if it does not exists
+            - appends the valid records of every campaign to its file in the ephemeral transition
+              volume (stateless) and in the scientist cloud volume (stateful), with one write per file
+            - writes the <cid>.start file of a new campaign to the scientist cloud volume
+        """
+        records: Dict[str, List[bytes]] = {}
+        accepted = 0
+        for transition_data in batch.records:
+            try:
+                if self._accept_transition(transition_data):
+                    records.setdefault(transition_data.id, []).append(
+                        self._transition_record(transition_data)
+                    )
+                    accepted += 1
+            except Exception as e:
+                logger.error(e)
+
+        for cid, lines in records.items():
+            data = b"".join(lines)
+            for path in self._transition_paths(cid):
+                self.writer.append(path, data)
+
+        if accepted != len(batch.records):
+            logger.warning(
+                f"skipped {len(batch.records) - accepted} of {len(batch.records)} invalid transition records"
+            )
+        return accepted
+
+    def _accept_transition(self, transition_data: TransitionData) -> bool:
+        """validates a transition record against its campaign and adds it to the campaign index"""
+        # campaigns missing from the index are new or were finished before,
+        # their file is read once the records still in the writer queue are written
+        status = self.campaigns.get(transition_data.id)
+        if status is None:
+            self.writer.flush()
+            status = self.campaigns.load(transition_data.id)
+            if status is None:
+                self._start_campaign(transition_data.id)
+
+        if status is None or isValidTransitionRecord(status, transition_data):
+            self.campaigns.add(transition_data)
+            return True
+        return False
+
+    def _bragg_received(self, timestamp: int):
+        """remembers the receive time of a bragg file received while no campaign is active"""
+        if len(self.campaigns) == 0 and self.idle_bragg_time is None:
+            self.idle_bragg_time = timestamp
+
+    def _start_campaign(self, cid: str):
+        """
+        Records the start of a new campaign in <cid>.start in the scientist cloud volume, on the
+        clock of the names of the bragg files: the receive time of the first bragg file since
+        no campaign was active, or now. The storage service bundles the bragg files received
+        from its start to its end.
+        """
+        start = self.idle_bragg_time if self.idle_bragg_time is not None else int(time.time())
+        self.idle_bragg_time = None
+        path = os.path.join(self.config["volumes"]["scientist_cloud_volume"], f"{cid}.start")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.writer.write(path, str(start).encode())
+
+    def _transition_paths(self, cid: str) -> List[str]:
+        """returns the paths of the transition file of a campaign, creating the volumes"""
+        paths = []
+        for volume in ["transition_volume", "scientist_cloud_volume"]:
+            os.makedirs(self.config["volumes"][volume], exist_ok=True)
+            paths.append(
+                os.path.join(self.config["volumes"][volume], f"{cid}_transition.txt")
+            )
+        return paths
+
+    def _transition_record(self, transition_data: TransitionData) -> bytes:
+        """returns the line of a transition record"""
+        ylist = ",".join(map(str, transition_data.ylist))
+        return f"{uuid.uuid4()},{transition_data.temp},{ylist}\n".encode()
+
     @intersect_message()
     def get_next_temperature(self, next_temperature: NextTemperature) -> None:
         """
@@ -261,13 +779,14 @@ class DashboardCapability(IntersectBaseCapabilityImplementation):
         os.makedirs(os.path.dirname(ephemeral_vol_path), exist_ok=True)
         os.makedirs(os.path.dirname(storage_path), exist_ok=True)
 
-        with open(ephemeral_vol_path, "a") as e, open(storage_path, "a") as s:
-            e.write(
-                f"{next_temperature.id},{uuid.uuid4()},{next_temperature.timestamp},{next_temperature.data}\n"
-            )
-            s.write(
-                f"{next_temperature.id},{uuid.uuid4()},{next_temperature.timestamp},{next_temperature.data}\n"
-            )
+        self.writer.append(
+            ephemeral_vol_path,
+            f"{next_temperature.id},{uuid.uuid4()},{next_temperature.timestamp},{next_temperature.data}\n".encode(),
+        )
+        self.writer.append(
+            storage_path,
+            f"{next_temperature.id},{uuid.uuid4()},{next_temperature.timestamp},{next_temperature.data}\n".encode(),
+        )
 
     @intersect_message()
     def finish_campaign(self, msg: FinishCampaignMsg) -> None:
@@ -279,6 +798,7 @@ class DashboardCapability(IntersectBaseCapabilityImplementation):
 
         Side Effects:
             - writes the .done file to the scientist cloud volume to signal the end of a campaign
+            - evicts the campaign from the in-memory campaign index
 
         """
         storage_path = os.path.join(
@@ -286,8 +806,9 @@ class DashboardCapability(IntersectBaseCapabilityImplementation):
         )
         os.makedirs(os.path.dirname(storage_path), exist_ok=True)
 
-        with open(storage_path, "w") as s:
-            s.write(" ")
+        # enqueued after the last records of the campaign, so they are written before the .done
+        self.writer.write(storage_path, b" ")
+        self.campaigns.evict(msg.id)
 
 
 def dashboard_service():
@@ -312,4 +833,5 @@ def dashboard_service():
 
 if __name__ == "__main__":
     svc = dashboard_service()
-    svc.startup()
+    # shuts the service down on SIGTERM/SIGINT, so the writer queue is drained at exit
+    default_intersect_lifecycle_loop(svc)
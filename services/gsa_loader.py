@@ -6,10 +6,18 @@ Description: The gsa file parser
 """
 
 import numpy as np
+import os
 import re
-from collections import defaultdict
-from typing import DefaultDict
+import json
+import struct
+import argparse
+import itertools
+import threading
+from collections import defaultdict, OrderedDict
+from typing import Callable, DefaultDict, Optional, Union
+from numpy.typing import ArrayLike, DTypeLike
 import logging
+from volume_writer import temp_path
 
 
 logger = logging.getLogger(__name__)
@@ -17,11 +25,28 @@ logging.basicConfig(
     filename="nsdf-intersect-dashboard.log", encoding="utf-8", level=logging.INFO
 )
 
+# header lines of a GSAS file, everything else is FXYE data
+_HEADER_LINE = re.compile(rb"\n(?:#|BANK|Monitor|Sample)[^\n]*")
 
-def tof_to_d(tof: float, difc: float, difa: float = 0.0, tzero: float = 0.0) -> float:
+# binary sidecars of parsed workspaces, kept in a hidden directory next to the gsa files
+SIDECAR_DIR = ".gsa_cache"
+SIDECAR_EXTENSION = ".sidecar"
+_SIDECAR_MAGIC = b"NSDFGSC1"
+_SIDECAR_ALIGNMENT = 64
+
+
+def tof_to_d(
+    tof: ArrayLike,
+    difc: ArrayLike,
+    difa: ArrayLike = 0.0,
+    tzero: ArrayLike = 0.0,
+    errors: str = "raise",
+) -> Union[float, np.ndarray]:
     """
     Calculates d-spacing from time-of-flight.
     NOTE: This is a python version of the Mantd C++ code in the reference.
+    The conversion is vectorized, tof can be a whole bank and difc, difa and tzero
+    are broadcast against it (scalars or per-bin values).
 
 
     References
@@ -30,50 +55,74 @@ def tof_to_d(tof: float, difc: float, difa: float = 0.0, tzero: float = 0.0) ->
         see https://en.wikipedia.org/wiki/Quadratic_formula#Square_root_in_the_denominator
 
     Attributes:
-        tof (float): Time-of-flight
-        difc (float): DIFC value
-        difa (float): DIFA value (default = 0.)
-        tzero (float): TZERO value (default = 0.)
+        tof (ArrayLike): Time-of-flight
+        difc (ArrayLike): DIFC value
+        difa (ArrayLike): DIFA value (default = 0.)
+        tzero (ArrayLike): TZERO value (default = 0.)
+        errors (str): "raise" to raise once for the array if any bin has no positive real root,
+            "nan" to set those bins to NaN (default = "raise").
 
     Returns:
-        d-spacing value.
+        d-spacing value, or array of d-spacing values when any of the inputs is an array.
+
+    Raises:
+        ValueError: If a bin cannot be converted and errors is "raise".
     """
+    tof, difc, difa, tzero = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (tof, difc, difa, tzero))
+    )
     negative_constant_term = tof - tzero
+    d = np.empty(tof.shape, dtype=np.float64)
+
+    linear = difa == 0.0
+    d[linear] = negative_constant_term[linear] / difc[linear]
 
-    if difa == 0.0:
-        return negative_constant_term / difc
+    quadratic = ~linear
+    if quadratic.any():
+        invalid = np.zeros(tof.shape, dtype=bool)
 
-    if tzero > tof:
-        if difa > 0.0:
-            err_msg = (
-                "Cannot convert to d spacing because ",
-                "tzero > time-of-flight and difa is positive. ",
-                "Quadratic doesn't have a positive root",
+        # tzero > time-of-flight and difa is positive, quadratic doesn't have a positive root
+        no_positive_root = quadratic & (tzero > tof) & (difa > 0.0)
+        if errors == "raise" and no_positive_root.any():
+            raise ValueError(
+                "Cannot convert to d spacing because tzero > time-of-flight and difa is positive. "
+                "Quadratic doesn't have a positive root"
             )
-            raise ValueError(err_msg)
-
-    # citardauq formula hides non-zero root if tof==tzero
-    # which means that the constantTerm == 0
-    if tof == tzero:
-        if difa < 0.0:
-            return -difc / difa
-        else:
-            return 0.0
-
-    # general citarqauq equation
-    sqrt_term = 1.0 + 4.0 * difa * negative_constant_term / (difc * difc)
-    if sqrt_term < 0.0:
-        err_msg = "Cannot convert to d spacing. Quadratic doesn't have real roots"
-        raise ValueError(err_msg)
-
-    # pick smallest positive root. Since difc is positive it just depends on sign of constantTerm
-    # NOTE: constantTerm is generally negative
-    if negative_constant_term < 0:
-        # single positive root
-        return negative_constant_term / (0.5 * difc * (1 - np.sqrt(sqrt_term)))
-    else:
-        # two positive roots. pick most negative denominator to get smallest root
-        return negative_constant_term / (0.5 * difc * (1 + np.sqrt(sqrt_term)))
+        invalid |= no_positive_root
+
+        # citardauq formula hides non-zero root if tof==tzero
+        # which means that the constantTerm == 0
+        at_tzero = quadratic & ~invalid & (tof == tzero)
+        d[at_tzero] = np.where(
+            difa[at_tzero] < 0.0, -difc[at_tzero] / difa[at_tzero], 0.0
+        )
+
+        # general citarqauq equation
+        general = quadratic & ~invalid & ~at_tzero
+        sqrt_term = np.ones(tof.shape, dtype=np.float64)
+        sqrt_term[general] = 1.0 + 4.0 * difa[general] * negative_constant_term[
+            general
+        ] / (difc[general] * difc[general])
+        no_real_root = general & (sqrt_term < 0.0)
+        if errors == "raise" and no_real_root.any():
+            raise ValueError(
+                "Cannot convert to d spacing. Quadratic doesn't have real roots"
+            )
+        invalid |= no_real_root
+        general &= ~no_real_root
+
+        # pick smallest positive root. Since difc is positive it just depends on sign of constantTerm
+        # NOTE: constantTerm is generally negative, which gives a single positive root,
+        # otherwise there are two positive roots and the most negative denominator gives the smallest
+        root = np.sqrt(sqrt_term[general])
+        d[general] = negative_constant_term[general] / (
+            0.5
+            * difc[general]
+            * np.where(negative_constant_term[general] < 0, 1 - root, 1 + root)
+        )
+        d[invalid] = np.nan
+
+    return float(d) if d.ndim == 0 else d
 
 
 def parse_bank_info(line: str) -> list[float]:
@@ -98,49 +147,411 @@ def parse_bank_info(line: str) -> list[float]:
     return length, two_theta, difc
 
 
+def parse_bank_calibration(line: str) -> tuple[float, float]:
+    """
+    Get the DIFA and TZERO diffractometer constants from GSAS file, if the header provides them.
+
+    Attributes:
+        line (str): Line to parse from GSAS file.
+
+    Returns:
+        Tuple of DIFA and TZERO, 0.0 for the values that are not in the line.
+    """
+    number = r"([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)"
+    difa_match = re.search(r"DIFA\s+" + number, line)
+    tzero_match = re.search(r"T?ZERO\s+" + number, line)
+
+    difa = float(difa_match.group(1)) if difa_match else 0.0
+    tzero = float(tzero_match.group(1)) if tzero_match else 0.0
+    return difa, tzero
+
+
+def _parse_fxye_block(block: bytes) -> np.ndarray:
+    """
+    Decodes a block of FXYE data lines into an array of (tof, counts, errors).
+
+    Attributes:
+        block (bytes): The data lines between two header lines.
+
+    Returns:
+        Array of shape (3, n).
+    """
+    block = block.strip()
+    if len(block) == 0:
+        return np.empty((3, 0), dtype=np.float64)
+
+    # fast path: every line is a (tof, counts, errors) triplet. With the newlines kept as "|"
+    # tokens the block is then "v v v | v v v | ... v v v": every fourth token is a separator,
+    # which is checked without splitting the lines in Python (the total alone does not tell a
+    # line with two values followed by a line with four)
+    tokens = block.replace(b"\n", b" | ").split()
+    newlines = block.count(b"\n")
+    if len(tokens) == 4 * newlines + 3 and tokens[3::4].count(b"|") == newlines:
+        del tokens[3::4]
+        try:
+            return np.array(tokens, dtype=np.float64).reshape(-1, 3).T
+        except ValueError:
+            pass
+
+    # slow path: keep only the lines with three values
+    rows = [line.split() for line in block.splitlines()]
+    values = [float(v) for row in rows if len(row) == 3 for v in row]
+    return np.array(values, dtype=np.float64).reshape(-1, 3).T
+
+
+def _stack_blocks(blocks: list[np.ndarray]) -> np.ndarray:
+    """stacks the decoded blocks of a bank into a single contiguous (3, n) array"""
+    if len(blocks) == 0:
+        return np.empty((3, 0), dtype=np.float64)
+    return np.concatenate(blocks, axis=1)
+
+
 def load_gsa_file(path: str) -> DefaultDict:
+    """
+    Loads a GSAS (FXYE) file into a workspace.
+    The header lines are located in a single pass over the file, and the data
+    lines between them are decoded as a single array operation per block.
+
+    Attributes:
+        path (str): Path to the GSAS file.
+
+    Returns:
+        Dictionary of bank id to an array of shape (3, n) with d-spacing, counts and errors.
+    """
     gsa_data = defaultdict()
     try:
-        with open(path, "r") as f:
-            tof, counts, errors = [], [], []
-            bank_id = -1
-
-            data = f.readlines()
-            temp_difc = 1.0
-            for line in data:
-                if (
-                    line.startswith("#")
-                    or line.startswith("BANK")
-                    or line.startswith("Monitor")
-                    or line.startswith("Sample")
-                ):
-                    if "DIFC" in line:
-                        temp_length, temp_two_theta, temp_difc = parse_bank_info(line)
-
-                    if line.startswith("BANK"):
-                        id = line.split()[1]
-                        if bank_id == -1:
-                            bank_id = int(id)
-                            continue
-                        gsa_data[bank_id] = np.asarray([tof, counts, errors])
-
-                        bank_id = int(id)
-                        tof.clear()
-                        counts.clear()
-                        errors.clear()
-                    continue
-                else:
-                    _data = line.split()
-                    if len(_data) == 3:
-                        d_value = tof_to_d(float(_data[0]), difc=temp_difc)
-                        tof.append(d_value)
-                        counts.append(float(_data[1]))
-                        errors.append(float(_data[2]))
+        with open(path, "rb") as f:
+            # leading newline so that the first line is matched as a header too
+            data = b"\n" + f.read()
+
+        bank_id = -1
+        temp_difc, temp_difa, temp_tzero = 1.0, 0.0, 0.0
+        blocks = []
+        pos = 0
+        for header in itertools.chain(_HEADER_LINE.finditer(data), [None]):
+            end = header.start() if header is not None else len(data)
+            block = _parse_fxye_block(data[pos:end])
+            if block.shape[1] != 0:
+                block[0] = tof_to_d(block[0], temp_difc, temp_difa, temp_tzero)
+                blocks.append(block)
+
+            if header is None:
+                break
+
+            line = header.group()[1:].decode()
+            if "DIFC" in line:
+                temp_length, temp_two_theta, temp_difc = parse_bank_info(line)
+                temp_difa, temp_tzero = parse_bank_calibration(line)
+
+            if line.startswith("BANK"):
+                id = int(line.split()[1])
+                if bank_id != -1:
+                    gsa_data[bank_id] = _stack_blocks(blocks)
+                    blocks = []
+                bank_id = id
+            pos = header.end()
 
         # final bank
-        if len(tof) != 0:
-            gsa_data[bank_id] = np.asarray([tof, counts, errors])
+        if len(blocks) != 0:
+            gsa_data[bank_id] = _stack_blocks(blocks)
     except Exception as e:
         logger.error(f"failed to load gsa workspace {path}: {e}")
 
     return gsa_data
+
+
+def sidecar_path(path: str) -> str:
+    """returns the path of the binary sidecar for a gsa file"""
+    return os.path.join(
+        os.path.dirname(path), SIDECAR_DIR, os.path.basename(path) + SIDECAR_EXTENSION
+    )
+
+
+def write_sidecar(
+    path: str,
+    gsa_data: DefaultDict,
+    dtype: DTypeLike = np.float64,
+    stat: Optional[os.stat_result] = None,
+) -> str:
+    """
+    Writes the binary sidecar of a parsed gsa file.
+    The sidecar is a fixed magic, the length of a JSON header (banks, dtype and the size/mtime
+    of the source file), the header, and the (3, n) arrays of every bank stored contiguously.
+
+    Attributes:
+        path (str): Path to the source GSAS file.
+        gsa_data (DefaultDict): The parsed workspace of the file.
+        dtype (DTypeLike): The dtype to store the arrays with (default = float64).
+        stat (os.stat_result): The stat of the source taken before it was parsed (default = stat now).
+
+    Returns:
+        The path to the sidecar.
+    """
+    stat = stat if stat is not None else os.stat(path)
+    dtype = np.dtype(dtype).newbyteorder("<")
+    header = json.dumps(
+        {
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "dtype": dtype.str,
+            "banks": [[int(bank_id), int(arr.shape[1])] for bank_id, arr in gsa_data.items()],
+        }
+    ).encode()
+    prefix_size = len(_SIDECAR_MAGIC) + 8
+    padding = -(prefix_size + len(header)) % _SIDECAR_ALIGNMENT
+    header += b" " * padding
+
+    output = sidecar_path(path)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    # unique per writer, the sessions of the dashboard can write the same sidecar concurrently
+    tmp_output = temp_path(output)
+    with open(tmp_output, "wb") as f:
+        f.write(_SIDECAR_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for arr in gsa_data.values():
+            f.write(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+    os.replace(tmp_output, output)
+    return output
+
+
+def read_sidecar(path: str) -> Optional[DefaultDict]:
+    """
+    Memory-maps the binary sidecar of a gsa file.
+
+    Attributes:
+        path (str): Path to the source GSAS file.
+
+    Returns:
+        The workspace with read-only memory-mapped arrays,
+        or None if there is no sidecar or it is stale (source size/mtime changed).
+    """
+    output = sidecar_path(path)
+    try:
+        stat = os.stat(path)
+        with open(output, "rb") as f:
+            if f.read(len(_SIDECAR_MAGIC)) != _SIDECAR_MAGIC:
+                return None
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+    except (OSError, ValueError, struct.error):
+        return None
+
+    if (
+        header["source_size"] != stat.st_size
+        or header["source_mtime_ns"] != stat.st_mtime_ns
+    ):
+        return None
+
+    gsa_data = defaultdict()
+    total = sum(3 * n for _, n in header["banks"])
+    if total == 0:
+        for bank_id, _ in header["banks"]:
+            gsa_data[bank_id] = np.empty((3, 0), dtype=header["dtype"])
+        return gsa_data
+
+    offset = len(_SIDECAR_MAGIC) + 8 + header_size
+    try:
+        values = np.memmap(
+            output, dtype=header["dtype"], mode="r", offset=offset, shape=(total,)
+        )
+    except (OSError, ValueError):
+        return None
+
+    start = 0
+    for bank_id, n in header["banks"]:
+        gsa_data[bank_id] = values[start : start + 3 * n].reshape(3, n)
+        start += 3 * n
+    return gsa_data
+
+
+def remove_sidecar(path: str):
+    """removes the binary sidecar of a gsa file, if any"""
+    try:
+        os.remove(sidecar_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def load_gsa_workspace(path: str, dtype: DTypeLike = np.float64) -> DefaultDict:
+    """
+    Loads a GSAS file through its binary sidecar.
+    A fresh sidecar is memory-mapped, otherwise the text is parsed and the sidecar is (re)written.
+
+    Attributes:
+        path (str): Path to the GSAS file.
+        dtype (DTypeLike): The dtype to store new sidecars with (default = float64).
+
+    Returns:
+        Dictionary of bank id to an array of shape (3, n) with d-spacing, counts and errors.
+    """
+    gsa_data = read_sidecar(path)
+    if gsa_data is not None:
+        return gsa_data
+
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        logger.error(f"failed to load gsa workspace {path}: {e}")
+        return defaultdict()
+
+    gsa_data = load_gsa_file(path)
+    if len(gsa_data) != 0:
+        try:
+            write_sidecar(path, gsa_data, dtype, stat)
+        except OSError as e:
+            logger.warning(f"could not write sidecar for {path}: {e}")
+    return gsa_data
+
+
+def build_sidecars(directory: str, dtype: DTypeLike = np.float64) -> int:
+    """
+    Pre-builds the binary sidecars of every gsa file in a directory.
+
+    Attributes:
+        directory (str): The directory with the gsa files (e.g. the scientist cloud volume).
+        dtype (DTypeLike): The dtype to store the sidecars with (default = float64).
+
+    Returns:
+        The number of sidecars that were built, fresh sidecars are skipped.
+    """
+    built = 0
+    for file in sorted(os.listdir(directory)):
+        path = os.path.join(directory, file)
+        if not file.endswith(".gsa") or read_sidecar(path) is not None:
+            continue
+
+        stat = os.stat(path)
+        gsa_data = load_gsa_file(path)
+        if len(gsa_data) != 0:
+            write_sidecar(path, gsa_data, dtype, stat)
+            built += 1
+    return built
+
+
+class WorkspaceCache:
+    """
+    Process-wide LRU cache of parsed gsa workspaces, shared by every dashboard session.
+    Entries are keyed by (path, mtime, size) so a rewritten file is never served stale,
+    and the least recently used workspaces are evicted once the memory budget is exceeded.
+
+    Attributes:
+        max_bytes (int): The memory budget of the cached arrays, 0 disables the cache.
+        hits (int): Number of loads served from the cache.
+        misses (int): Number of loads that had to parse the file.
+        evictions (int): Number of workspaces evicted to stay within the budget.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = 0
+        self._entries: OrderedDict[tuple, DefaultDict] = OrderedDict()
+        self._keys: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, path: str, loader: Callable[[str], DefaultDict] = load_gsa_file
+    ) -> DefaultDict:
+        """
+        Returns the workspace of a gsa file, loading it on a miss.
+
+        Attributes:
+            path (str): Path to the GSAS file.
+            loader (Callable): Function that loads the workspace on a miss (default = load_gsa_file).
+
+        Returns:
+            The workspace, its arrays are shared between sessions and read-only.
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return loader(path)
+
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            gsa_data = self._entries.get(key)
+            if gsa_data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return gsa_data
+            self.misses += 1
+
+        gsa_data = loader(path)
+        if len(gsa_data) == 0:
+            return gsa_data
+
+        for arr in gsa_data.values():
+            arr.flags.writeable = False
+        nbytes = sum(arr.nbytes for arr in gsa_data.values())
+
+        with self._lock:
+            # drop the previous version of the file
+            previous = self._keys.pop(path, None)
+            if previous is not None and previous in self._entries:
+                self._nbytes -= self._workspace_nbytes(self._entries.pop(previous))
+
+            if nbytes > self.max_bytes:
+                return gsa_data
+
+            self._entries[key] = gsa_data
+            self._keys[path] = key
+            self._nbytes += nbytes
+            self._evict()
+        return gsa_data
+
+    def resize(self, max_bytes: int):
+        """sets the memory budget, evicting workspaces if needed"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """removes every workspace from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._nbytes = 0
+
+    def stats(self) -> dict:
+        """returns the counters of the cache for monitoring"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "nbytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _evict(self):
+        """evicts the least recently used workspaces until the cache fits its budget"""
+        while self._nbytes > self.max_bytes and self._entries:
+            (path, _, _), gsa_data = self._entries.popitem(last=False)
+            self._keys.pop(path, None)
+            self._nbytes -= self._workspace_nbytes(gsa_data)
+            self.evictions += 1
+
+    @staticmethod
+    def _workspace_nbytes(gsa_data: DefaultDict) -> int:
+        return sum(arr.nbytes for arr in gsa_data.values())
+
+
+# shared by all the sessions of the dashboard process
+workspace_cache = WorkspaceCache()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-build binary sidecars of gsa files")
+    parser.add_argument("directory", help="directory with the gsa files")
+    parser.add_argument(
+        "--float32", action="store_true", default=False, help="store sidecars as float32"
+    )
+    args = parser.parse_args()
+
+    n = build_sidecars(args.directory, np.float32 if args.float32 else np.float64)
+    print(f"built {n} sidecars in {args.directory}")
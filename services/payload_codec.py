@@ -0,0 +1,88 @@
+"""
+File: payload_codec.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Compression of the files sent in the messages (gzip, and zstd if zstandard is installed).
+"""
+
+import io
+import zlib
+import gzip
+from typing import Iterator
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+ENCODINGS = ("none", "gzip", "zstd")
+
+
+def _check(encoding: str):
+    if encoding not in ENCODINGS:
+        raise ValueError(f"unknown encoding: {encoding}")
+    if encoding == "zstd" and zstandard is None:
+        raise ValueError("the zstd encoding requires the zstandard package")
+
+
+def encode(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses data with an encoding.
+
+    Args:
+        data (bytes): The content of the file.
+        encoding (str): One of ENCODINGS.
+
+    Returns:
+        bytes: The compressed content.
+
+    Raises:
+        ValueError: If the encoding is unknown or not available.
+    """
+    _check(encoding)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def iter_decoded(data: bytes, encoding: str, block_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Decompresses data in blocks of at most block_size bytes, so the whole decompressed content
+    is never in memory.
+
+    Args:
+        data (bytes): The compressed content.
+        encoding (str): One of ENCODINGS.
+        block_size (int): The maximum size of the decompressed blocks (default = 1 MiB).
+
+    Yields:
+        bytes: The blocks of the decompressed content.
+
+    Raises:
+        ValueError: If the encoding is unknown or not available, or data is not valid.
+    """
+    _check(encoding)
+    if encoding == "none":
+        for start in range(0, len(data), block_size):
+            yield data[start : start + block_size]
+    elif encoding == "gzip":
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            while data:
+                yield decompressor.decompress(data, block_size)
+                data = decompressor.unconsumed_tail
+            yield decompressor.flush()
+        except zlib.error as e:
+            raise ValueError(f"invalid gzip content: {e}")
+        if not decompressor.eof:
+            raise ValueError("truncated gzip content")
+    else:
+        try:
+            yield from zstandard.ZstdDecompressor().read_to_iter(
+                io.BytesIO(data), write_size=block_size
+            )
+        except zstandard.ZstdError as e:
+            raise ValueError(f"invalid zstd content: {e}")
@@ -0,0 +1,197 @@
+"""
+File: record_reader.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Readers for the append-only record files (transition and ANDiE files).
+"""
+
+import os
+import logging
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_last_line(path: str, block_size: int = 8192, complete: bool = False) -> str:
+    """
+    Returns the last line of a file by reading fixed-size blocks backwards from its end,
+    so the cost depends on the length of the last line and not on the size of the file.
+    Like iterating over the lines of the file, the last line keeps its newline if it has one.
+
+    Args:
+        path (str): The path to the file.
+        block_size (int): The number of bytes read per seek (default = 8192).
+        complete (bool): If True, a last line without its newline (still being written) is
+            skipped and the line before it is returned (default = False).
+
+    Returns:
+        str: The last line, or an empty string if the file does not exist or is empty.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return ""
+
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        line = _last_line(f, end, block_size)
+        if complete and line and not line.endswith(b"\n"):
+            line = _last_line(f, end - len(line), block_size)
+        return line.decode()
+
+
+def _last_line(f, end: int, block_size: int) -> bytes:
+    """returns the last line of the first end bytes of a binary file"""
+    pos = end
+    data = b""
+    while pos > 0:
+        start = max(0, pos - block_size)
+        f.seek(start)
+        block = f.read(pos - start)
+        # the newline terminating the last line is part of it
+        limit = len(block) if data else len(block) - 1
+        data = block + data
+        pos = start
+        i = data.rfind(b"\n", 0, limit)
+        if i != -1:
+            return data[i + 1 :]
+    return data
+
+
+def count_lines(path: str, block_size: int = 1 << 20) -> int:
+    """
+    Counts the complete lines of a file, reading it in fixed-size blocks.
+
+    Args:
+        path (str): The path to the file.
+        block_size (int): The number of bytes read at a time (default = 1 MiB).
+
+    Returns:
+        int: The number of lines, 0 if the file does not exist.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+
+    with f:
+        return sum(block.count(b"\n") for block in iter(lambda: f.read(block_size), b""))
+
+
+class TransitionReader:
+    """
+    Incremental reader of the transition file of a campaign.
+    It remembers the byte offset after the last complete record, so a refresh only reads and
+    parses the records appended since the previous one. The temperatures and peaks are kept in
+    growable NumPy buffers, the arrays returned by temp and ylist are never modified afterwards.
+
+    Attributes:
+        path (str): The path to the <cid>_transition.txt file.
+        last_id (str): The id of the last record read, empty if there is none.
+    """
+
+    def __init__(self, path: str, capacity: int = 1024):
+        self.path = path
+        self.last_id = ""
+        self._capacity = capacity
+        self._reset()
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def temp(self) -> np.ndarray:
+        """the temperatures of the records, shape (n,)"""
+        return self._temp[: self._n]
+
+    @property
+    def ylist(self) -> np.ndarray:
+        """the peaks (d-Spacing) of the records, shape (n, number of peaks)"""
+        return self._ylist[: self._n]
+
+    def refresh(self) -> int:
+        """
+        Reads the records appended to the file since the last refresh.
+        The file is read again from the start if it was truncated or replaced.
+
+        Returns:
+            int: The number of new records.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return 0
+
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size == self._offset:
+                return 0
+
+            f.seek(self._offset)
+            chunk = f.read(stat.st_size - self._offset)
+
+        # a record without its newline yet is read on the next refresh
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+
+        ids, rows, malformed = [], [], 0
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            record = line.split(b",")
+            try:
+                values = [float(v) for v in record[1:]]
+            except ValueError:
+                malformed += 1
+                continue
+            if self._width is None and len(values) >= 1:
+                self._width = len(values) - 1
+                self._ylist = np.empty((len(self._temp), self._width), dtype=np.float64)
+            if len(values) - 1 != self._width:
+                malformed += 1
+                continue
+            ids.append(record[0])
+            rows.append(values)
+        # the malformed records are skipped, not read again
+        self._offset += end
+        if malformed:
+            logger.warning(
+                f"skipped {malformed} malformed records of {self.path} (not numbers, or a different number of peaks)"
+            )
+        if not rows:
+            return 0
+
+        values = np.array(rows, dtype=np.float64)
+        self._grow(self._n + len(rows))
+        self._temp[self._n : self._n + len(rows)] = values[:, 0]
+        self._ylist[self._n : self._n + len(rows)] = values[:, 1:]
+        self._n += len(rows)
+        self.last_id = ids[-1].decode()
+        return len(rows)
+
+    def _grow(self, size: int):
+        """grows the buffers (doubling) to hold at least size records"""
+        capacity = len(self._temp)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        temp = np.empty(capacity, dtype=np.float64)
+        temp[: self._n] = self._temp[: self._n]
+        ylist = np.empty((capacity, self._width), dtype=np.float64)
+        ylist[: self._n] = self._ylist[: self._n]
+        self._temp, self._ylist = temp, ylist
+
+    def _reset(self):
+        self.last_id = ""
+        self._inode = None
+        self._offset = 0
+        self._n = 0
+        self._width = None
+        self._temp = np.empty(self._capacity, dtype=np.float64)
+        self._ylist = np.empty((self._capacity, 0), dtype=np.float64)
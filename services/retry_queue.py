@@ -0,0 +1,196 @@
+"""
+File: retry_queue.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Persistent queue (SQLite) of the failed uploads, retried with exponential backoff.
+"""
+
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+import concurrent.futures
+from typing import Callable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetryQueue:
+    """
+    The uploads that failed, each retried after an exponentially growing delay with jitter
+    (base_delay, 2 * base_delay, ... up to max_delay). An upload still failing max_age seconds
+    after its first failure is given up: it stays in the queue without a next attempt, so it is
+    neither retried nor uploaded again by a scan, until clear_failed (or remove) removes it.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+        base_delay (float): The seconds before the first retry (default = 2).
+        max_delay (float): The maximum seconds between two retries (default = 600).
+        max_age (float): The seconds after which an upload is given up (default = 1 day).
+    """
+
+    def __init__(self, path: str, base_delay: float = 2, max_delay: float = 600, max_age: float = 24 * 3600):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_age = max_age
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # the uploads fail on the threads of the executor
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS retries (
+                key TEXT PRIMARY KEY,
+                local_path TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                next_at REAL,
+                first_failed_at REAL NOT NULL,
+                error TEXT
+            )
+            """
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM retries").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM retries WHERE key = ?", (key,)).fetchone() is not None
+
+    def delay(self, attempts: int) -> float:
+        """returns the seconds before the retry following a number of failed attempts"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        # half of the delay is random, so the uploads that failed together are not retried together
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def push(self, key: str, local_path: str, error: str = "", now: Optional[float] = None):
+        """
+        Records a failed attempt to upload a file, and schedules its next attempt.
+
+        Args:
+            key (str): The key of the file in the bucket.
+            local_path (str): The path of the file.
+            error (str): The error of the attempt.
+            now (Optional[float]): The time of the failure (default = time.time()).
+        """
+        now = time.time() if now is None else now
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            row = self._db.execute(
+                "SELECT attempts, first_failed_at FROM retries WHERE key = ?", (key,)
+            ).fetchone()
+            attempts, first_failed_at = (row[0] + 1, row[1]) if row else (1, now)
+            if now - first_failed_at >= self.max_age:
+                logger.error(f"gave up uploading {local_path} after {attempts} attempts: {error}")
+                next_at = None
+            else:
+                next_at = now + self.delay(attempts)
+            self._db.execute(
+                "INSERT OR REPLACE INTO retries VALUES (?, ?, ?, ?, ?, ?)",
+                (key, local_path, attempts, next_at, first_failed_at, error),
+            )
+
+    def remove(self, key: str):
+        """removes an upload from the queue, after its success or to retry it from scratch"""
+        with self._lock:
+            self._db.execute("DELETE FROM retries WHERE key = ?", (key,))
+
+    def due(self, now: Optional[float] = None) -> List[tuple]:
+        """returns the (key, local path) of the uploads to retry at now (default = time.time())"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._db.execute(
+                "SELECT key, local_path FROM retries WHERE next_at <= ? ORDER BY next_at", (now,)
+            ).fetchall()
+
+    def next_due(self) -> Optional[float]:
+        """returns the time of the next retry, None if there is none"""
+        with self._lock:
+            return self._db.execute("SELECT MIN(next_at) FROM retries").fetchone()[0]
+
+    def failed(self) -> List[tuple]:
+        """returns the (key, local path, attempts, error) of the uploads given up"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT key, local_path, attempts, error FROM retries WHERE next_at IS NULL"
+            ).fetchall()
+
+    def clear_failed(self) -> List[tuple]:
+        """
+        Removes the uploads given up, so the next scan uploads their files again.
+
+        Returns:
+            List[tuple]: The (key, local path, attempts, error) of the removed uploads.
+        """
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            failed = self._db.execute(
+                "SELECT key, local_path, attempts, error FROM retries WHERE next_at IS NULL"
+            ).fetchall()
+            self._db.execute("DELETE FROM retries WHERE next_at IS NULL")
+        return failed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RetryScheduler:
+    """
+    Submits the due uploads of a retry queue to an executor, on a thread of its own, so the
+    retries neither sleep on the threads of the executor nor wait for a scan.
+
+    Attributes:
+        queue (RetryQueue): The failed uploads.
+        submit (Callable): Submits the retry of (key, local path) and returns its future.
+        poll_interval (float): The maximum seconds between two checks of the queue (default = 1).
+    """
+
+    def __init__(self, queue: RetryQueue, submit: Callable, poll_interval: float = 1.0):
+        self.queue = queue
+        self.submit = submit
+        self.poll_interval = poll_interval
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run_pending(self) -> List[concurrent.futures.Future]:
+        """submits the due uploads that are not already being retried, and returns their futures"""
+        futures = []
+        for key, local_path in self.queue.due():
+            with self._lock:
+                if key in self._in_flight:
+                    continue
+                self._in_flight.add(key)
+            future = self.submit(key, local_path)
+            future.add_done_callback(lambda _, key=key: self._done(key))
+            futures.append(future)
+        return futures
+
+    def _done(self, key: str):
+        with self._lock:
+            self._in_flight.discard(key)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"could not schedule the retries: {e}")
+            # the uploads already due are being retried
+            timeout = (self.queue.next_due() or 0) - time.time()
+            self._stop.wait(timeout if 0 < timeout < self.poll_interval else self.poll_interval)
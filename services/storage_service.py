@@ -6,19 +6,28 @@ Description: The storage component exports data to the ScientistCloud
 and serves as the caching layer for stateful features.
 """
 
+import io
+import json
+import hashlib
 import pathlib
 import dotenv
 import os
+import zlib
 from botocore.client import Config
 from botocore.exceptions import ClientError
 import boto3
 import time
 import logging
-import subprocess
-import random
+import threading
 import concurrent.futures
 import yaml
-from constants import INTERSECT_STORAGE_CONFIG
+from typing import Dict, Iterable, Optional, Set
+from constants import INTERSECT_STORAGE_CONFIG, RETRY_FILE
+from upload_manifest import UploadManifest
+from transfer_limits import Transfer
+from retry_queue import RetryQueue, RetryScheduler
+from volume_watcher import InotifyWatcher, inotify_available
+from campaign_bundle import bundle_encoding, bundle_name, read_index, write_bundle
 
 
 logger = logging.getLogger(__name__)
@@ -26,9 +35,40 @@ logging.basicConfig(
     filename="nsdf-intersect-storage.log", encoding="utf-8", level=logging.INFO
 )
 
+# the uploads run in parallel on a thread pool, with one pooled connection per thread
+MAX_WORKERS = 32
 
-def Shell(cmd):
-    return subprocess.check_output(cmd, shell=True, text=True)
+# the manifest of the uploaded files, relative to the scientist cloud volume
+MANIFEST_PATH = ".storage_manifest.sqlite3"
+# the seconds between two reconciliations of the manifest with the listing of the bucket
+RECONCILE_PERIOD = 3600
+
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+# the names of the campaign bundles, <cid>_bundle.tar.zst or <cid>_bundle.tar.gz
+BUNDLE_SUFFIX = "_bundle.tar."
+
+_client = None
+_client_lock = threading.Lock()
+
+# the read-modify-write of the alias manifests of a run are serialized, on one of these locks
+_alias_locks = [threading.Lock() for _ in range(64)]
+
+# the transfer settings and limits of all the uploads, see configure_transfer
+_transfer = Transfer()
+
+
+def checksum(f, block_size: int = CHECKSUM_BLOCK_SIZE, digest=None) -> int:
+    """
+    returns the CRC32 of an open binary file, read in blocks from its current position, and
+    updates digest (e.g., a hashlib.sha256) with the same blocks if it is given
+    """
+    crc = 0
+    for block in iter(lambda: f.read(block_size), b""):
+        crc = zlib.crc32(block, crc)
+        if digest is not None:
+            digest.update(block)
+    return crc
 
 
 def check_if_key_exists(key: str) -> bool:
@@ -38,72 +78,566 @@ def check_if_key_exists(key: str) -> bool:
     Return
     bool: True if the key is in the bucket, False otherwise
     """
+    return get_object_size(key) is not None
+
+
+def get_object_size(key: str) -> Optional[int]:
+    """
+    Returns the size of the object of a key (one HEAD request), None if the key is not in
+    the bucket or could not be checked.
+    """
     if key == "":
-        return False
+        return None
 
-    s3 = get_bucket()
     try:
-        s3.Object(key).load()
-        return True
+        response = get_client().head_object(Bucket=get_bucket_name(), Key=key)
+        return response["ContentLength"]
     except ClientError as e:
         if e.response["Error"]["Code"] == "404":
-            return False
+            return None
         # other error
+        return None
+
+
+def needs_upload(
+    key: str, local_filepath: str, manifest: UploadManifest = None, head: bool = True
+) -> bool:
+    """
+    Checks if a file must be uploaded to a key. With a manifest, the files recorded with
+    their current size and modification time are skipped without any request, and a file
+    missing from the manifest is recorded if its key already holds an object of its size.
+    With head False, a file missing from the manifest is uploaded without checking its key,
+    e.g., a deduplicated file that is never stored under its own key.
+    """
+    if manifest is None:
+        return not check_if_key_exists(key)
+    try:
+        stat = os.stat(local_filepath)
+    except OSError:
+        return not check_if_key_exists(key)
+
+    if manifest.is_current(key, stat):
         return False
+    if key in manifest or not head:
+        # changed since its upload, or never stored under its own key
+        return True
+    if get_object_size(key) == stat.st_size:
+        manifest.record(key, stat.st_size, stat.st_mtime_ns)
+        return False
+    return True
+
 
+def upload_with_retry(
+    local_filepath, key, config, manifest=None, retries=None
+) -> str:
+    """
+    Uploads a file once, botocore retrying the transient errors of its requests. A failed
+    upload is pushed to the retry queue and retried later by the retry scheduler, so the
+    threads of the executor never sleep between attempts.
+
+    Returns:
+        str: The name of the uploaded file.
 
-def upload_with_retry(local_filepath, key, config, max_retries=5, delay=2) -> str:
-    retries = 0
-    bucket = get_bucket()
-    cksum = int(Shell(f"cksum {local_filepath}").split()[0].strip())
+    Raises:
+        Exception: If the upload failed.
+    """
+    transfer = _transfer
     filename = os.path.basename(local_filepath)
-    while retries < max_retries:
-        try:
-            bucket.upload_file(
-                local_filepath,
-                key,
-                ExtraArgs={"Metadata": {"checksum": str(cksum)}},
+    try:
+        size = os.path.getsize(local_filepath)
+        if size > transfer.in_memory_max:
+            # only the parts being sent of a file uploaded from disk are in memory
+            size = min(
+                size,
+                transfer.config.max_concurrency * transfer.config.multipart_chunksize,
             )
-            return filename
-        except Exception:
-            retries += 1
-            if retries < max_retries:
-                # Randomize the delay a bit to avoid retry storms
-                time.sleep(delay + random.uniform(0, 1))
+        with transfer.budget.reserve(size):
+            if deduplicated(config, key):
+                _upload_blob(local_filepath, key, config, manifest, transfer)
             else:
-                # write to retry.txt to upload later
-                path = os.path.join(
-                    config["volumes"]["scientist_cloud_volume"], "retry.txt"
-                )
-                os.makedirs(path, exist_ok=True)
-                with open(path, "a") as f:
-                    f.write(f"{os.path.basename(local_filepath)}\n")
-
-                raise Exception(
-                    f"Failed to upload {filename}, after {max_retries} retries"
-                )
+                _upload(local_filepath, key, manifest, transfer)
+    except FileNotFoundError:
+        # nothing to retry
+        if retries is not None:
+            retries.remove(key)
+        raise
+    except Exception as e:
+        if retries is not None:
+            retries.push(key, local_filepath, str(e))
+        raise Exception(f"Failed to upload {filename}: {e}")
 
+    if retries is not None:
+        retries.remove(key)
     return filename
 
 
-def get_bucket():
-    dotenv.load_dotenv()
-    endpoint_url = os.getenv("ENDPOINT_URL")
-    bucket_name = os.getenv("BUCKET_NAME")
-    aws_access_key_id = os.getenv("ACCESS_KEY_ID")
-    aws_secret_access_key = os.getenv("SECRET_ACCESS_KEY")
-
-    config = Config(signature_version="s3v4")
-    s3 = boto3.resource(
-        "s3",
-        endpoint_url=endpoint_url,
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        config=config,
-        verify=True,
+def _read(local_filepath, in_memory_max, digest=None):
+    """
+    Reads a file: returns its status, its content (None above in_memory_max, the file is then
+    read again to upload it from disk) and its CRC32, and updates digest with its content.
+    """
+    with open(local_filepath, "rb") as f:
+        # taken before the upload, a file modified during it is uploaded again by the next scan
+        stat = os.fstat(f.fileno())
+        if stat.st_size <= in_memory_max:
+            data = f.read()
+            cksum = zlib.crc32(data)
+            if digest is not None:
+                digest.update(data)
+        else:
+            data = None
+            cksum = checksum(f, digest=digest)
+    return stat, data, cksum
+
+
+def _put(local_filepath, data, key, metadata, transfer):
+    client = get_client()
+    extra_args = {"Metadata": metadata}
+    if data is None:
+        client.upload_file(
+            local_filepath,
+            get_bucket_name(),
+            key,
+            ExtraArgs=extra_args,
+            Callback=transfer.callback,
+            Config=transfer.config,
+        )
+    else:
+        client.upload_fileobj(
+            io.BytesIO(data),
+            get_bucket_name(),
+            key,
+            ExtraArgs=extra_args,
+            Callback=transfer.callback,
+            Config=transfer.config,
+        )
+
+
+def _upload(local_filepath, key, manifest, transfer):
+    stat, data, cksum = _read(local_filepath, transfer.in_memory_max)
+    metadata = {"checksum": str(cksum), "checksum-algorithm": "crc32"}
+    _put(local_filepath, data, key, metadata, transfer)
+    if manifest is not None:
+        manifest.record(key, stat.st_size, stat.st_mtime_ns, str(cksum))
+
+
+def deduplicated(config: dict, key: str) -> bool:
+    """checks if the content of a key is stored once per content, see _upload_blob"""
+    bragg = os.path.join(
+        config["sci_cloud"]["bucket_prefix"], config["sci_cloud"]["bragg_prefix"], ""
+    )
+    return config.get("dedup", {}).get("enabled", False) and key.startswith(bragg)
+
+
+def blob_key(config: dict, sha256: str) -> str:
+    """returns the content-addressed key of a content"""
+    return os.path.join(
+        config["sci_cloud"]["bucket_prefix"],
+        config["sci_cloud"].get("blob_prefix", "blobs"),
+        sha256,
+    )
+
+
+def alias_key(config: dict, name: str) -> str:
+    """returns the key of the alias manifest of the run of a gsa file, <timestamp>_<run>.gsa"""
+    run = pathlib.Path(name.split("_", 1)[-1]).stem
+    return os.path.join(
+        config["sci_cloud"]["bucket_prefix"],
+        config["sci_cloud"].get("alias_prefix", "aliases"),
+        f"{run}.json",
+    )
+
+
+def add_alias(config: dict, name: str, blob: str, sha256: str, size: int):
+    """
+    Adds a gsa file to the alias manifest of its run, a JSON object mapping the names the run
+    was received under to the blob of their content.
+    """
+    client = get_client()
+    key = alias_key(config, name)
+    with _alias_locks[hash(key) % len(_alias_locks)]:
+        try:
+            response = client.get_object(Bucket=get_bucket_name(), Key=key)
+            aliases = json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            aliases = {"run": name.split("_", 1)[-1], "aliases": {}}
+        aliases["aliases"][name] = {"blob": blob, "sha256": sha256, "size": size}
+        client.put_object(
+            Bucket=get_bucket_name(),
+            Key=key,
+            Body=json.dumps(aliases, indent=1).encode(),
+            ContentType="application/json",
+        )
+
+
+def _upload_blob(local_filepath, key, config, manifest, transfer):
+    """
+    Uploads the content of a gsa file once under its SHA-256 (the blob), and records its name
+    in the alias manifest of its run, so the same file received again under another timestamp
+    only costs the write of the alias manifest.
+    """
+    digest = hashlib.sha256()
+    stat, data, cksum = _read(local_filepath, transfer.in_memory_max, digest)
+    sha256 = digest.hexdigest()
+    blob = blob_key(config, sha256)
+
+    known = manifest is not None and manifest.get(blob) is not None
+    if not known and get_object_size(blob) != stat.st_size:
+        metadata = {
+            "checksum": str(cksum),
+            "checksum-algorithm": "crc32",
+            "sha256": sha256,
+        }
+        _put(local_filepath, data, blob, metadata, transfer)
+    elif not known:
+        logger.info(f"{os.path.basename(local_filepath)} is already stored as {blob}")
+    if manifest is not None and not known:
+        manifest.record(blob, stat.st_size, checksum=sha256)
+
+    add_alias(config, os.path.basename(local_filepath), blob, sha256, stat.st_size)
+    if manifest is not None:
+        manifest.record(key, stat.st_size, stat.st_mtime_ns, sha256, bundle=blob)
+
+
+def upload(local_filepath, key, config, manifest=None, retries=None) -> str:
+    """
+    Uploads a file, see upload_with_retry, and removes the .done and .start files of the
+    campaign of an uploaded transition file or bundle.
+
+    Returns:
+        str: The name of the uploaded file.
+    """
+    result = upload_with_retry(local_filepath, key, config, manifest, retries)
+    if BUNDLE_SUFFIX in result:
+        finish_bundle(local_filepath, key, config, manifest)
+    elif pathlib.Path(result).suffix == ".txt":
+        remove_campaign_markers(config, result.split("_")[0])
+    logger.info(f"Uploaded file {result}")
+    return result
+
+
+def remove_campaign_markers(config: dict, cid: str):
+    """removes the .done file of a finished campaign, and the .start file of its start"""
+    for suffix in (".done", ".start"):
+        path = os.path.join(config["volumes"]["scientist_cloud_volume"], f"{cid}{suffix}")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def bundle_key(config: dict, name: str) -> str:
+    """returns the key of a campaign bundle"""
+    return os.path.join(
+        config["sci_cloud"]["bucket_prefix"],
+        config["sci_cloud"].get("bundle_prefix", "bundle"),
+        name,
+    )
+
+
+def upload_bundle(cid, key, config, manifest=None, retries=None) -> str:
+    """
+    Packs the files of a finished campaign into one bundle, see write_bundle, and uploads it.
+    The bundle is written to a hidden file of the scientist cloud volume, removed once uploaded.
+
+    A bundle that could not be written is pushed to the retry queue, as a failed upload, so
+    the retry scheduler packs it again and the scans skip it in the meantime.
+
+    Returns:
+        str: The name of the uploaded bundle.
+
+    Raises:
+        Exception: If the bundle could not be written or uploaded.
+    """
+    volume = config["volumes"]["scientist_cloud_volume"]
+    encoding = bundle_encoding(config.get("bundle", {}).get("encoding"))
+    local_filepath = os.path.join(volume, f".{bundle_name(cid, encoding)}")
+    try:
+        end = os.path.getmtime(os.path.join(volume, f"{cid}.done"))
+    except FileNotFoundError:
+        # the campaign was uploaded meanwhile, nothing to retry
+        if retries is not None:
+            retries.remove(key)
+        raise
+    try:
+        index = write_bundle(volume, cid, local_filepath, encoding, end=end)
+    except Exception as e:
+        if retries is not None:
+            retries.push(key, local_filepath, str(e))
+        raise Exception(f"Failed to bundle {cid}: {e}")
+    logger.info(
+        f"Bundled {len(index['files'])} files of {cid}: {index['raw_size']} bytes into "
+        f"{index['size']} bytes, {index['raw_size'] - index['size']} bytes saved"
     )
-    bucket = s3.Bucket(bucket_name)
-    return bucket
+    return upload(local_filepath, key, config, manifest, retries)
+
+
+def retry_upload(key, local_filepath, config, manifest=None, retries=None) -> str:
+    """
+    Retries an upload of the retry queue: a bundle is packed again, see upload_bundle, since
+    its file may not have been written, any other file is uploaded, see upload.
+
+    Returns:
+        str: The name of the uploaded file.
+    """
+    if BUNDLE_SUFFIX in key:
+        cid = os.path.basename(key).split(BUNDLE_SUFFIX)[0]
+        return upload_bundle(cid, key, config, manifest, retries)
+    return upload(local_filepath, key, config, manifest, retries)
+
+
+def finish_bundle(local_filepath, key, config, manifest=None):
+    """
+    Records the files of an uploaded bundle in the manifest, under their own keys so they are
+    not uploaded one by one, and removes the bundle and the .done and .start files of its campaign.
+    """
+    index = read_index(local_filepath)
+    if manifest is not None:
+        for file in index["files"]:
+            if file["name"].startswith("gsas/"):
+                prefix, name = "bragg_prefix", file["name"][len("gsas/") :]
+            elif file["name"].endswith("_transition.txt"):
+                prefix, name = "transition_prefix", file["name"]
+            else:
+                continue
+            member = os.path.join(
+                config["sci_cloud"]["bucket_prefix"], config["sci_cloud"][prefix], name
+            )
+            manifest.record(member, file["size"], checksum=str(file["crc32"]), bundle=key)
+    os.remove(local_filepath)
+    remove_campaign_markers(config, index["campaign"])
+
+
+def get_client(max_pool_connections: int = MAX_WORKERS):
+    """
+    Returns the S3 client shared by all the threads of the service. It is created, with the
+    credentials of the environment (or .env file), on the first call, so the connections and
+    their TLS sessions are reused across uploads and scans.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            dotenv.load_dotenv()
+            config = Config(
+                signature_version="s3v4",
+                max_pool_connections=max_pool_connections,
+                # the transient errors of a request are retried with backoff by botocore
+                retries={"mode": "standard", "max_attempts": 5},
+            )
+            _client = boto3.client(
+                "s3",
+                endpoint_url=os.getenv("ENDPOINT_URL"),
+                aws_access_key_id=os.getenv("ACCESS_KEY_ID"),
+                aws_secret_access_key=os.getenv("SECRET_ACCESS_KEY"),
+                config=config,
+                verify=True,
+            )
+        return _client
+
+
+def configure_transfer(config: dict) -> Transfer:
+    """
+    Sets the transfer settings and limits of all the uploads from the transfer section of
+    the configuration, see Transfer.from_config.
+    """
+    global _transfer
+    _transfer = Transfer.from_config(config.get("transfer", {}))
+    return _transfer
+
+
+def get_bucket_name() -> str:
+    """returns the name of the bucket of the scientist cloud"""
+    return os.getenv("BUCKET_NAME")
+
+
+def scan(
+    config: dict,
+    executor: concurrent.futures.Executor,
+    manifest: UploadManifest = None,
+    retries: RetryQueue = None,
+    files: Optional[Iterable[str]] = None,
+) -> list:
+    """
+    Uploads the new files of the scientist cloud volume: the gsa files, and the transition file
+    of every finished campaign (with a .done file). With a manifest, only the files that are
+    new or changed since their upload are checked, see needs_upload. The files in the retry
+    queue are left to the retry scheduler.
+
+    Args:
+        files (Optional[Iterable[str]]): The names of the files to check, e.g., the files written
+            since the last scan, instead of listing the whole volume (default = None).
+
+    Returns:
+        list: The names of the uploaded files.
+    """
+    if files is None:
+        files = os.listdir(config["volumes"]["scientist_cloud_volume"])
+    bundle = config.get("bundle", {})
+    bundling = bundle.get("enabled", False)
+    jobs = []
+    for file in files:
+        # hidden names are temporary files of the dashboard service, still being written
+        if file.startswith("."):
+            continue
+        path = pathlib.Path(file)
+        ext = path.suffix
+        if ext == ".gsa":
+            if bundling and not bundle_expired(config, file):
+                # uploaded in the bundle of its campaign
+                continue
+            key = os.path.join(
+                config["sci_cloud"]["bucket_prefix"],
+                config["sci_cloud"]["bragg_prefix"],
+                file,
+            )
+        elif ext == ".done" and bundling:
+            cid = path.stem
+            key = bundle_key(config, bundle_name(cid, bundle_encoding(bundle.get("encoding"))))
+            if retries is not None and key in retries:
+                continue
+            if (manifest is not None and key in manifest) or check_if_key_exists(key):
+                # uploaded before its .done could be removed
+                os.remove(os.path.join(config["volumes"]["scientist_cloud_volume"], file))
+                continue
+            jobs.append([upload_bundle, cid, key, config, manifest, retries])
+            continue
+        elif ext == ".done":
+            file = f"{path.stem}_transition.txt"
+            key = os.path.join(
+                config["sci_cloud"]["bucket_prefix"],
+                config["sci_cloud"]["transition_prefix"],
+                file,
+            )
+        else:
+            continue
+
+        if retries is not None and key in retries:
+            continue
+        local_filepath = os.path.join(config["volumes"]["scientist_cloud_volume"], file)
+        if needs_upload(key, local_filepath, manifest, head=not deduplicated(config, key)):
+            jobs.append([upload, local_filepath, key, config, manifest, retries])
+
+    uploaded = []
+    futures = [executor.submit(*job) for job in jobs]
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            uploaded.append(future.result())
+        except Exception as e:
+            logger.error(e)
+    return uploaded
+
+
+def bundle_expired(config: dict, file: str) -> bool:
+    """
+    Checks if a gsa file waited bundle.max_wait_hours for the bundle of its campaign, e.g., if it
+    was received outside of a campaign, it is then uploaded under its own key.
+    """
+    max_wait = config.get("bundle", {}).get("max_wait_hours", 24) * 3600
+    try:
+        mtime = os.path.getmtime(
+            os.path.join(config["volumes"]["scientist_cloud_volume"], file)
+        )
+    except OSError:
+        return False
+    return time.time() - mtime >= max_wait
+
+
+class ScanTrigger:
+    """
+    Collects the files written or moved into the scientist cloud volume, reported by the inotify
+    watcher, and wakes up the main loop to upload them without waiting for the next scan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._files: Set[str] = set()
+        self._full = False
+
+    def on_event(self, volume: str, filename: str):
+        """called by the watcher thread, an empty filename requests a full scan"""
+        # hidden names are temporary files of the dashboard service
+        if filename.startswith("."):
+            return
+        if filename and pathlib.Path(filename).suffix not in (".gsa", ".done"):
+            return
+        with self._lock:
+            if filename:
+                self._files.add(filename)
+            else:
+                self._full = True
+        self._wakeup.set()
+
+    def wait(self, timeout: float) -> tuple:
+        """
+        Waits up to timeout seconds for an event.
+
+        Returns:
+            tuple: True if a full scan was requested, and the names of the files written.
+        """
+        self._wakeup.wait(max(0.0, timeout))
+        with self._lock:
+            self._wakeup.clear()
+            full, files = self._full, self._files
+            self._full, self._files = False, set()
+        return full, files
+
+
+def start_watcher(config: dict, trigger: ScanTrigger) -> Optional[InotifyWatcher]:
+    """
+    Watches the scientist cloud volume with inotify if watch.mode is "inotify", returns None
+    (the volume is polled every scan_period) if it is not or inotify is not available.
+    """
+    if config.get("watch", {}).get("mode", "poll") != "inotify":
+        return None
+    if not inotify_available():
+        logger.warning("inotify is not available, polling the volume instead")
+        return None
+    try:
+        watcher = InotifyWatcher(
+            {"scientist_cloud_volume": config["volumes"]["scientist_cloud_volume"]},
+            trigger.on_event,
+        )
+        watcher.start()
+        return watcher
+    except OSError as e:
+        logger.warning(f"could not watch the volume, polling it instead: {e}")
+        return None
+
+
+def list_objects(prefix: str) -> Dict[str, int]:
+    """returns the size of every object under a prefix, listed 1000 keys per request"""
+    objects = {}
+    paginator = get_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=get_bucket_name(), Prefix=prefix):
+        for obj in page.get("Contents", []):
+            objects[obj["Key"]] = obj["Size"]
+    return objects
+
+
+def reconcile(config: dict, manifest: UploadManifest, retries: RetryQueue = None):
+    """
+    Reconciles the manifest with the listing of the bragg, transition, bundle and blob prefixes
+    of the bucket, so the files whose objects were deleted are uploaded again, and the objects
+    uploaded by another instance (or before the manifest) are not checked one by one.
+    The uploads given up by the retry queue are removed from it, so the next full scan tries
+    them again, once per reconciliation.
+    """
+    if retries is not None:
+        for key, local_path, attempts, error in retries.clear_failed():
+            logger.warning(f"uploading {local_path} again, given up after {attempts} attempts: {error}")
+    prefixes = [
+        config["sci_cloud"]["bragg_prefix"],
+        config["sci_cloud"]["transition_prefix"],
+        config["sci_cloud"].get("bundle_prefix", "bundle"),
+        config["sci_cloud"].get("blob_prefix", "blobs"),
+    ]
+    for prefix in prefixes:
+        prefix = os.path.join(config["sci_cloud"]["bucket_prefix"], prefix, "")
+        try:
+            manifest.reconcile(prefix, list_objects(prefix))
+        except Exception as e:
+            logger.error(f"could not reconcile the manifest with {prefix}: {e}")
 
 
 def main():
@@ -120,56 +654,57 @@ def main():
 
     logger.info("Starting Storage Service")
 
-    while True:
-        files = os.listdir(config["volumes"]["scientist_cloud_volume"])
-        jobs = []
-        if files:
-            for file in files:
-                path = pathlib.Path(file)
-                ext = path.suffix
-                if ext == ".gsa":
-                    key = os.path.join(
-                        config["sci_cloud"]["bucket_prefix"],
-                        config["sci_cloud"]["bragg_prefix"],
-                        file,
-                    )
-                    if not check_if_key_exists(key):
-                        local_filepath = os.path.join(
-                            config["volumes"]["scientist_cloud_volume"], file
-                        )
-                        jobs.append([upload_with_retry, local_filepath, key, config])
-                elif ext == ".done":
-                    file = f"{path.stem}_transition.txt"
-                    key = os.path.join(
-                        config["sci_cloud"]["bucket_prefix"],
-                        config["sci_cloud"]["transition_prefix"],
-                        file,
-                    )
-                    if not check_if_key_exists(key):
-                        local_filepath = os.path.join(
-                            config["volumes"]["scientist_cloud_volume"], file
-                        )
-                        jobs.append([upload_with_retry, local_filepath, key, config])
-                else:
-                    continue
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=32) as ex:
-                futures = [ex.submit(*job) for job in jobs]
-                for future in concurrent.futures.as_completed(futures):
-                    try:
-                        result = future.result()
-                        if pathlib.Path(result).suffix == ".txt":
-                            os.remove(
-                                os.path.join(
-                                    config["volumes"]["scientist_cloud_volume"],
-                                    f"{result.split('_')[0]}.done",
-                                )
-                            )
-                        logger.info(f"Uploaded file {result}")
-                    except Exception as e:
-                        logger.error(e)
-
-        time.sleep(config["scan_period"])
+    max_workers = config.get("max_workers", MAX_WORKERS)
+    transfer = configure_transfer(config)
+    # every upload sends its parts on up to max_concurrency threads
+    get_client(max_pool_connections=max_workers * transfer.config.max_concurrency)
+    manifest_config = config.get("manifest", {})
+    manifest = UploadManifest(
+        os.path.join(
+            config["volumes"]["scientist_cloud_volume"],
+            manifest_config.get("path", MANIFEST_PATH),
+        )
+    )
+    reconcile_period = manifest_config.get("reconcile_period", RECONCILE_PERIOD)
+    retry_config = config.get("retry", {})
+    retries = RetryQueue(
+        os.path.join(
+            config["volumes"]["scientist_cloud_volume"],
+            retry_config.get("path", RETRY_FILE),
+        ),
+        base_delay=retry_config.get("base_delay", 2),
+        max_delay=retry_config.get("max_delay", 600),
+        max_age=retry_config.get("max_age_hours", 24) * 3600,
+    )
+
+    reconciled = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        scheduler = RetryScheduler(
+            retries,
+            lambda key, local_path: executor.submit(
+                retry_upload, key, local_path, config, manifest, retries
+            ),
+        )
+        scheduler.start()
+
+        # with inotify the files are uploaded when they are written, and the full scans are
+        # only a slow sweep for the events that were missed
+        trigger = ScanTrigger()
+        watcher = start_watcher(config, trigger)
+        sweep_period = config.get("watch", {}).get("reconcile_period", 600)
+        next_sweep = 0.0
+        while True:
+            if reconciled is None or time.monotonic() - reconciled >= reconcile_period:
+                reconcile(config, manifest, retries)
+                reconciled = time.monotonic()
+            full, files = trigger.wait(next_sweep - time.monotonic())
+            watched = watcher is not None and watcher.watched()
+            if full or time.monotonic() >= next_sweep:
+                scan(config, executor, manifest, retries)
+                period = sweep_period if watched else config["scan_period"]
+                next_sweep = time.monotonic() + period
+            elif files:
+                scan(config, executor, manifest, retries, files=sorted(files))
 
 
 if __name__ == "__main__":
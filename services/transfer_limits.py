@@ -0,0 +1,137 @@
+"""
+File: transfer_limits.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Transfer settings and limits (bandwidth, bytes in flight) shared by the uploads of the storage service.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the bytes per second sent by all the uploads together.
+    A caller reserves its bytes and sleeps for the time they take at the rate, so the callers
+    are served in the order of their reservations and none of them holds a lock while sleeping.
+
+    Attributes:
+        rate (float): The bytes per second, 0 for no limit.
+        burst (float): The bytes that can be sent at once after an idle period (default = 1 s at the rate).
+    """
+
+    def __init__(self, rate: float = 0, burst: float = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes: int):
+        """blocks until nbytes can be sent"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ByteBudget:
+    """
+    Limits the bytes of the uploads in flight, e.g., after a long campaign, so the files read
+    into memory and the parts being sent stay within max_bytes. A file larger than max_bytes
+    waits until nothing else is in flight.
+
+    Attributes:
+        max_bytes (int): The bytes in flight, 0 for no limit.
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int):
+        """blocks until nbytes fit in the budget"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: not self.max_bytes
+                or self.in_flight == 0
+                or self.in_flight + nbytes <= self.max_bytes
+            )
+            self.in_flight += nbytes
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self.in_flight -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        """reserves nbytes for the duration of the with block"""
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+
+class Transfer:
+    """
+    The settings of the uploads: the multipart transfer of every file, and the limits shared by
+    all of them.
+    The checksum of a file is sent in the metadata of its object, so it is computed before the
+    upload starts: a file up to in_memory_max is read once and uploaded from memory, a larger
+    file is read twice, to checksum it and to upload it from disk.
+
+    Attributes:
+        config (TransferConfig): The multipart threshold, part size and threads of one upload.
+        limiter (RateLimiter): The bandwidth of all the uploads.
+        budget (ByteBudget): The bytes of all the uploads in flight.
+        in_memory_max (int): The largest file read into memory (default = 64 MiB).
+    """
+
+    def __init__(
+        self,
+        config: TransferConfig = None,
+        limiter: RateLimiter = None,
+        budget: ByteBudget = None,
+        in_memory_max: int = 64 * MB,
+    ):
+        self.config = config or TransferConfig()
+        self.limiter = limiter or RateLimiter()
+        self.budget = budget or ByteBudget()
+        self.in_memory_max = in_memory_max
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Transfer":
+        """
+        Creates the settings from the transfer section of config_storage.yaml, the missing keys
+        keep the defaults of boto3 and no limits.
+        """
+        kwargs = {}
+        if "multipart_threshold_mb" in config:
+            kwargs["multipart_threshold"] = int(config["multipart_threshold_mb"] * MB)
+        if "multipart_chunksize_mb" in config:
+            kwargs["multipart_chunksize"] = int(config["multipart_chunksize_mb"] * MB)
+        if "max_concurrency" in config:
+            kwargs["max_concurrency"] = config["max_concurrency"]
+        return cls(
+            TransferConfig(**kwargs),
+            RateLimiter(config.get("max_bandwidth_mb", 0) * MB),
+            ByteBudget(int(config.get("max_in_flight_mb", 0) * MB)),
+            int(config.get("in_memory_max_mb", 64) * MB),
+        )
+
+    def callback(self, nbytes: int):
+        """the progress callback of an upload, it throttles the thread that sent nbytes"""
+        self.limiter.acquire(nbytes)
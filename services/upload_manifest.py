@@ -0,0 +1,157 @@
+"""
+File: upload_manifest.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Local manifest (SQLite) of the files uploaded to the scientist cloud.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class UploadManifest:
+    """
+    Remembers the key, size, modification time and checksum of every uploaded file, so a scan
+    only checks or uploads the files that are new or changed since their upload.
+    The manifest is reconciled with the listing of the bucket, see reconcile. The files uploaded
+    inside another object (a campaign bundle, or the blob of their content) are recorded under
+    their own key, with the key of that object.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # the uploads complete on the threads of the executor
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER,
+                checksum TEXT,
+                uploaded_at REAL NOT NULL,
+                bundle TEXT
+            )
+            """
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(uploads)")]
+        if "bundle" not in columns:
+            # manifests created before the campaign bundles
+            self._db.execute("ALTER TABLE uploads ADD COLUMN bundle TEXT")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: str) -> Optional[dict]:
+        """returns the entry of a key (size, mtime_ns, checksum, uploaded_at, bundle), None if it is unknown"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, checksum, uploaded_at, bundle FROM uploads WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("size", "mtime_ns", "checksum", "uploaded_at", "bundle"), row))
+
+    def is_current(self, key: str, stat: os.stat_result) -> bool:
+        """
+        Checks if the uploaded version of a key is the local file.
+        An entry found by reconcile has no modification time yet, it is current if its size is
+        the size of the file, and the modification time of the file is then recorded.
+
+        Args:
+            key (str): The key of the file in the bucket.
+            stat (os.stat_result): The status of the local file.
+
+        Returns:
+            bool: True if the file does not need to be uploaded.
+        """
+        entry = self.get(key)
+        if entry is None or entry["size"] != stat.st_size:
+            return False
+        if entry["mtime_ns"] is None:
+            with self._lock:
+                self._db.execute(
+                    "UPDATE uploads SET mtime_ns = ? WHERE key = ?", (stat.st_mtime_ns, key)
+                )
+            return True
+        return entry["mtime_ns"] == stat.st_mtime_ns
+
+    def record(
+        self,
+        key: str,
+        size: int,
+        mtime_ns: Optional[int] = None,
+        checksum: Optional[str] = None,
+        bundle: Optional[str] = None,
+    ):
+        """
+        Records the upload of a file, replacing the previous entry of its key.
+
+        Args:
+            key (str): The key of the file in the bucket.
+            size (int): The size of the file.
+            mtime_ns (Optional[int]): The modification time of the file, None if it is unknown.
+            checksum (Optional[str]): The checksum sent with the file.
+            bundle (Optional[str]): The key of the object holding the content of the file (its
+                bundle or its blob), None if it was uploaded under its own key.
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (key, size, mtime_ns, checksum, time.time(), bundle),
+            )
+
+    def reconcile(self, prefix: str, objects: Dict[str, int]) -> tuple:
+        """
+        Makes the entries under a prefix agree with the listing of the bucket: the entries of
+        missing objects are removed (so their files are uploaded again), and the objects without
+        an entry, or of another size, are recorded without a modification time. The files of the
+        bundles and blobs that are no longer recorded are removed too.
+
+        Args:
+            prefix (str): The prefix of the listed keys.
+            objects (Dict[str, int]): The size of every object under the prefix.
+
+        Returns:
+            tuple: The number of entries removed and added.
+        """
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            known = dict(
+                self._db.execute(
+                    "SELECT key, size FROM uploads WHERE substr(key, 1, ?) = ? AND bundle IS NULL",
+                    (len(prefix), prefix),
+                ).fetchall()
+            )
+            stale = [key for key, size in known.items() if objects.get(key) != size]
+            self._db.executemany("DELETE FROM uploads WHERE key = ?", [(key,) for key in stale])
+            now = time.time()
+            added = [(key, size, now) for key, size in objects.items() if known.get(key) != size]
+            self._db.executemany("INSERT OR REPLACE INTO uploads VALUES (?, ?, NULL, NULL, ?, NULL)", added)
+            self._db.execute(
+                "DELETE FROM uploads WHERE bundle IS NOT NULL AND bundle NOT IN (SELECT key FROM uploads)"
+            )
+        removed = len([key for key in known if key not in objects])
+        logger.info(f"reconciled {prefix}: {len(objects)} objects, {removed} entries removed, {len(added)} added")
+        return removed, len(added)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
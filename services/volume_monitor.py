@@ -0,0 +1,454 @@
+"""
+File: volume_monitor.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Scans the dashboard volumes once per process and fans out the updates to every dashboard session.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from typing import Callable, DefaultDict, List, Optional, Set, Tuple
+import numpy as np
+import plotly.graph_objects as go
+from gsa_loader import load_gsa_file, load_gsa_workspace, remove_sidecar, workspace_cache
+from record_reader import TransitionReader, read_last_line
+from volume_watcher import InotifyWatcher, inotify_available
+
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    filename="nsdf-intersect-dashboard.log", encoding="utf-8", level=logging.INFO
+)
+
+# scans triggered by the changes of each volume
+VOLUME_SCANS = {
+    "bragg_volume": "bragg",
+    "transition_volume": "transition",
+    "andie_volume": "transition",
+    "scientist_cloud_volume": "stateful",
+}
+
+
+@dataclass
+class VolumeSnapshot:
+    """
+    The state of the volumes as seen by the last scan, shared (read-only) by all sessions.
+
+    Attributes:
+        bragg_file (str): The latest gsa file in the bragg volume.
+        bragg_data (DefaultDict): The workspace of the latest gsa file.
+        id_campaign (str): The id of the current campaign.
+        id_transition (str): The id of the last transition record of the campaign.
+        transition_temp (np.ndarray): The temperatures of the transition records, shape (n,).
+        transition_ylist (np.ndarray): The peaks of the transition records, shape (n, number of peaks).
+        id_andie (str): The id of the last ANDiE prediction.
+        next_temperature (float): The last ANDiE predicted temperature.
+        next_temperature_timestamp (int): The timestamp of the last ANDiE prediction.
+        stateful_files (Optional[DefaultDict[str, str]]): The timestamp/filename pairs of the
+            scientist cloud volume, None until it has been scanned.
+        bragg_traces (List[go.Scatter]): The traces of the bragg plot, one per bank.
+        bank_figures (List[dict]): The figure of every bank in the by bank tab.
+        bragg_limits (Tuple[float, float, float, float]): The minX, maxX, minY and maxY of the bragg data.
+        transition_traces (List[go.Scatter]): The traces of the transition plot, one per peak.
+        transition_max (float): The maximum peak of the transition records.
+    """
+
+    bragg_file: str = ""
+    bragg_data: DefaultDict = field(default_factory=defaultdict)
+    id_campaign: str = ""
+    id_transition: str = ""
+    transition_temp: np.ndarray = field(default_factory=lambda: np.empty(0))
+    transition_ylist: np.ndarray = field(default_factory=lambda: np.empty((0, 0)))
+    id_andie: str = ""
+    next_temperature: float = 0.0
+    next_temperature_timestamp: int = 0
+    stateful_files: Optional[DefaultDict[str, str]] = None
+    bragg_traces: List[go.Scatter] = field(default_factory=list)
+    bank_figures: List[dict] = field(default_factory=list)
+    bragg_limits: Tuple[float, float, float, float] = (0.0, 0.0, 0.0, 0.0)
+    transition_traces: List[go.Scatter] = field(default_factory=list)
+    transition_max: float = 0.0
+
+
+def bragg_figures(bragg_data: DefaultDict) -> Tuple[List[go.Scatter], List[dict], Tuple[float, float, float, float]]:
+    """
+    Builds the traces of the bragg plot and the figures of the by bank tab from a gsas workspace.
+    The traces are shared by the sessions, which must not modify them.
+
+    Returns:
+        tuple: The traces (one per bank), the figure of every bank, and the (minX, maxX, minY, maxY) limits.
+    """
+    traces, figures = [], []
+    minX = maxX = minY = maxY = 0.0
+    for wksp_index, arr in bragg_data.items():
+        scatter_line = go.Scatter(
+            x=arr[0],
+            y=arr[1],
+            name=f"Bank {wksp_index}",
+            line=dict(width=2),
+        )
+        # setting plot limits
+        minX = min(minX, np.min(arr[0]))
+        maxX = max(maxX, np.max(arr[0]))
+        minY = min(minX, np.min(arr[1]))
+        maxY = max(maxY, np.max(arr[1]))
+
+        figures.append(dict(
+            data=scatter_line,
+            layout=go.Layout(
+                title=dict(text=f"Bank {wksp_index}", font=dict(size=26, weight="bold")),
+                xaxis=dict(title=dict(text="d-Spacing", font=dict(size=22)), tickfont=dict(size=18)),
+                yaxis=dict(title=dict(text="Intensity", font=dict(size=22)), tickfont=dict(size=18)),)
+        ))
+        traces.append(scatter_line)
+    return traces, figures, (minX, maxX, minY, maxY)
+
+
+def transition_figures(temp: np.ndarray, ylist: np.ndarray) -> Tuple[List[go.Scatter], float]:
+    """
+    Builds the traces of the transition plot from the transition records, one per peak.
+    The traces are shared by the sessions, which must not modify them.
+
+    Returns:
+        tuple: The traces, and the maximum peak (the height of the ANDiE trace).
+    """
+    maxY = max(0.0, float(ylist.max())) if ylist.size else 0.0
+    traces = [
+        go.Scatter(
+            mode="lines+markers",
+            x=temp,
+            y=ylist[:, i],
+            name=f"Peak {i+1}",
+            marker=dict(size=np.linspace(5, 35, len(temp))),
+            line=dict(width=1),
+        )
+        for i in range(ylist.shape[1])
+    ]
+    return traces, maxY
+
+
+def load_stateful_files(volume: str) -> DefaultDict[str, str]:
+    """load files as timestamp/filename pair from the scientist cloud volume"""
+    stateful_files = defaultdict()
+    files = os.listdir(volume)
+    if files:
+        for file in files:
+            if file.endswith(".gsa"):
+                epoch = int(file.split("_")[0])
+                human_readable_timestamp = datetime.fromtimestamp(
+                    epoch, tz=timezone.utc
+                ).strftime("%B %d, %Y %I:%M:%S %p UTC")
+                stateful_files[human_readable_timestamp] = file
+
+    return stateful_files
+
+
+def latest_bragg_file(volume: str) -> Optional[str]:
+    """
+    Returns the latest gsa file in the bragg volume, removing the older ones (and their sidecars).
+    """
+    files = [f for f in os.listdir(volume) if f.endswith(".gsa")]
+    if not files:
+        return None
+
+    files = sorted(files, key=lambda f: int(f.split("_")[0]))
+    for file in files[:-1]:
+        filepath = os.path.join(volume, file)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+            remove_sidecar(filepath)
+    return files[-1]
+
+
+def current_campaign(volume: str, id_campaign: str) -> str:
+    """
+    Returns the id of the current campaign in the transition volume, removing the transition file
+    of the previous campaign when a new one starts.
+    NOTE: No support for parallel campaign (sequential only)
+    """
+    # hidden names are temporary files of the writers
+    files = [f for f in os.listdir(volume) if not f.startswith(".")]
+    if not files:
+        return id_campaign
+
+    if len(files) == 1:
+        return files[0].split("_")[0]
+
+    # change campaign id
+    prev_cid = id_campaign
+    for file in files:
+        cid = file.split("_")[0]
+        if cid != id_campaign:
+            id_campaign = cid
+    prev_path = os.path.join(volume, f"{prev_cid}_transition.txt")
+    if os.path.exists(prev_path):
+        os.remove(prev_path)
+    return id_campaign
+
+
+class VolumeMonitor:
+    """
+    Scans the dashboard volumes on a single background thread and pushes every change to the
+    subscribed sessions, so listing, reading and parsing the volumes is done once per process
+    instead of once per browser session.
+    With watch.mode "inotify" the scans are triggered by the files written to the volumes, and the
+    scan periods are replaced by a slow reconciliation sweep (watch.reconcile_period), volumes that
+    cannot be watched are still polled.
+
+    Attributes:
+        config (dict): The dashboard configuration (volumes, scan periods and cache).
+        snapshot (VolumeSnapshot): The state of the volumes after the last scan.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.snapshot = VolumeSnapshot()
+        self._scanned = False
+        self._subscribers: List[Callable[[VolumeSnapshot], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._pending: Set[str] = set()
+        self._thread: Optional[threading.Thread] = None
+        self._watcher: Optional[InotifyWatcher] = None
+        self._transition_reader: Optional[TransitionReader] = None
+
+    def subscribe(self, callback: Callable[[VolumeSnapshot], None]):
+        """
+        Registers a session callback, it is called with the current snapshot and on every change.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+            snapshot, scanned = self.snapshot, self._scanned
+        if scanned:
+            callback(snapshot)
+
+    def unsubscribe(self, callback: Callable[[VolumeSnapshot], None]):
+        """removes a session callback"""
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def start(self):
+        """starts the scanning thread, if it is not running yet"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="volume-monitor", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """stops the scanning thread"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def _start_watcher(self):
+        """starts watching the volumes with inotify, falling back to polling if not available"""
+        if not inotify_available():
+            logger.warning("inotify is not available, polling the volumes instead")
+            return
+        try:
+            self._watcher = InotifyWatcher(
+                {name: self.config["volumes"][name] for name in VOLUME_SCANS},
+                self._on_volume_event,
+            )
+            self._watcher.start()
+        except OSError as e:
+            logger.warning(f"could not watch the volumes, polling them instead: {e}")
+            self._watcher = None
+
+    def _on_volume_event(self, volume: str, filename: str):
+        """called by the watcher thread when a file is written or moved into a volume"""
+        scan = VOLUME_SCANS[volume]
+        # hidden and temporary files are not data, the stateful files are only the gsa files
+        if filename.startswith(".") or (scan == "stateful" and filename and not filename.endswith(".gsa")):
+            return
+        with self._lock:
+            self._pending.add(scan)
+        self._wakeup.set()
+
+    def _watched_scans(self) -> Set[str]:
+        """returns the scans whose volumes are all watched"""
+        watched = self._watcher.watched() if self._watcher is not None else set()
+        return {
+            scan
+            for scan in set(VOLUME_SCANS.values())
+            if all(volume in watched for volume, s in VOLUME_SCANS.items() if s == scan)
+        }
+
+    def poll(self, bragg: bool = True, transition: bool = True, stateful: bool = True) -> bool:
+        """
+        Scans the volumes and publishes the new snapshot to the subscribers if anything changed.
+
+        Returns:
+            bool: True if the snapshot changed.
+        """
+        snapshot = self.snapshot
+        if bragg:
+            snapshot = self._scan_bragg(snapshot)
+        if transition:
+            snapshot = self._scan_transition(snapshot)
+            snapshot = self._scan_andie(snapshot)
+        if stateful:
+            snapshot = self._scan_stateful_files(snapshot)
+
+        changed = snapshot is not self.snapshot or not self._scanned
+        with self._lock:
+            self.snapshot = snapshot
+            self._scanned = True
+            subscribers = list(self._subscribers)
+
+        if changed:
+            for callback in subscribers:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    logger.error(f"failed to push volume update to a session: {e}")
+        return changed
+
+    def _run(self):
+        periods = self.config["scan_period"]
+        schedule = {
+            "bragg": periods["bragg_scan_period"],
+            "transition": periods["transition_scan_period"],
+            "stateful": periods["select_scan_period"],
+        }
+        watch = self.config.get("watch", {})
+        reconcile_period = watch.get("reconcile_period", periods["select_scan_period"])
+        if watch.get("mode", "poll") == "inotify":
+            self._start_watcher()
+
+        next_scan = {name: 0.0 for name in schedule}
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            watched = self._watched_scans()
+
+            now = time.monotonic()
+            due = {name: name in pending or now >= next_scan[name] for name in schedule}
+            try:
+                self.poll(**due)
+            except Exception as e:
+                logger.error(f"failed to scan the volumes: {e}")
+            for name, is_due in due.items():
+                if is_due:
+                    next_scan[name] = now + (reconcile_period if name in watched else schedule[name])
+            self._wakeup.wait(max(0.0, min(next_scan.values()) - time.monotonic()))
+
+    def _scan_bragg(self, snapshot: VolumeSnapshot) -> VolumeSnapshot:
+        volume = self.config["volumes"]["bragg_volume"]
+        if not os.path.isdir(volume):
+            logger.warning(f"Bragg volume: {volume} not found, skipping checks...")
+            return snapshot
+
+        filename = latest_bragg_file(volume)
+        if filename is None or filename == snapshot.bragg_file:
+            return snapshot
+
+        loader = load_gsa_workspace if self.config.get("cache", {}).get("sidecar", False) else load_gsa_file
+        bragg_data = workspace_cache.get(os.path.join(volume, filename), loader)
+        # the figures are built once here instead of once per session
+        traces, figures, limits = bragg_figures(bragg_data)
+        return replace(
+            snapshot,
+            bragg_file=filename,
+            bragg_data=bragg_data,
+            bragg_traces=traces,
+            bank_figures=figures,
+            bragg_limits=limits,
+        )
+
+    def _scan_transition(self, snapshot: VolumeSnapshot) -> VolumeSnapshot:
+        volume = self.config["volumes"]["transition_volume"]
+        if not os.path.isdir(volume):
+            logger.warning(f"Transition volume: {volume} not found, skipping checks...")
+            return snapshot
+
+        id_campaign = current_campaign(volume, snapshot.id_campaign)
+        if id_campaign == "":
+            return snapshot
+
+        path = os.path.join(volume, f"{id_campaign}_transition.txt")
+        if self._transition_reader is None or self._transition_reader.path != path:
+            self._transition_reader = TransitionReader(path)
+        reader = self._transition_reader
+        reader.refresh()
+
+        id_transition = reader.last_id if reader.last_id != "" else snapshot.id_transition
+        if (id_campaign, id_transition) == (snapshot.id_campaign, snapshot.id_transition):
+            return snapshot
+        traces, maxY = transition_figures(reader.temp, reader.ylist)
+        return replace(
+            snapshot,
+            id_campaign=id_campaign,
+            id_transition=id_transition,
+            transition_temp=reader.temp,
+            transition_ylist=reader.ylist,
+            transition_traces=traces,
+            transition_max=maxY,
+        )
+
+    def _scan_andie(self, snapshot: VolumeSnapshot) -> VolumeSnapshot:
+        volume = self.config["volumes"]["andie_volume"]
+        if not os.path.isdir(volume):
+            logger.warning(f"ANDiE volume: {volume} not found, skipping checks...")
+            return snapshot
+
+        last_measure = read_last_line(os.path.join(volume, "andie.txt"), complete=True)
+        if last_measure == "":
+            return snapshot
+
+        last_measure = last_measure.strip().split(",")
+        if last_measure[1] == snapshot.id_andie:
+            return snapshot
+        return replace(
+            snapshot,
+            id_andie=last_measure[1],
+            next_temperature_timestamp=int(last_measure[2]),
+            next_temperature=float(last_measure[3]),
+        )
+
+    def _scan_stateful_files(self, snapshot: VolumeSnapshot) -> VolumeSnapshot:
+        volume = self.config["volumes"]["scientist_cloud_volume"]
+        if not os.path.isdir(volume):
+            logger.warning(
+                f"Scientist cloud volume: {volume} not found, "
+                "skipping load stateful files..."
+            )
+            return snapshot
+
+        stateful_files = load_stateful_files(volume)
+        if stateful_files == snapshot.stateful_files:
+            return snapshot
+        return replace(snapshot, stateful_files=stateful_files)
+
+
+_volume_monitor: Optional[VolumeMonitor] = None
+_volume_monitor_lock = threading.Lock()
+
+
+def get_volume_monitor(config: dict) -> VolumeMonitor:
+    """
+    Returns the volume monitor of the process, creating and starting it on the first call.
+    NOTE: panel runs the dashboard script once per session, this module is imported once per process.
+    """
+    global _volume_monitor
+    with _volume_monitor_lock:
+        if _volume_monitor is None:
+            _volume_monitor = VolumeMonitor(config)
+        _volume_monitor.start()
+        return _volume_monitor
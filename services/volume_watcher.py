@@ -0,0 +1,159 @@
+"""
+File: volume_watcher.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Event-driven watching of the volumes with Linux inotify.
+"""
+
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from typing import Callable, Dict, Optional, Set
+
+
+logger = logging.getLogger(__name__)
+
+# inotify events (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+_EVENT = struct.Struct("iIII")
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    """loads the inotify functions of libc, None if they are not available"""
+    global _libc
+    if _libc is None and sys.platform.startswith("linux"):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            _libc = libc
+        except (OSError, AttributeError):
+            return None
+    return _libc
+
+
+def inotify_available() -> bool:
+    """returns True if the platform supports inotify"""
+    return _load_libc() is not None
+
+
+class InotifyWatcher:
+    """
+    Watches directories with inotify on a background thread and calls back on every file that
+    is closed after writing or moved into them. Directories that do not exist yet are retried
+    every retry_period seconds.
+
+    Attributes:
+        paths (Dict[str, str]): The directories to watch, by key.
+        callback (Callable[[str, str], None]): Called with the key of the directory and the name of the file.
+            On a queue overflow it is called with an empty name for every directory.
+        mask (int): The inotify events to watch (default = IN_CLOSE_WRITE | IN_MOVED_TO).
+        retry_period (float): Seconds between attempts to watch missing directories (default = 1.0).
+    """
+
+    def __init__(
+        self,
+        paths: Dict[str, str],
+        callback: Callable[[str, str], None],
+        mask: int = IN_CLOSE_WRITE | IN_MOVED_TO,
+        retry_period: float = 1.0,
+    ):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+        self.paths = paths
+        self.callback = callback
+        self.mask = mask
+        self.retry_period = retry_period
+        self._libc = libc
+        self._fd = fd
+        self._watches: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._add_missing_watches()
+
+    def watched(self) -> Set[str]:
+        """returns the keys of the directories that are currently watched"""
+        with self._lock:
+            return set(self._watches.values())
+
+    def start(self):
+        """starts the watching thread"""
+        self._thread = threading.Thread(target=self._run, name="inotify-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """stops the watching thread and releases the inotify instance"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._fd)
+
+    def _add_missing_watches(self):
+        with self._lock:
+            missing = set(self.paths) - set(self._watches.values())
+        for key in missing:
+            path = self.paths[key]
+            if not os.path.isdir(path):
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.mask)
+            if wd < 0:
+                err = ctypes.get_errno()
+                logger.warning(f"could not watch {path}: {os.strerror(err)}")
+                continue
+            with self._lock:
+                self._watches[wd] = key
+            # files may have been written before the watch existed
+            self.callback(key, "")
+
+    def _run(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], self.retry_period)
+            if not ready:
+                self._add_missing_watches()
+                continue
+
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = _EVENT.unpack_from(buffer, offset)
+                name = buffer[offset + _EVENT.size : offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                self._handle_event(wd, mask, os.fsdecode(name))
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflow, rescanning all the watched directories")
+            for key in self.watched():
+                self.callback(key, "")
+            return
+
+        with self._lock:
+            key = self._watches.get(wd)
+            if key is not None and mask & IN_IGNORED:
+                # the directory was removed, it is watched again when it comes back
+                del self._watches[wd]
+        if key is not None and not mask & IN_IGNORED:
+            self.callback(key, name)
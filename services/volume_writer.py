@@ -0,0 +1,384 @@
+"""
+File: volume_writer.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Writes files into the volumes atomically, once, and links them into the other volumes.
+"""
+
+import os
+import time
+import uuid
+import queue
+import shutil
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# durability modes, from the fastest to the safest
+#   none: the page cache is flushed by the kernel
+#   file: the content of the file is fsynced before it is renamed into place
+#   full: the directories are also fsynced after the rename, so the new names survive a crash
+DURABILITY_MODES = ("none", "file", "full")
+
+# persistence modes of a file written to several volumes
+#   link: written once and hardlinked into the other volumes (copied across filesystems)
+#   copy: written to every volume
+PERSISTENCE_MODES = ("link", "copy")
+
+
+def temp_path(path: str) -> str:
+    """returns a hidden, unique temporary name next to path"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def fsync_directory(directory: str):
+    """fsyncs a directory, so the names created or renamed in it are durable"""
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _replace(tmp: str, path: str, durability: str):
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        discard(tmp)
+        raise
+    if durability == "full":
+        fsync_directory(os.path.dirname(path))
+
+
+def discard(tmp: str):
+    """removes a temporary file that will not be renamed into place, if it exists"""
+    try:
+        os.remove(tmp)
+    except FileNotFoundError:
+        pass
+
+
+def write_atomic(path: str, data: bytes, durability: str = "none"):
+    """
+    Writes data to a hidden temporary file and renames it to path, so readers of the directory
+    only ever see the complete file.
+
+    Args:
+        path (str): The path of the file.
+        data (bytes): The content of the file.
+        durability (str): One of DURABILITY_MODES (default = "none").
+    """
+    tmp = temp_path(path)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            if durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        discard(tmp)
+        raise
+    _replace(tmp, path, durability)
+
+
+def copy_atomic(src: str, dst: str, durability: str = "none"):
+    """
+    Copies the file src to a hidden temporary file and renames it to dst.
+
+    Args:
+        src (str): The path of the existing file.
+        dst (str): The path of the copy.
+        durability (str): One of DURABILITY_MODES (default = "none").
+    """
+    tmp = temp_path(dst)
+    try:
+        shutil.copyfile(src, tmp)
+        if durability != "none":
+            with open(tmp, "rb+") as f:
+                os.fsync(f.fileno())
+    except BaseException:
+        discard(tmp)
+        raise
+    _replace(tmp, dst, durability)
+
+
+def link_or_copy(src: str, dst: str, durability: str = "none") -> bool:
+    """
+    Atomically places the file src at dst, as a hardlink when both are on the same filesystem
+    and as a copy otherwise. An existing dst is replaced.
+
+    Args:
+        src (str): The path of the existing file.
+        dst (str): The path of the new file.
+        durability (str): One of DURABILITY_MODES (default = "none").
+
+    Returns:
+        bool: True if the file was linked, False if it was copied.
+    """
+    tmp = temp_path(dst)
+    try:
+        os.link(src, tmp)
+    except OSError as e:
+        # EXDEV across filesystems, EPERM or ENOTSUP where hardlinks are not supported
+        logger.debug(f"could not link {src} to {dst}, copying it: {e}")
+        copy_atomic(src, dst, durability)
+        return False
+    _replace(tmp, dst, durability)
+    return True
+
+
+def append_record(path: str, record: bytes, durability: str = "none"):
+    """
+    Appends a record (one or more complete lines) to a file with a single O_APPEND write, so
+    readers see whole records or nothing of them, except for a last line they skip until its
+    newline is written. A missing file is created by the append, which closes it like any other
+    append, so the watchers of the volume (IN_CLOSE_WRITE) see its first record too.
+
+    Args:
+        path (str): The path of the file.
+        record (bytes): The record, ending with a newline.
+        durability (str): One of DURABILITY_MODES (default = "none").
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644)
+        created = True
+    except FileExistsError:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        created = False
+    try:
+        os.write(fd, record)
+        if durability != "none":
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    if created and durability == "full":
+        fsync_directory(os.path.dirname(path))
+
+
+def persist(data: bytes, paths: List[str], mode: str = "link", durability: str = "none"):
+    """
+    Writes the same content to several paths, creating their directories if they do not exist.
+
+    Args:
+        data (bytes): The content of the file.
+        paths (List[str]): The paths of the file, in every volume.
+        mode (str): One of PERSISTENCE_MODES (default = "link").
+        durability (str): One of DURABILITY_MODES (default = "none").
+
+    Raises:
+        ValueError: If the mode or the durability are unknown.
+    """
+    if mode not in PERSISTENCE_MODES:
+        raise ValueError(f"unknown persistence mode: {mode}")
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"unknown durability mode: {durability}")
+
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    write_atomic(paths[0], data, durability)
+    for path in paths[1:]:
+        if mode == "link":
+            link_or_copy(paths[0], path, durability)
+        else:
+            write_atomic(path, data, durability)
+
+
+def place(src: str, paths: List[str], mode: str = "link", durability: str = "none"):
+    """
+    Moves a complete file into several paths, renaming it to the first one and linking (or
+    copying) it to the others, see persist.
+
+    Args:
+        src (str): The path of the file, on the filesystem of the first path.
+        paths (List[str]): The paths of the file, in every volume.
+        mode (str): One of PERSISTENCE_MODES (default = "link").
+        durability (str): One of DURABILITY_MODES (default = "none").
+    """
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if durability != "none":
+        with open(src, "rb+") as f:
+            os.fsync(f.fileno())
+    _replace(src, paths[0], durability)
+    for path in paths[1:]:
+        if mode == "link":
+            link_or_copy(paths[0], path, durability)
+        else:
+            copy_atomic(paths[0], path, durability)
+
+
+class WriterQueue:
+    """
+    Writes files on a background thread, so the message handlers only enqueue their writes.
+    The operations are done in the order they were enqueued. Consecutive appends are coalesced
+    per file and written with one append_record once flush_bytes are pending or flush_interval
+    seconds after the first of them. Enqueuing blocks while max_bytes are queued (backpressure),
+    and close drains the queue.
+
+    Attributes:
+        max_bytes (int): The bytes queued before enqueuing blocks (default = 64 MiB).
+        flush_bytes (int): The pending appended bytes that trigger a flush (default = 256 KiB).
+        flush_interval (float): The seconds an append may stay pending (default = 0.05).
+        durability (str): One of DURABILITY_MODES (default = "none").
+        mode (str): One of PERSISTENCE_MODES, for the files written to several volumes (default = "link").
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        flush_bytes: int = 256 * 1024,
+        flush_interval: float = 0.05,
+        durability: str = "none",
+        mode: str = "link",
+    ):
+        if mode not in PERSISTENCE_MODES:
+            raise ValueError(f"unknown persistence mode: {mode}")
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability mode: {durability}")
+
+        self.max_bytes = max_bytes
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.mode = mode
+        self._items = deque()
+        self._queued_bytes = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="volume-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, path: str, record: bytes, timeout: Optional[float] = None):
+        """
+        Enqueues a record to append to a file, see append_record.
+
+        Raises:
+            queue.Full: If the queue is still full after timeout seconds.
+        """
+        self._put(("append", path, record, None), timeout)
+
+    def write(self, path: str, data: bytes, timeout: Optional[float] = None):
+        """
+        Enqueues an atomic write of a file, see write_atomic.
+
+        Raises:
+            queue.Full: If the queue is still full after timeout seconds.
+        """
+        self._put(("write", path, data, None), timeout)
+
+    def persist(self, data: bytes, paths: List[str], timeout: Optional[float] = None):
+        """
+        Enqueues the write of a file to several volumes, see persist.
+
+        Raises:
+            queue.Full: If the queue is still full after timeout seconds.
+        """
+        self._put(("persist", paths, data, None), timeout)
+
+    def place(self, src: str, paths: List[str], timeout: Optional[float] = None):
+        """
+        Enqueues the move of a complete file into several volumes, see place.
+
+        Raises:
+            queue.Full: If the queue is still full after timeout seconds.
+        """
+        self._put(("place", paths, b"", src), timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every operation enqueued before is written.
+
+        Returns:
+            bool: False if they were not written within timeout seconds.
+        """
+        done = threading.Event()
+        self._put(("barrier", None, b"", done), timeout)
+        return done.wait(timeout)
+
+    def close(self):
+        """writes every enqueued operation and stops the writing thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _put(self, item: tuple, timeout: Optional[float]):
+        nbytes = len(item[2])
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("the writer queue is closed")
+            # an operation larger than max_bytes waits for an empty queue
+            if not self._cond.wait_for(
+                lambda: self._queued_bytes == 0 or self._queued_bytes + nbytes <= self.max_bytes,
+                timeout,
+            ):
+                raise queue.Full(f"{self._queued_bytes} bytes are waiting to be written")
+            self._items.append(item)
+            self._queued_bytes += nbytes
+            self._cond.notify_all()
+
+    def _run(self):
+        pending: Dict[str, List[bytes]] = {}
+        pending_bytes = 0
+        deadline = None
+        while True:
+            with self._cond:
+                while not self._items and not self._closed:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                items = list(self._items)
+                self._items.clear()
+                closed = self._closed
+
+            # an item is (kind, target path(s), data, the event of a barrier or the source of a place)
+            for kind, target, data, arg in items:
+                if kind == "append":
+                    pending.setdefault(target, []).append(data)
+                    pending_bytes += len(data)
+                    deadline = deadline or time.monotonic() + self.flush_interval
+                    if pending_bytes >= self.flush_bytes:
+                        self._flush(pending)
+                        pending_bytes, deadline = 0, None
+                    continue
+
+                # the pending appends go first, e.g., the last records of a campaign before its .done
+                self._flush(pending)
+                pending_bytes, deadline = 0, None
+                try:
+                    if kind == "write":
+                        write_atomic(target, data, self.durability)
+                    elif kind == "persist":
+                        persist(data, target, self.mode, self.durability)
+                    elif kind == "place":
+                        place(arg, target, self.mode, self.durability)
+                except Exception as e:
+                    logger.error(f"failed to write {target}: {e}")
+                if kind == "barrier":
+                    arg.set()
+
+            if deadline is not None and (closed or time.monotonic() >= deadline):
+                self._flush(pending)
+                pending_bytes, deadline = 0, None
+
+            with self._cond:
+                self._queued_bytes -= sum(len(item[2]) for item in items)
+                self._cond.notify_all()
+                if closed and not self._items:
+                    return
+
+    def _flush(self, pending: Dict[str, List[bytes]]):
+        for path, records in pending.items():
+            try:
+                append_record(path, b"".join(records), self.durability)
+            except Exception as e:
+                logger.error(f"failed to append {len(records)} records to {path}: {e}")
+        pending.clear()
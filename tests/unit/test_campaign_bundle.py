@@ -0,0 +1,110 @@
+"""
+File: test_campaign_bundle.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the bundles of the finished campaigns.
+"""
+
+from __future__ import annotations
+import os
+import gzip
+import shutil
+import tarfile
+import zlib
+import pytest
+import campaign_bundle
+from campaign_bundle import bundle_encoding, bundle_name, campaign_files, read_index, write_bundle
+
+CAMPAIGN_ID = "cb199084-91ec-4b9b-898d-024d1920b8cb"
+FIXTURES = "./tests/fixtures/scientist_cloud_volume"
+
+
+@pytest.fixture
+def volume(tmp_path):
+    volume = tmp_path / "scientist_cloud_volume"
+    shutil.copytree(FIXTURES, volume)
+    with open(volume / "andie.txt", "a") as f:
+        f.write("c6f406ef-71e6-436e-b0eb-e3766e20a48d,1044a37c-09d1-46c0-8ad8-0b9a35a9281a,1743619600,300.0\n")
+    # received after the end of the campaign
+    shutil.copy(volume / "1743619477_NOM168363tof.gsa", volume / "1743619700_NOM168380tof.gsa")
+    return str(volume)
+
+
+class TestCampaignFiles:
+    def test_window(self, volume):
+        andie, gsas, window = campaign_files(volume, CAMPAIGN_ID, end=1743619600)
+        assert andie.count(b"\n") == 33
+        assert all(line.startswith(CAMPAIGN_ID) for line in andie.decode().splitlines())
+        assert gsas == [
+            "1743619477_NOM168363tof.gsa",
+            "1743619479_NOM168364tof.gsa",
+            "1743619481_NOM168365tof.gsa",
+            "1743619494_NOM168371tof.gsa",
+            "1743619501_NOM168374tof.gsa",
+        ]
+        assert window == (1743619342, 1743619600)
+
+    def test_recorded_start(self, volume):
+        # received before the first ANDiE record, by the clock of the service
+        shutil.copy(os.path.join(volume, "1743619477_NOM168363tof.gsa"), os.path.join(volume, "1743619300_NOM168362tof.gsa"))
+        _, gsas, window = campaign_files(volume, CAMPAIGN_ID, end=1743619600)
+        assert "1743619300_NOM168362tof.gsa" not in gsas
+
+        with open(os.path.join(volume, f"{CAMPAIGN_ID}.start"), "w") as f:
+            f.write("1743619290")
+        _, gsas, window = campaign_files(volume, CAMPAIGN_ID, end=1743619600)
+        assert gsas[0] == "1743619300_NOM168362tof.gsa"
+        assert len(gsas) == 6
+        assert window == (1743619290, 1743619600)
+
+    def test_no_andie_records(self, volume):
+        andie, gsas, window = campaign_files(volume, "unknown", end=1743619600)
+        assert (andie, gsas, window) == (b"", [], (None, 1743619600))
+
+
+class TestWriteBundle:
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    def test_bundle(self, volume, tmp_path, encoding):
+        if encoding == "zstd":
+            pytest.importorskip("zstandard")
+        dst = str(tmp_path / bundle_name(CAMPAIGN_ID, encoding))
+        index = write_bundle(volume, CAMPAIGN_ID, dst, encoding, end=1743619600)
+
+        assert read_index(dst) == {k: v for k, v in index.items() if k != "size"}
+        assert index["size"] == os.path.getsize(dst)
+        assert index["size"] < index["raw_size"]
+        names = [f["name"] for f in index["files"]]
+        assert names[0] == f"{CAMPAIGN_ID}_transition.txt"
+        assert names[-1] == "andie.txt"
+        assert "gsas/1743619700_NOM168380tof.gsa" not in names
+        assert len(names) == 7
+
+        extracted = tmp_path / "extracted"
+        if encoding == "zstd":
+            with open(dst, "rb") as f:
+                data = campaign_bundle.zstandard.ZstdDecompressor().stream_reader(f).read()
+        else:
+            data = gzip.decompress(open(dst, "rb").read())
+        tar_path = tmp_path / "bundle.tar"
+        tar_path.write_bytes(data)
+        with tarfile.open(tar_path) as tar:
+            assert tar.getnames()[0] == "index.json"
+            tar.extractall(extracted)
+        for file in index["files"]:
+            content = (extracted / file["name"]).read_bytes()
+            assert len(content) == file["size"]
+            assert zlib.crc32(content) == file["crc32"]
+        with open(os.path.join(volume, "1743619477_NOM168363tof.gsa"), "rb") as f:
+            assert (extracted / "gsas" / "1743619477_NOM168363tof.gsa").read_bytes() == f.read()
+
+    def test_missing_transition_file(self, volume, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            write_bundle(volume, "unknown", str(tmp_path / "bundle.tar.gz"), "gzip")
+
+    def test_encoding(self, monkeypatch):
+        assert bundle_encoding("gzip") == "gzip"
+        monkeypatch.setattr(campaign_bundle, "zstandard", None)
+        assert bundle_encoding("zstd") == "gzip"
+        assert bundle_encoding() == "gzip"
+        with pytest.raises(ValueError):
+            bundle_encoding("bz2")
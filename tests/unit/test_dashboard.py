@@ -8,6 +8,11 @@ Description: Unit tests for the dashboard.
 from __future__ import annotations
 import os
 from services import AppState, App
+import shutil
+import threading
+import time
+from volume_monitor import VolumeMonitor
+from volume_watcher import inotify_available
 import pytest
 
 
@@ -60,56 +65,55 @@ class TestInitialization:
         )
 
 
-class TestPollingMethods:
-    def test_no_volume_poll_bragg(
-        self, unconfigured_app, caplog: pytest.LogCaptureFixture
-    ):
-        unconfigured_app.poll_bragg()
+class TestVolumeScans:
+    def test_no_volumes(self, unconfigured_app, caplog: pytest.LogCaptureFixture):
+        monitor = VolumeMonitor(unconfigured_app.config)
+        monitor.subscribe(unconfigured_app.apply_snapshot)
+        monitor.poll()
         assert "Bragg volume:  not found, skipping checks..." in caplog.text
-
-    def test_poll_bragg(self, configured_app, bragg_volume):
-        configured_app.poll_bragg()
-        assert configured_app.current_bragg_file == "1743619484_NOM168366tof.gsa"
-        assert len(os.listdir(bragg_volume)) == 1
-
-    def test_no_volume_poll_transition(
-        self, unconfigured_app, caplog: pytest.LogCaptureFixture
-    ):
-        unconfigured_app.poll_transition()
         assert "Transition volume:  not found, skipping checks..." in caplog.text
-
-    def test_poll_transition(self, configured_app, transition_volume):
-        configured_app.poll_transition()
-        assert configured_app.id_campaign == "cb199084-91ec-4b9b-898d-024d1920b8cb"
-        assert configured_app.id_transition == "6fb0c800-b960-4af7-a6e1-3ebbf73c2a6d"
-        assert len(os.listdir(transition_volume)) == 1
-
-    def test_no_volume_poll_andie(
-        self, unconfigured_app, caplog: pytest.LogCaptureFixture
-    ):
-        unconfigured_app.poll_andie()
         assert "ANDiE volume:  not found, skipping checks..." in caplog.text
+        assert unconfigured_app.current_bragg_file == ""
+        assert unconfigured_app.id_campaign == ""
+
+    def test_scan_bragg(self, configured_app, bragg_volume):
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.poll(transition=False, stateful=False)
+        assert monitor.snapshot.bragg_file == "1743619484_NOM168366tof.gsa"
+        assert len(monitor.snapshot.bragg_data.keys()) == 6
+        assert len(monitor.snapshot.bragg_data[1]) == 3
+        assert len(os.listdir(bragg_volume)) == 1
 
-    def test_poll_andie(self, configured_app):
-        configured_app.poll_andie()
-        assert configured_app.id_andie == "8cdcb065-4b0f-4473-bfb7-d715965f8e13"
-
+    def test_scan_transition_ignores_temp_files(self, configured_app, transition_volume, tmp_path):
+        volume = shutil.copytree(transition_volume, tmp_path / "transition_volume")
+        (volume / ".new-campaign_transition.txt.0a1b2c3d.tmp").write_text("")
+        configured_app.config["volumes"]["transition_volume"] = str(volume)
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.poll(bragg=False, stateful=False)
+        assert monitor.snapshot.id_campaign == "cb199084-91ec-4b9b-898d-024d1920b8cb"
+        assert monitor.snapshot.id_transition == "6fb0c800-b960-4af7-a6e1-3ebbf73c2a6d"
+        assert len(os.listdir(volume)) == 2
 
-class TestLoaders:
-    def test_load_stateful_files(self, configured_app):
-        timestamp_to_filename = configured_app._load_stateful_files()
-        assert len(timestamp_to_filename) == 5
+    def test_scan_andie(self, configured_app):
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.poll(bragg=False, stateful=False)
+        assert monitor.snapshot.id_andie == "8cdcb065-4b0f-4473-bfb7-d715965f8e13"
 
-    def test_load_workspace(self, configured_app):
-        configured_app._load_workspace("1743619484_NOM168366tof.gsa")
-        assert len(configured_app.bragg_data.keys()) == 6
-        assert len(configured_app.bragg_data[1]) == 3
+    def test_scan_stateful_files(self, configured_app):
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.poll(bragg=False, transition=False)
+        assert len(monitor.snapshot.stateful_files) == 5
 
 
 class TestRenderers:
-    def test_render_bragg_plot(self, configured_app):
-        configured_app.poll_bragg()
-        configured_app._render_bragg_plot()
+    @pytest.fixture
+    def monitor(self, configured_app) -> VolumeMonitor:
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.subscribe(configured_app.apply_snapshot)
+        return monitor
+
+    def test_render_bragg_plot(self, configured_app, monitor):
+        monitor.poll(transition=False, stateful=False)
         assert len(configured_app.bragg_data_by_bank) == 6
         assert len(configured_app.bragg_data_dict["data"]) == 6
         assert configured_app.all_banks_header_md != """"""
@@ -117,9 +121,8 @@ class TestRenderers:
         assert configured_app.minX >= 0.0
         assert configured_app.minY >= 0.0
 
-    def test_render_transition_content(self, configured_app):
-        configured_app.poll_transition()
-        configured_app._render_transition_content()
+    def test_render_transition_content(self, configured_app, monitor):
+        monitor.poll(bragg=False, stateful=False)
         assert len(configured_app.transition_data_dict["data"]) == 3
         # The last trace in the transition content should always be the ANDiE prediction trace
         assert (
@@ -130,12 +133,12 @@ class TestRenderers:
             in configured_app.transition_data_dict["layout"].title.text
         )
 
-    def test_render_andie_content(self, configured_app):
-        configured_app.poll_andie()
-        configured_app._render_andie_content()
-        assert len(configured_app.transition_data_dict["data"]) > 0
-        assert (
-            configured_app.transition_data_dict["data"][-1].name == "Next Temperature"
+    def test_render_andie_content(self, configured_app, monitor):
+        monitor.poll(bragg=False, stateful=False)
+        assert configured_app.next_temperature_timestamp != 0
+        assert configured_app.transition_data_dict["data"][-1].x == (
+            configured_app.next_temperature,
+            configured_app.next_temperature,
         )
         assert configured_app.andie_header_md != """"""
 
@@ -170,11 +173,70 @@ class TestReactivity:
         assert configured_app.bragg_data_dict["layout"].yaxis.range[1] == 10
 
 
-class TestHelpers:
-    def test_last_id(self, configured_app):
-        last_id_transition = configured_app._last_id(
-            "TRANSITION", "cb199084-91ec-4b9b-898d-024d1920b8cb_transition.txt"
-        )
-        last_id_andie = configured_app._last_id("ANDIE", "")
-        assert last_id_transition == "6fb0c800-b960-4af7-a6e1-3ebbf73c2a6d"
-        assert last_id_andie == "8cdcb065-4b0f-4473-bfb7-d715965f8e13"
+class TestVolumeMonitor:
+    def test_poll_pushes_snapshot(self, configured_app):
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.subscribe(configured_app.apply_snapshot)
+        assert monitor.poll()
+        assert configured_app.current_bragg_file == "1743619484_NOM168366tof.gsa"
+        assert len(configured_app.bragg_data_dict["data"]) == 6
+        assert configured_app.id_campaign == "cb199084-91ec-4b9b-898d-024d1920b8cb"
+        assert configured_app.id_transition == "6fb0c800-b960-4af7-a6e1-3ebbf73c2a6d"
+        assert len(configured_app.transition_data_dict["data"]) == 3
+        assert configured_app.id_andie == "8cdcb065-4b0f-4473-bfb7-d715965f8e13"
+        assert len(configured_app.files) == 5
+        # nothing changed in the volumes
+        assert not monitor.poll()
+
+    def test_sessions_share_the_figures(self, configured_app):
+        other_app = AppState()
+        other_app.config = configured_app.config
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.subscribe(configured_app.apply_snapshot)
+        monitor.subscribe(other_app.apply_snapshot)
+        monitor.poll()
+        snapshot = monitor.snapshot
+        for app in (configured_app, other_app):
+            assert app.bragg_data_dict["data"] is snapshot.bragg_traces
+            assert [pane.object for pane in app.bragg_data_by_bank] == snapshot.bank_figures
+            assert app.transition_data_dict["data"][:-1] == snapshot.transition_traces
+        # the ANDiE trace is modified by each session
+        assert configured_app.transition_data_dict["data"][-1] is not other_app.transition_data_dict["data"][-1]
+
+    def test_subscriber_gets_current_snapshot(self, configured_app):
+        monitor = VolumeMonitor(configured_app.config)
+        monitor.poll()
+        snapshots = []
+        monitor.subscribe(snapshots.append)
+        assert len(snapshots) == 1
+        assert snapshots[0].bragg_file == "1743619484_NOM168366tof.gsa"
+        monitor.unsubscribe(snapshots.append)
+
+    @pytest.mark.skipif(not inotify_available(), reason="inotify is not available")
+    def test_inotify_wakes_up_monitor(self, tmp_path, bragg_volume):
+        config = {
+            "volumes": {
+                name: str(tmp_path / name)
+                for name in ["bragg_volume", "transition_volume", "andie_volume", "scientist_cloud_volume"]
+            },
+            "scan_period": {"bragg_scan_period": 60, "transition_scan_period": 60, "select_scan_period": 60},
+            "watch": {"mode": "inotify", "reconcile_period": 60},
+        }
+        for volume in config["volumes"].values():
+            os.makedirs(volume)
+
+        monitor = VolumeMonitor(config)
+        updated = threading.Event()
+        monitor.subscribe(lambda snapshot: snapshot.bragg_file != "" and updated.set())
+        monitor.start()
+        try:
+            # let the first scan run, the next one is only due in 60s without events
+            time.sleep(0.2)
+            shutil.copy(
+                os.path.join(bragg_volume, "1743619484_NOM168366tof.gsa"),
+                os.path.join(config["volumes"]["bragg_volume"], "1743619484_NOM168366tof.gsa"),
+            )
+            assert updated.wait(2.0)
+            assert monitor.snapshot.bragg_file == "1743619484_NOM168366tof.gsa"
+        finally:
+            monitor.stop()
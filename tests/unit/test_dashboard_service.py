@@ -0,0 +1,354 @@
+"""
+File: test_dashboard_service.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the dashboard service.
+"""
+
+from __future__ import annotations
+import os
+import json
+import errno
+import base64
+import hashlib
+import pytest
+
+pytest.importorskip("intersect_sdk")
+
+from pydantic import TypeAdapter  # noqa: E402
+
+from constants import INTERSECT_DASHBOARD_CONFIG  # noqa: E402
+from payload_codec import encode  # noqa: E402
+import dashboard_service  # noqa: E402
+import volume_writer  # noqa: E402
+from dashboard_service import (  # noqa: E402
+    BraggChunk,
+    BraggUploadBegin,
+    BraggUploadCommit,
+    CampaignIndex,
+    DashboardCapability,
+    FileType,
+    FinishCampaignMsg,
+    TransitionData,
+    TransitionDataBatch,
+    last_record,
+)
+
+CAMPAIGN_ID = "cb199084-91ec-4b9b-898d-024d1920b8cb"
+
+
+@pytest.fixture
+def capability(tmp_path, monkeypatch):
+    config_path = tmp_path / "config_dashboard.yaml"
+    config_path.write_text(
+        "volumes:\n"
+        f"  bragg_volume: {tmp_path / 'bragg_volume'}\n"
+        f"  transition_volume: {tmp_path / 'transition_volume'}\n"
+        f"  andie_volume: {tmp_path / 'andie_volume'}\n"
+        f"  scientist_cloud_volume: {tmp_path / 'scientist_cloud_volume'}\n"
+    )
+    monkeypatch.setenv(INTERSECT_DASHBOARD_CONFIG, str(config_path))
+    capability = DashboardCapability()
+    yield capability
+    capability.writer.close()
+
+
+def read_records(capability: DashboardCapability, cid: str) -> list:
+    capability.writer.flush()
+    path = os.path.join(
+        capability.config["volumes"]["transition_volume"], f"{cid}_transition.txt"
+    )
+    with open(path) as f:
+        return [line.rstrip("\n").split(",") for line in f]
+
+
+class TestLastRecord:
+    def test_partial_line_is_skipped(self, tmp_path):
+        (tmp_path / "c1_transition.txt").write_text("r1,300.0,1.5,2.5\nr2,31")
+        assert last_record(str(tmp_path), "c1").temp == 300.0
+
+    def test_fixture(self):
+        tdata = last_record("./tests/fixtures/transition_volume", CAMPAIGN_ID)
+        assert tdata.id == CAMPAIGN_ID
+        assert tdata.temp == 200.0
+        assert len(tdata.ylist) > 0
+
+    def test_one_line_file(self, tmp_path):
+        (tmp_path / "c1_transition.txt").write_text("r1,300.0,1.5,2.5\n")
+        tdata = last_record(str(tmp_path), "c1")
+        assert (tdata.id, tdata.temp, tdata.ylist) == ("c1", 300.0, [1.5, 2.5])
+
+    def test_missing_file(self, tmp_path):
+        assert last_record(str(tmp_path), "c1").id == ""
+
+
+class TestBraggData:
+    def test_written_once_and_linked(self, capability):
+        with open("./tests/fixtures/bragg_volume/1743619484_NOM168366tof.gsa", "rb") as f:
+            content = f.read()
+        capability.get_bragg_data(FileType(filename="NOM168366tof.gsa", file=base64.encodebytes(content)))
+        capability.writer.flush()
+
+        volumes = capability.config["volumes"]
+        (name,) = os.listdir(volumes["bragg_volume"])
+        assert name.endswith("_NOM168366tof.gsa")
+        assert os.listdir(volumes["scientist_cloud_volume"]) == [name]
+        path = os.path.join(volumes["bragg_volume"], name)
+        with open(path, "rb") as f:
+            assert f.read() == content
+        assert os.path.samefile(path, os.path.join(volumes["scientist_cloud_volume"], name))
+
+
+    @pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+    def test_compressed(self, capability, encoding):
+        if encoding == "zstd":
+            pytest.importorskip("zstandard")
+        with open("./tests/fixtures/bragg_volume/1743619484_NOM168366tof.gsa", "rb") as f:
+            content = f.read()
+        bragg_file = FileType(
+            filename="NOM168366tof.gsa",
+            file=base64.encodebytes(encode(content, encoding)),
+            encoding=encoding,
+        )
+        capability.get_bragg_data(bragg_file)
+        capability.writer.flush()
+
+        volumes = capability.config["volumes"]
+        (name,) = os.listdir(volumes["scientist_cloud_volume"])
+        with open(os.path.join(volumes["bragg_volume"], name), "rb") as f:
+            assert f.read() == content
+        assert os.listdir(capability.uploads.directory) == []
+
+    def test_versions(self, capability):
+        with open("./tests/fixtures/bragg_volume/1743619484_NOM168366tof.gsa", "rb") as f:
+            content = f.read()
+        adapter = TypeAdapter(FileType)
+        # a version 1 sender (or an older one, without version) puts the Base64 text in the field
+        v1 = adapter.validate_json(
+            json.dumps({"filename": "NOM168366tof.gsa", "file": base64.b64encode(content).decode()})
+        )
+        assert v1.version == 1 and v1.content() == content
+        # a version 2 sender puts the raw content in the field, Base64 only exists on the wire
+        wire = json.dumps(
+            {"filename": "NOM168366tof.gsa", "file": base64.b64encode(content).decode(), "version": 2}
+        )
+        v2 = adapter.validate_json(wire)
+        assert v2.file == content and v2.content() == content
+
+        capability.get_bragg_data(FileType(filename="NOM168366tof.gsa", file=content, version=2))
+        capability.writer.flush()
+        (name,) = os.listdir(capability.config["volumes"]["bragg_volume"])
+        with open(os.path.join(capability.config["volumes"]["bragg_volume"], name), "rb") as f:
+            assert f.read() == content
+
+    def test_invalid_compressed_content(self, capability):
+        bragg_file = FileType(filename="NOM168366tof.gsa", file=base64.encodebytes(b"not gzip"), encoding="gzip")
+        with pytest.raises(ValueError):
+            capability.get_bragg_data(bragg_file)
+        assert os.listdir(capability.uploads.directory) == []
+
+    def test_temp_file_not_created(self, capability, monkeypatch):
+        def not_permitted(path, mode):
+            raise PermissionError(f"cannot create {path}")
+
+        monkeypatch.setattr(dashboard_service, "open", not_permitted, raising=False)
+        content = base64.encodebytes(encode(b"bank 1", "gzip"))
+        bragg_file = FileType(filename="NOM168366tof.gsa", file=content, encoding="gzip")
+        # the error of open is not hidden by the cleanup of the temporary file
+        with pytest.raises(PermissionError):
+            capability.get_bragg_data(bragg_file)
+
+
+class TestChunkedUpload:
+    @pytest.fixture
+    def content(self):
+        with open("./tests/fixtures/bragg_volume/1743619484_NOM168366tof.gsa", "rb") as f:
+            return f.read()
+
+    def begin(self, content: bytes) -> BraggUploadBegin:
+        return BraggUploadBegin(
+            filename="NOM168366tof.gsa", size=len(content), checksum=hashlib.sha256(content).hexdigest()
+        )
+
+    def send(self, capability, status, content: bytes, chunk_size: int, chunks: int = -1):
+        while status.offset < status.size and chunks != 0:
+            data = content[status.offset : status.offset + chunk_size]
+            chunk = BraggChunk(upload_id=status.upload_id, offset=status.offset, data=base64.b64encode(data))
+            status = capability.upload_bragg_chunk(chunk)
+            chunks -= 1
+        return status
+
+    def test_upload(self, capability, content):
+        status = capability.begin_bragg_upload(self.begin(content))
+        assert status.offset == 0
+        status = self.send(capability, status, content, 64 * 1024)
+        # a chunk sent twice is ignored
+        stale = BraggChunk(upload_id=status.upload_id, offset=0, data=base64.b64encode(content[:10]))
+        assert capability.upload_bragg_chunk(stale).offset == len(content)
+
+        status = capability.commit_bragg_upload(BraggUploadCommit(upload_id=status.upload_id))
+        assert status.committed
+        capability.writer.flush()
+        volumes = capability.config["volumes"]
+        (name,) = [f for f in os.listdir(volumes["bragg_volume"]) if not f.startswith(".")]
+        assert name.endswith("_NOM168366tof.gsa")
+        with open(os.path.join(volumes["scientist_cloud_volume"], name), "rb") as f:
+            assert f.read() == content
+        assert os.listdir(capability.uploads.directory) == []
+
+    def test_resume_after_restart(self, capability, content):
+        status = capability.begin_bragg_upload(self.begin(content))
+        status = self.send(capability, status, content, 64 * 1024, chunks=2)
+        capability.writer.flush()
+
+        restarted = DashboardCapability()
+        resumed = restarted.begin_bragg_upload(self.begin(content))
+        assert (resumed.upload_id, resumed.offset) == (status.upload_id, 128 * 1024)
+        resumed = self.send(restarted, resumed, content, 64 * 1024)
+        assert restarted.commit_bragg_upload(BraggUploadCommit(upload_id=resumed.upload_id)).committed
+        restarted.writer.close()
+
+    def test_checksum_mismatch(self, capability, content):
+        begin = self.begin(content)
+        begin.checksum = hashlib.sha256(b"other").hexdigest()
+        status = self.send(capability, capability.begin_bragg_upload(begin), content, 64 * 1024)
+        with pytest.raises(ValueError):
+            capability.commit_bragg_upload(BraggUploadCommit(upload_id=status.upload_id))
+        assert capability.begin_bragg_upload(begin).offset == 0
+
+    def test_failed_write(self, capability, content, monkeypatch):
+        status = capability.begin_bragg_upload(self.begin(content))
+        status = self.send(capability, status, content, 64 * 1024, chunks=1)
+        capability.writer.flush()
+
+        def no_space(path, record, durability):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        with monkeypatch.context() as m:
+            m.setattr(volume_writer, "append_record", no_space)
+            status = self.send(capability, status, content, 64 * 1024)
+            assert status.offset == len(content)
+            with pytest.raises(ValueError):
+                capability.commit_bragg_upload(BraggUploadCommit(upload_id=status.upload_id))
+
+        # the upload resumes after the last chunk written
+        resumed = capability.begin_bragg_upload(self.begin(content))
+        assert resumed.offset == 64 * 1024
+        resumed = self.send(capability, resumed, content, 64 * 1024)
+        assert capability.commit_bragg_upload(BraggUploadCommit(upload_id=resumed.upload_id)).committed
+        capability.writer.flush()
+        (name,) = os.listdir(capability.config["volumes"]["scientist_cloud_volume"])
+        with open(os.path.join(capability.config["volumes"]["scientist_cloud_volume"], name), "rb") as f:
+            assert f.read() == content
+
+    def test_incomplete_upload(self, capability, content):
+        status = capability.begin_bragg_upload(self.begin(content))
+        with pytest.raises(ValueError):
+            capability.commit_bragg_upload(BraggUploadCommit(upload_id=status.upload_id))
+        with pytest.raises(KeyError):
+            capability.commit_bragg_upload(BraggUploadCommit(upload_id="unknown"))
+
+
+class TestTransitionData:
+    def test_records_are_validated(self, capability):
+        capability.get_transition_data_single(TransitionData(id="c1", temp=300.0, ylist=[1.0, 2.0]))
+        capability.get_transition_data_single(TransitionData(id="c1", temp=310.0, ylist=[1.0]))
+        capability.get_transition_data_single(TransitionData(id="c1", temp=320.0, ylist=[1.5, 2.5]))
+        records = read_records(capability, "c1")
+        assert [r[1:] for r in records] == [["300.0", "1.0", "2.0"], ["320.0", "1.5", "2.5"]]
+        status = capability.get_campaign_status("c1")
+        assert (status.width, status.temp, status.records) == (2, 320.0, 2)
+
+    def test_index_is_rebuilt_at_startup(self, capability, monkeypatch):
+        capability.get_transition_data_single(TransitionData(id="c1", temp=300.0, ylist=[1.0, 2.0]))
+        capability.writer.flush()
+
+        # a new capability (service restart) reads the campaigns from the transition volume
+        restarted = DashboardCapability()
+        status = restarted.get_campaign_status("c1")
+        assert (status.width, status.temp, status.records) == (2, 300.0, 1)
+
+        def fail(*args):
+            raise AssertionError("the transition file should not be read again")
+
+        monkeypatch.setattr("dashboard_service.last_record", fail)
+        restarted.get_transition_data_single(TransitionData(id="c1", temp=310.0, ylist=[1.0]))
+        restarted.get_transition_data_single(TransitionData(id="c1", temp=320.0, ylist=[3.0, 4.0]))
+        assert [r[1] for r in read_records(restarted, "c1")] == ["300.0", "320.0"]
+        assert restarted.get_campaign_status("c1").records == 2
+        restarted.writer.close()
+
+    def test_finished_campaign_is_evicted(self, capability):
+        capability.get_transition_data_single(TransitionData(id="c1", temp=300.0, ylist=[1.0, 2.0]))
+        capability.finish_campaign(FinishCampaignMsg(id="c1"))
+        capability.writer.flush()
+        assert sorted(os.listdir(capability.config["volumes"]["scientist_cloud_volume"])) == [
+            "c1.done",
+            "c1.start",
+            "c1_transition.txt",
+        ]
+        assert "c1" not in capability.campaigns
+        assert capability.get_campaign_status("c1").records == 0
+
+        # a late record of the finished campaign is still validated against its file
+        capability.get_transition_data_single(TransitionData(id="c1", temp=310.0, ylist=[1.0]))
+        assert len(read_records(capability, "c1")) == 1
+
+    def test_campaign_start(self, capability):
+        volume = capability.config["volumes"]["scientist_cloud_volume"]
+        # the first measurement of a campaign arrives before its first transition record
+        capability.get_bragg_data(FileType(filename="NOM168366tof.gsa", file=b"bank 1", version=2))
+        capability.writer.flush()
+        (name,) = os.listdir(volume)
+        capability.get_bragg_data(FileType(filename="NOM168367tof.gsa", file=b"bank 2", version=2))
+        capability.get_transition_data_single(TransitionData(id="c1", temp=300.0, ylist=[1.0, 2.0]))
+        capability.writer.flush()
+        with open(os.path.join(volume, "c1.start")) as f:
+            assert f.read() == name.split("_")[0]
+
+        # the bragg files received during a campaign do not start the next one
+        capability.get_bragg_data(FileType(filename="NOM168368tof.gsa", file=b"bank 3", version=2))
+        assert capability.idle_bragg_time is None
+        capability.finish_campaign(FinishCampaignMsg(id="c1"))
+        capability.get_transition_data_single(TransitionData(id="c2", temp=300.0, ylist=[1.0, 2.0]))
+        capability.writer.flush()
+        with open(os.path.join(volume, "c2.start")) as f:
+            assert int(f.read()) >= int(name.split("_")[0])
+
+
+class TestTransitionDataBatch:
+    def test_batch(self, capability, monkeypatch):
+        capability.get_transition_data_single(TransitionData(id="c1", temp=300.0, ylist=[1.0, 2.0]))
+        capability.writer.flush()
+
+        appends = []
+        append = capability.writer.append
+        monkeypatch.setattr(capability.writer, "append", lambda path, data: appends.append(path) or append(path, data))
+        batch = TransitionDataBatch(
+            records=[
+                TransitionData(id="c1", temp=310.0, ylist=[1.0, 2.0]),
+                TransitionData(id="c2", temp=400.0, ylist=[3.0]),
+                TransitionData(id="c1", temp=320.0, ylist=[1.0]),
+                TransitionData(id="c2", temp=410.0, ylist=[4.0]),
+                TransitionData(id="c1", temp=330.0, ylist=[1.5, 2.5]),
+            ]
+        )
+        assert capability.get_transition_data_batch(batch) == 4
+        # one append per campaign and volume
+        assert len(appends) == 4
+        assert [r[1] for r in read_records(capability, "c1")] == ["300.0", "310.0", "330.0"]
+        assert [r[1:] for r in read_records(capability, "c2")] == [["400.0", "3.0"], ["410.0", "4.0"]]
+        assert capability.get_campaign_status("c1").records == 3
+
+
+class TestCampaignIndex:
+    def test_rebuild(self):
+        index = CampaignIndex("./tests/fixtures/transition_volume")
+        assert index.rebuild() == 1
+        status = index.get(CAMPAIGN_ID)
+        assert (status.width, status.temp) == (2, 200.0)
+        with open(f"./tests/fixtures/transition_volume/{CAMPAIGN_ID}_transition.txt") as f:
+            assert status.records == len(f.readlines())
+
+    def test_missing_volume(self, tmp_path):
+        assert CampaignIndex(str(tmp_path / "missing")).rebuild() == 0
@@ -0,0 +1,198 @@
+"""
+File: test_gsa_loader.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the gsa file parser.
+"""
+
+from __future__ import annotations
+import os
+import shutil
+import numpy as np
+from gsa_loader import (
+    load_gsa_file,
+    parse_bank_info,
+    parse_bank_calibration,
+    tof_to_d,
+    sidecar_path,
+    read_sidecar,
+    load_gsa_workspace,
+    build_sidecars,
+    WorkspaceCache,
+)
+import pytest
+
+
+@pytest.fixture
+def scientist_cloud_volume():
+    return "./tests/fixtures/scientist_cloud_volume"
+
+
+@pytest.fixture
+def gsa_copy(tmp_path, scientist_cloud_volume):
+    src = os.path.join(scientist_cloud_volume, "1743619479_NOM168364tof.gsa")
+    return shutil.copy(src, tmp_path / "1743619479_NOM168364tof.gsa")
+
+
+def line_by_line_load(path: str) -> dict:
+    """reference loader which parses the file one line at a time"""
+    gsa_data, rows, bank_id, difc = {}, [], -1, 1.0
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith(("#", "BANK", "Monitor", "Sample")):
+                if "DIFC" in line:
+                    _, _, difc = parse_bank_info(line)
+                if line.startswith("BANK"):
+                    if bank_id != -1:
+                        gsa_data[bank_id] = np.asarray(rows).reshape(-1, 3).T
+                    bank_id, rows = int(line.split()[1]), []
+                continue
+            values = line.split()
+            if len(values) == 3:
+                rows.append([float(values[0]) / difc, float(values[1]), float(values[2])])
+    if rows:
+        gsa_data[bank_id] = np.asarray(rows).T
+    return gsa_data
+
+
+class TestLoadGsaFile:
+    def test_matches_line_by_line(self, scientist_cloud_volume):
+        for file in os.listdir(scientist_cloud_volume):
+            if not file.endswith(".gsa"):
+                continue
+            path = os.path.join(scientist_cloud_volume, file)
+            expected = line_by_line_load(path)
+            gsa_data = load_gsa_file(path)
+            assert list(gsa_data.keys()) == list(expected.keys())
+            for bank_id, arr in expected.items():
+                assert gsa_data[bank_id].shape == arr.shape
+                assert np.array_equal(gsa_data[bank_id], arr)
+
+    def test_malformed_lines_are_skipped(self, tmp_path):
+        path = tmp_path / "malformed.gsa"
+        path.write_text(
+            "# Total flight path   21.510m, tth   15.100deg, DIFC 2.0\n"
+            "BANK 1 3 3 SLOG 1 2 0.1 0 FXYE\n"
+            "  4.0  1.0  0.5\n"
+            "  6.0  2.0\n"
+            "\n"
+            "  8.0  3.0  0.25\n"
+        )
+        gsa_data = load_gsa_file(str(path))
+        assert np.array_equal(gsa_data[1], [[2.0, 4.0], [1.0, 3.0], [0.5, 0.25]])
+
+    def test_misaligned_lines_are_skipped(self, tmp_path):
+        # as many values as three complete lines, but only the last line is complete
+        path = tmp_path / "misaligned.gsa"
+        path.write_text(
+            "# Total flight path   21.510m, tth   15.100deg, DIFC 2.0\n"
+            "BANK 1 3 3 SLOG 1 2 0.1 0 FXYE\n"
+            "  4.0  1.0\n"
+            "  8.0  1.0  0.5  3.0\n"
+            "  12.0  7.0  0.25\n"
+        )
+        gsa_data = load_gsa_file(str(path))
+        assert np.array_equal(gsa_data[1], [[6.0], [7.0], [0.25]])
+
+    def test_missing_file(self, caplog: pytest.LogCaptureFixture):
+        gsa_data = load_gsa_file("./tests/fixtures/does_not_exist.gsa")
+        assert len(gsa_data) == 0
+        assert "failed to load gsa workspace" in caplog.text
+
+
+class TestTofToD:
+    def test_scalar(self):
+        assert tof_to_d(1000.0, 500.0) == 2.0
+        assert isinstance(tof_to_d(1000.0, 500.0), float)
+
+    def test_array_matches_scalar(self):
+        tof = np.linspace(100.0, 20000.0, 50)
+        for difa, tzero in [(0.0, 0.0), (-0.8, 4.0), (0.6, -3.0)]:
+            d = tof_to_d(tof, 1428.8, difa, tzero)
+            expected = [tof_to_d(float(t), 1428.8, difa, tzero) for t in tof]
+            assert np.array_equal(d, expected)
+
+    def test_broadcast_per_bin_constants(self):
+        d = tof_to_d(np.array([10.0, 10.0, 10.0]), 2.0, np.array([0.0, -1.0, 1.0]), 10.0)
+        assert np.array_equal(d, [0.0, 2.0, 0.0])
+
+    def test_no_positive_root(self):
+        tof = np.array([5.0, 50.0])
+        with pytest.raises(ValueError):
+            tof_to_d(tof, 100.0, difa=1.0, tzero=10.0)
+        d = tof_to_d(tof, 100.0, difa=1.0, tzero=10.0, errors="nan")
+        assert np.isnan(d[0]) and not np.isnan(d[1])
+
+    def test_no_real_root(self):
+        with pytest.raises(ValueError):
+            tof_to_d(np.array([1.0e6]), 100.0, difa=-1.0)
+
+    def test_parse_bank_calibration(self):
+        line = "# Total flight path   21.510m, tth   15.100deg, DIFC 1428.8, DIFA -0.5, TZERO 3.2"
+        assert parse_bank_calibration(line) == (-0.5, 3.2)
+        assert parse_bank_calibration("# Total flight path   21.510m, tth   15.100deg, DIFC 1428.8") == (0.0, 0.0)
+
+
+class TestSidecar:
+    def test_roundtrip(self, gsa_copy):
+        path = str(gsa_copy)
+        assert read_sidecar(path) is None
+        parsed = load_gsa_workspace(path)
+        assert os.path.exists(sidecar_path(path))
+
+        mapped = read_sidecar(path)
+        assert isinstance(mapped[1], np.memmap)
+        assert list(mapped.keys()) == list(parsed.keys())
+        for bank_id, arr in parsed.items():
+            assert np.array_equal(mapped[bank_id], arr)
+
+    def test_stale_sidecar(self, gsa_copy):
+        path = str(gsa_copy)
+        load_gsa_workspace(path)
+        with open(path, "a") as f:
+            f.write("  30000.0  1.0  1.0\n")
+        assert read_sidecar(path) is None
+        gsa_data = load_gsa_workspace(path)
+        assert gsa_data[6][0][-1] == tof_to_d(30000.0, 836.206546490)
+        assert read_sidecar(path) is not None
+
+    def test_build_sidecars(self, gsa_copy, tmp_path):
+        shutil.copy(gsa_copy, tmp_path / "1743619481_NOM168365tof.gsa")
+        assert build_sidecars(str(tmp_path), np.float32) == 2
+        assert build_sidecars(str(tmp_path)) == 0
+        mapped = read_sidecar(str(gsa_copy))
+        assert mapped[1].dtype == np.float32
+        assert np.allclose(mapped[1], load_gsa_file(str(gsa_copy))[1])
+
+
+class TestWorkspaceCache:
+    def test_hits_and_misses(self, gsa_copy):
+        cache = WorkspaceCache()
+        first = cache.get(str(gsa_copy))
+        second = cache.get(str(gsa_copy))
+        assert first is second
+        assert not first[1].flags.writeable
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+        assert stats["nbytes"] == sum(arr.nbytes for arr in first.values())
+
+    def test_changed_file_is_reloaded(self, gsa_copy):
+        cache = WorkspaceCache()
+        first = cache.get(str(gsa_copy))
+        with open(gsa_copy, "a") as f:
+            f.write("  30000.0  1.0  1.0\n")
+        second = cache.get(str(gsa_copy))
+        assert second is not first
+        assert second[6].shape[1] == first[6].shape[1] + 1
+        assert cache.stats()["entries"] == 1
+
+    def test_lru_eviction(self, gsa_copy, tmp_path):
+        other = shutil.copy(gsa_copy, tmp_path / "1743619481_NOM168365tof.gsa")
+        cache = WorkspaceCache()
+        nbytes = sum(arr.nbytes for arr in cache.get(str(gsa_copy)).values())
+        cache.resize(nbytes)
+        cache.get(str(other))
+        stats = cache.stats()
+        assert (stats["entries"], stats["evictions"]) == (1, 1)
+        cache.get(str(other))
+        assert cache.stats()["hits"] == 1
@@ -0,0 +1,53 @@
+"""
+File: test_payload_codec.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the compression of the files sent in the messages.
+"""
+
+from __future__ import annotations
+import payload_codec
+from payload_codec import encode, iter_decoded
+from clients.schema import encode_file
+import pytest
+
+
+@pytest.fixture
+def content():
+    with open("./tests/fixtures/bragg_volume/1743619484_NOM168366tof.gsa", "rb") as f:
+        return f.read()
+
+
+class TestPayloadCodec:
+    @pytest.mark.parametrize("encoding", ["none", "gzip", "zstd"])
+    def test_roundtrip(self, content, encoding):
+        if encoding == "zstd":
+            pytest.importorskip("zstandard")
+        encoded = encode(content, encoding)
+        if encoding != "none":
+            assert len(encoded) < len(content) / 2
+        blocks = list(iter_decoded(encoded, encoding, block_size=4096))
+        assert max(len(block) for block in blocks) <= 4096
+        assert b"".join(blocks) == content
+
+    @pytest.mark.parametrize("encoding", ["none", "gzip", "zstd"])
+    def test_client_roundtrip(self, content, encoding):
+        # the clients compress the files with their own copy of encode
+        if encoding == "zstd":
+            pytest.importorskip("zstandard")
+        assert b"".join(iter_decoded(encode_file(content, encoding), encoding)) == content
+
+    def test_invalid_content(self, content):
+        with pytest.raises(ValueError):
+            list(iter_decoded(b"not gzip", "gzip"))
+        with pytest.raises(ValueError):
+            list(iter_decoded(encode(content, "gzip")[:-100], "gzip"))
+
+    def test_unknown_encoding(self, content):
+        with pytest.raises(ValueError):
+            encode(content, "brotli")
+
+    def test_zstd_not_installed(self, content, monkeypatch):
+        monkeypatch.setattr(payload_codec, "zstandard", None)
+        with pytest.raises(ValueError):
+            encode(content, "zstd")
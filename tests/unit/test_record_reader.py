@@ -0,0 +1,106 @@
+"""
+File: test_record_reader.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the record file readers.
+"""
+
+from __future__ import annotations
+import shutil
+import numpy as np
+from record_reader import TransitionReader, read_last_line
+import pytest
+
+
+@pytest.fixture
+def transition_file(tmp_path):
+    src = "./tests/fixtures/transition_volume/cb199084-91ec-4b9b-898d-024d1920b8cb_transition.txt"
+    return str(shutil.copy(src, tmp_path / "cb199084-91ec-4b9b-898d-024d1920b8cb_transition.txt"))
+
+
+class TestReadLastLine:
+    def test_last_line(self):
+        last_line = read_last_line("./tests/fixtures/andie_volume/andie.txt", block_size=16)
+        assert last_line.strip().split(",")[1] == "8cdcb065-4b0f-4473-bfb7-d715965f8e13"
+        assert last_line.endswith("\n")
+
+    def test_no_trailing_newline(self, tmp_path):
+        path = tmp_path / "andie.txt"
+        path.write_text("a,1\nb,2\nc,3")
+        assert read_last_line(str(path), block_size=2) == "c,3"
+
+    def test_complete_skips_partial_line(self, tmp_path):
+        path = tmp_path / "andie.txt"
+        path.write_text("a,1\nb,2\nc,")
+        assert read_last_line(str(path), block_size=2, complete=True) == "b,2\n"
+        path.write_text("c,")
+        assert read_last_line(str(path), complete=True) == ""
+
+    def test_single_line(self, tmp_path):
+        path = tmp_path / "andie.txt"
+        path.write_text("a,1\n")
+        assert read_last_line(str(path), block_size=2) == "a,1\n"
+
+    def test_empty_and_missing_file(self, tmp_path):
+        path = tmp_path / "andie.txt"
+        path.write_text("")
+        assert read_last_line(str(path)) == ""
+        assert read_last_line(str(tmp_path / "missing.txt")) == ""
+
+
+class TestTransitionReader:
+    def test_refresh(self, transition_file):
+        reader = TransitionReader(transition_file, capacity=4)
+        assert reader.refresh() == 33
+        assert reader.last_id == "6fb0c800-b960-4af7-a6e1-3ebbf73c2a6d"
+        assert reader.temp.shape == (33,)
+        assert reader.ylist.shape == (33, 2)
+        assert reader.temp[0] == 284.89
+        assert reader.ylist[0, 1] == 1.5583828040832086
+        assert reader.refresh() == 0
+
+    def test_only_appended_records_are_read(self, transition_file):
+        reader = TransitionReader(transition_file)
+        reader.refresh()
+        temp = reader.temp
+        with open(transition_file, "a") as f:
+            f.write("new-id,300.5,1.0,2.0\n")
+            f.write("partial-id,301.5,1.0")
+        assert reader.refresh() == 1
+        assert reader.last_id == "new-id"
+        assert np.array_equal(reader.temp[:-1], temp)
+        with open(transition_file, "a") as f:
+            f.write(",3.0\n")
+        assert reader.refresh() == 1
+        assert reader.last_id == "partial-id"
+        assert np.array_equal(reader.ylist[-1], [1.0, 3.0])
+
+    def test_malformed_record_is_skipped(self, transition_file):
+        reader = TransitionReader(transition_file)
+        reader.refresh()
+        with open(transition_file, "a") as f:
+            f.write("first-id,300.5,1.0,2.0\n")
+            f.write("corrupt-id,301.5,1.0,not-a-number\n")
+            f.write("short-id,302.5\n")
+            f.write("last-id,303.5,3.0,4.0\n")
+        assert reader.refresh() == 2
+        assert reader.last_id == "last-id"
+        assert np.array_equal(reader.temp[-2:], [300.5, 303.5])
+        assert np.array_equal(reader.ylist[-1], [3.0, 4.0])
+        # the malformed records are not read again
+        assert reader.refresh() == 0
+        assert len(reader) == 35
+
+    def test_truncated_file_is_read_again(self, transition_file):
+        reader = TransitionReader(transition_file)
+        reader.refresh()
+        with open(transition_file, "w") as f:
+            f.write("only-id,100.0,1.0,2.0\n")
+        assert reader.refresh() == 1
+        assert len(reader) == 1
+        assert reader.last_id == "only-id"
+
+    def test_missing_file(self, tmp_path):
+        reader = TransitionReader(str(tmp_path / "missing_transition.txt"))
+        assert reader.refresh() == 0
+        assert reader.last_id == ""
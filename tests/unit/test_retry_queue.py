@@ -0,0 +1,107 @@
+"""
+File: test_retry_queue.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the persistent queue of the failed uploads.
+"""
+
+from __future__ import annotations
+import time
+import threading
+import concurrent.futures
+import pytest
+from retry_queue import RetryQueue, RetryScheduler
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = RetryQueue(str(tmp_path / "retry.sqlite3"), base_delay=2, max_delay=60, max_age=3600)
+    yield queue
+    queue.close()
+
+
+class TestRetryQueue:
+    def test_backoff(self, queue):
+        for attempts in range(1, 10):
+            delay = min(60, 2 * 2 ** (attempts - 1))
+            assert delay / 2 <= queue.delay(attempts) <= delay
+
+    def test_push(self, queue):
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", "timeout", now=1000)
+        assert "utk/bragg/a.gsa" in queue
+        assert queue.due(now=1000) == []
+        assert queue.due(now=1002) == [("utk/bragg/a.gsa", "/volume/a.gsa")]
+        assert 1001 <= queue.next_due() <= 1002
+
+        # the next attempt waits longer
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", "timeout", now=1002)
+        assert 1004 <= queue.next_due() <= 1006
+        assert len(queue) == 1
+
+        queue.remove("utk/bragg/a.gsa")
+        assert "utk/bragg/a.gsa" not in queue
+        assert queue.next_due() is None
+
+    def test_max_age(self, queue):
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", "timeout", now=1000)
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", "access denied", now=1000 + 3600)
+        # given up, but kept so a scan does not upload it again
+        assert "utk/bragg/a.gsa" in queue
+        assert queue.due(now=1e12) == []
+        assert queue.failed() == [("utk/bragg/a.gsa", "/volume/a.gsa", 2, "access denied")]
+
+    def test_clear_failed(self, queue):
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", "timeout", now=1000)
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", "access denied", now=1000 + 3600)
+        queue.push("utk/bragg/b.gsa", "/volume/b.gsa", "timeout", now=1000 + 3600)
+        assert queue.clear_failed() == [("utk/bragg/a.gsa", "/volume/a.gsa", 2, "access denied")]
+        assert "utk/bragg/a.gsa" not in queue
+        # the uploads still being retried are kept
+        assert "utk/bragg/b.gsa" in queue
+        assert queue.failed() == []
+
+    def test_persistent(self, tmp_path):
+        queue = RetryQueue(str(tmp_path / "retry.sqlite3"))
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", now=1000)
+        queue.close()
+        queue = RetryQueue(str(tmp_path / "retry.sqlite3"))
+        assert queue.due(now=1e12) == [("utk/bragg/a.gsa", "/volume/a.gsa")]
+        queue.close()
+
+
+class TestRetryScheduler:
+    def test_run_pending(self, queue):
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", now=0)
+        release = threading.Event()
+        submitted = []
+
+        def submit(key, local_path):
+            submitted.append(key)
+            return executor.submit(release.wait, 1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            scheduler = RetryScheduler(queue, submit)
+            futures = scheduler.run_pending()
+            # an upload being retried is not submitted again
+            assert scheduler.run_pending() == []
+            release.set()
+            concurrent.futures.wait(futures)
+            assert len(scheduler.run_pending()) == 1
+        assert submitted == ["utk/bragg/a.gsa", "utk/bragg/a.gsa"]
+
+    def test_thread(self, queue):
+        queue.push("utk/bragg/a.gsa", "/volume/a.gsa", now=time.time() - 10)
+        retried = threading.Event()
+
+        def submit(key, local_path):
+            queue.remove(key)
+            retried.set()
+            future = concurrent.futures.Future()
+            future.set_result(key)
+            return future
+
+        scheduler = RetryScheduler(queue, submit, poll_interval=0.05)
+        scheduler.start()
+        assert retried.wait(1)
+        scheduler.stop()
+        assert len(queue) == 0
@@ -0,0 +1,434 @@
+"""
+File: test_storage_service.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the storage service, against a local S3 stand-in (moto).
+"""
+
+from __future__ import annotations
+import os
+import json
+import time
+import zlib
+import hashlib
+import shutil
+import concurrent.futures
+import pytest
+
+pytest.importorskip("moto")
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+import storage_service  # noqa: E402
+from storage_service import (  # noqa: E402
+    ScanTrigger,
+    check_if_key_exists,
+    checksum,
+    configure_transfer,
+    get_client,
+    reconcile,
+    retry_upload,
+    scan,
+    start_watcher,
+    upload,
+    upload_with_retry,
+)
+from retry_queue import RetryQueue, RetryScheduler  # noqa: E402
+from volume_watcher import inotify_available  # noqa: E402
+from upload_manifest import UploadManifest  # noqa: E402
+
+CAMPAIGN_ID = "cb199084-91ec-4b9b-898d-024d1920b8cb"
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setenv("BUCKET_NAME", "nsdf-intersect")
+    monkeypatch.setenv("ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.delenv("ENDPOINT_URL", raising=False)
+    monkeypatch.setattr(storage_service, "_client", None)
+    # restored after configure_transfer
+    monkeypatch.setattr(storage_service, "_transfer", storage_service._transfer)
+    monkeypatch.setattr(storage_service.dotenv, "load_dotenv", lambda: None)
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="nsdf-intersect")
+        yield "nsdf-intersect"
+
+
+@pytest.fixture
+def config(tmp_path):
+    volume = tmp_path / "scientist_cloud_volume"
+    volume.mkdir()
+    fixtures = "./tests/fixtures/scientist_cloud_volume"
+    for file in ["1743619477_NOM168363tof.gsa", "1743619479_NOM168364tof.gsa", f"{CAMPAIGN_ID}_transition.txt"]:
+        shutil.copy(os.path.join(fixtures, file), volume / file)
+    return {
+        "volumes": {"scientist_cloud_volume": str(volume)},
+        "scan_period": 30,
+        "sci_cloud": {"bucket_prefix": "utk", "bragg_prefix": "bragg", "transition_prefix": "transition"},
+    }
+
+
+def list_keys(bucket: str) -> list:
+    response = boto3.client("s3", region_name="us-east-1").list_objects_v2(Bucket=bucket)
+    return sorted(obj["Key"] for obj in response.get("Contents", []))
+
+
+class TestClient:
+    def test_client_is_shared(self, bucket):
+        client = get_client()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: get_client(), range(16)))
+        assert all(c is client for c in clients)
+        assert client.meta.config.max_pool_connections == storage_service.MAX_WORKERS
+
+    def test_check_if_key_exists(self, bucket):
+        get_client().put_object(Bucket=bucket, Key="utk/bragg/a.gsa", Body=b"bank 1")
+        assert check_if_key_exists("utk/bragg/a.gsa")
+        assert not check_if_key_exists("utk/bragg/b.gsa")
+        assert not check_if_key_exists("")
+
+
+class TestScan:
+    def test_scan(self, bucket, config):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        open(os.path.join(volume, f"{CAMPAIGN_ID}.done"), "w").close()
+        open(os.path.join(volume, ".1743619481_NOM168365tof.gsa.0a1b2c3d.tmp"), "w").close()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            uploaded = scan(config, executor)
+            assert sorted(uploaded) == [
+                "1743619477_NOM168363tof.gsa",
+                "1743619479_NOM168364tof.gsa",
+                f"{CAMPAIGN_ID}_transition.txt",
+            ]
+            assert list_keys(bucket) == [
+                "utk/bragg/1743619477_NOM168363tof.gsa",
+                "utk/bragg/1743619479_NOM168364tof.gsa",
+                f"utk/transition/{CAMPAIGN_ID}_transition.txt",
+            ]
+            assert not os.path.exists(os.path.join(volume, f"{CAMPAIGN_ID}.done"))
+
+            # the executor is reused, and the files already uploaded are not uploaded again
+            assert scan(config, executor) == []
+
+
+class TestManifest:
+    @pytest.fixture
+    def heads(self, monkeypatch):
+        keys = []
+        get_object_size = storage_service.get_object_size
+
+        def counted(key):
+            keys.append(key)
+            return get_object_size(key)
+
+        monkeypatch.setattr(storage_service, "get_object_size", counted)
+        return keys
+
+    def test_scan_checks_new_files(self, bucket, config, heads):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        manifest = UploadManifest(os.path.join(volume, storage_service.MANIFEST_PATH))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            assert len(scan(config, executor, manifest)) == 2
+            assert len(heads) == 2
+            assert len(manifest) == 2
+
+            # the uploaded files are not checked again
+            heads.clear()
+            assert scan(config, executor, manifest) == []
+            assert heads == []
+
+            # a changed file is uploaded again, without a check
+            with open(os.path.join(volume, "1743619477_NOM168363tof.gsa"), "a") as f:
+                f.write("\n")
+            assert scan(config, executor, manifest) == ["1743619477_NOM168363tof.gsa"]
+            assert heads == []
+        manifest.close()
+
+    def test_reconcile(self, bucket, config, heads):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        for file in ["1743619477_NOM168363tof.gsa", "1743619479_NOM168364tof.gsa"]:
+            get_client().upload_file(os.path.join(volume, file), bucket, f"utk/bragg/{file}")
+
+        manifest = UploadManifest(os.path.join(volume, storage_service.MANIFEST_PATH))
+        reconcile(config, manifest)
+        assert len(manifest) == 2
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            # the objects already in the bucket are neither checked nor uploaded
+            assert scan(config, executor, manifest) == []
+            assert heads == []
+
+            # a deleted object is uploaded again after the next reconciliation
+            get_client().delete_object(Bucket=bucket, Key="utk/bragg/1743619477_NOM168363tof.gsa")
+            reconcile(config, manifest)
+            assert scan(config, executor, manifest) == ["1743619477_NOM168363tof.gsa"]
+        manifest.close()
+
+
+class TestChecksum:
+    @pytest.mark.parametrize("in_memory_max_mb", [64, 0])
+    def test_upload_checksum(self, bucket, config, in_memory_max_mb):
+        configure_transfer({"transfer": {"in_memory_max_mb": in_memory_max_mb}})
+        volume = config["volumes"]["scientist_cloud_volume"]
+        # the path of the file is not passed to a shell
+        local_filepath = os.path.join(volume, "NOM 168363tof.gsa")
+        os.rename(os.path.join(volume, "1743619477_NOM168363tof.gsa"), local_filepath)
+        with open(local_filepath, "rb") as f:
+            data = f.read()
+
+        assert upload_with_retry(local_filepath, "utk/bragg/a.gsa", config) == "NOM 168363tof.gsa"
+        response = get_client().get_object(Bucket=bucket, Key="utk/bragg/a.gsa")
+        assert response["Body"].read() == data
+        assert response["Metadata"] == {"checksum": str(zlib.crc32(data)), "checksum-algorithm": "crc32"}
+
+    def test_checksum_blocks(self, config):
+        path = os.path.join(config["volumes"]["scientist_cloud_volume"], "1743619477_NOM168363tof.gsa")
+        with open(path, "rb") as f:
+            expected = zlib.crc32(f.read())
+            f.seek(0)
+            assert checksum(f, block_size=1000) == expected
+
+
+class TestTransfer:
+    def test_multipart_upload(self, bucket, config, monkeypatch):
+        transfer = configure_transfer(
+            {
+                "transfer": {
+                    "multipart_threshold_mb": 5,
+                    "multipart_chunksize_mb": 5,
+                    "max_concurrency": 2,
+                    "max_in_flight_mb": 8,
+                }
+            }
+        )
+        sent = []
+        monkeypatch.setattr(transfer.limiter, "acquire", sent.append)
+
+        local_filepath = os.path.join(config["volumes"]["scientist_cloud_volume"], "large.gsa")
+        data = os.urandom(12 * 1024 * 1024)
+        with open(local_filepath, "wb") as f:
+            f.write(data)
+
+        upload_with_retry(local_filepath, "utk/bragg/large.gsa", config)
+        response = get_client().get_object(Bucket=bucket, Key="utk/bragg/large.gsa")
+        assert response["Body"].read() == data
+        # 3 parts of at most 5 MB
+        assert response["ETag"].endswith('-3"')
+        # every byte sent went through the rate limiter
+        assert sum(sent) == len(data)
+        assert transfer.budget.in_flight == 0
+
+
+class TestRetry:
+    def test_failed_upload_is_queued(self, bucket, config, monkeypatch):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        # retried as soon as they failed
+        retries = RetryQueue(os.path.join(volume, storage_service.RETRY_FILE), base_delay=0)
+        monkeypatch.setenv("BUCKET_NAME", "missing-bucket")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            start = time.monotonic()
+            assert scan(config, executor, retries=retries) == []
+            # the failures do not sleep on the threads of the executor
+            assert time.monotonic() - start < 5
+            assert len(retries) == 2
+            assert "utk/bragg/1743619477_NOM168363tof.gsa" in retries
+
+            # the next scan leaves them to the retry scheduler
+            monkeypatch.setenv("BUCKET_NAME", bucket)
+            assert scan(config, executor, retries=retries) == []
+
+            scheduler = RetryScheduler(
+                retries,
+                lambda key, local_path: executor.submit(upload, local_path, key, config, None, retries),
+            )
+            futures = scheduler.run_pending()
+            assert sorted(f.result() for f in futures) == [
+                "1743619477_NOM168363tof.gsa",
+                "1743619479_NOM168364tof.gsa",
+            ]
+        assert len(retries) == 0
+        assert len(list_keys(bucket)) == 2
+        retries.close()
+
+    def test_given_up_upload_is_scanned_after_reconcile(self, bucket, config):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        retries = RetryQueue(os.path.join(volume, storage_service.RETRY_FILE), max_age=0)
+        key = "utk/bragg/1743619477_NOM168363tof.gsa"
+        retries.push(key, os.path.join(volume, "1743619477_NOM168363tof.gsa"), "access denied")
+        assert retries.failed() != []
+        manifest = UploadManifest(os.path.join(volume, storage_service.MANIFEST_PATH))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            # skipped until the next reconciliation
+            assert scan(config, executor, manifest, retries) == ["1743619479_NOM168364tof.gsa"]
+            assert scan(config, executor, manifest, retries) == []
+            reconcile(config, manifest, retries)
+            assert key not in retries
+            assert scan(config, executor, manifest, retries) == ["1743619477_NOM168363tof.gsa"]
+        manifest.close()
+        retries.close()
+
+    def test_deleted_file_is_not_queued(self, bucket, config):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        retries = RetryQueue(os.path.join(volume, storage_service.RETRY_FILE))
+        retries.push("utk/bragg/deleted.gsa", os.path.join(volume, "deleted.gsa"))
+        with pytest.raises(FileNotFoundError):
+            upload_with_retry(os.path.join(volume, "deleted.gsa"), "utk/bragg/deleted.gsa", config, retries=retries)
+        assert len(retries) == 0
+        retries.close()
+
+
+class TestWatch:
+    def test_scan_files(self, bucket, config):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            # only the files given are checked
+            assert scan(config, executor, files=["1743619479_NOM168364tof.gsa"]) == ["1743619479_NOM168364tof.gsa"]
+        assert list_keys(bucket) == ["utk/bragg/1743619479_NOM168364tof.gsa"]
+
+    def test_trigger(self):
+        trigger = ScanTrigger()
+        for filename in ["a.gsa", ".a.gsa.0a1b2c3d.tmp", "retry.txt", "cb199084.done"]:
+            trigger.on_event("scientist_cloud_volume", filename)
+        assert trigger.wait(0) == (False, {"a.gsa", "cb199084.done"})
+        assert trigger.wait(0) == (False, set())
+        trigger.on_event("scientist_cloud_volume", "")
+        assert trigger.wait(0) == (True, set())
+
+    def test_poll_mode(self, config):
+        assert start_watcher(config, ScanTrigger()) is None
+
+    @pytest.mark.skipif(not inotify_available(), reason="inotify is not available")
+    def test_inotify_triggers_upload(self, config):
+        config["watch"] = {"mode": "inotify"}
+        volume = config["volumes"]["scientist_cloud_volume"]
+        trigger = ScanTrigger()
+        watcher = start_watcher(config, trigger)
+        try:
+            # the full scan requested when the watch is added
+            assert trigger.wait(1) == (True, set())
+            shutil.copy(
+                os.path.join(volume, "1743619477_NOM168363tof.gsa"),
+                os.path.join(volume, "1743619481_NOM168365tof.gsa"),
+            )
+            open(os.path.join(volume, f"{CAMPAIGN_ID}.done"), "w").close()
+            files = set()
+            deadline = time.monotonic() + 2
+            while len(files) < 2 and time.monotonic() < deadline:
+                files |= trigger.wait(deadline - time.monotonic())[1]
+            assert files == {"1743619481_NOM168365tof.gsa", f"{CAMPAIGN_ID}.done"}
+        finally:
+            watcher.stop()
+
+
+class TestBundle:
+    def test_bundle_on_done(self, bucket, config):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        shutil.copy("./tests/fixtures/scientist_cloud_volume/andie.txt", os.path.join(volume, "andie.txt"))
+        config["bundle"] = {"enabled": True, "encoding": "gzip"}
+        manifest = UploadManifest(os.path.join(volume, storage_service.MANIFEST_PATH))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            # the gsa files wait for the bundle of their campaign
+            assert scan(config, executor, manifest) == []
+
+            open(os.path.join(volume, f"{CAMPAIGN_ID}.done"), "w").close()
+            assert scan(config, executor, manifest) == [f".{CAMPAIGN_ID}_bundle.tar.gz"]
+            assert list_keys(bucket) == [f"utk/bundle/{CAMPAIGN_ID}_bundle.tar.gz"]
+            assert not os.path.exists(os.path.join(volume, f"{CAMPAIGN_ID}.done"))
+            assert not os.path.exists(os.path.join(volume, f".{CAMPAIGN_ID}_bundle.tar.gz"))
+
+            # the files of the bundle are not uploaded one by one once they waited long enough
+            config["bundle"]["max_wait_hours"] = 0
+            assert manifest.get("utk/bragg/1743619477_NOM168363tof.gsa")["bundle"] == (
+                f"utk/bundle/{CAMPAIGN_ID}_bundle.tar.gz"
+            )
+            assert scan(config, executor, manifest) == []
+
+            # unless their bundle was deleted
+            get_client().delete_object(Bucket=bucket, Key=f"utk/bundle/{CAMPAIGN_ID}_bundle.tar.gz")
+            reconcile(config, manifest)
+            assert sorted(scan(config, executor, manifest)) == [
+                "1743619477_NOM168363tof.gsa",
+                "1743619479_NOM168364tof.gsa",
+            ]
+        manifest.close()
+
+    def test_failed_bundle_is_queued(self, bucket, config):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        shutil.copy("./tests/fixtures/scientist_cloud_volume/andie.txt", os.path.join(volume, "andie.txt"))
+        config["bundle"] = {"enabled": True, "encoding": "gzip"}
+        retries = RetryQueue(os.path.join(volume, storage_service.RETRY_FILE), base_delay=0)
+        transition = os.path.join(volume, f"{CAMPAIGN_ID}_transition.txt")
+        os.rename(transition, transition + ".moved")
+        open(os.path.join(volume, f"{CAMPAIGN_ID}.done"), "w").close()
+        key = f"utk/bundle/{CAMPAIGN_ID}_bundle.tar.gz"
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            assert scan(config, executor, retries=retries) == []
+            assert key in retries
+
+            # the next scan leaves it to the retry scheduler, which packs it again
+            assert scan(config, executor, retries=retries) == []
+            os.rename(transition + ".moved", transition)
+            scheduler = RetryScheduler(
+                retries,
+                lambda key, local_path: executor.submit(retry_upload, key, local_path, config, None, retries),
+            )
+            futures = scheduler.run_pending()
+            assert [f.result() for f in futures] == [f".{CAMPAIGN_ID}_bundle.tar.gz"]
+        assert len(retries) == 0
+        assert list_keys(bucket) == [key]
+        retries.close()
+
+
+class TestDedup:
+    @pytest.fixture
+    def requests(self, bucket, monkeypatch):
+        """counts the requests sent to the bucket, by operation"""
+        counts = {}
+        client = get_client()
+        client.meta.events.register(
+            "before-call.s3.*", lambda model, **kwargs: counts.__setitem__(model.name, counts.get(model.name, 0) + 1)
+        )
+        return counts
+
+    def test_repeated_send(self, bucket, config, requests):
+        volume = config["volumes"]["scientist_cloud_volume"]
+        config["dedup"] = {"enabled": True}
+        # the same run received again under another timestamp
+        shutil.copy(
+            os.path.join(volume, "1743619477_NOM168363tof.gsa"),
+            os.path.join(volume, "1743619600_NOM168363tof.gsa"),
+        )
+        with open(os.path.join(volume, "1743619477_NOM168363tof.gsa"), "rb") as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        manifest = UploadManifest(os.path.join(volume, storage_service.MANIFEST_PATH))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            assert scan(config, executor, manifest, files=["1743619477_NOM168363tof.gsa"]) == [
+                "1743619477_NOM168363tof.gsa"
+            ]
+            assert list_keys(bucket) == ["utk/aliases/NOM168363tof.json", f"utk/blobs/{sha256}"]
+
+            requests.clear()
+            assert scan(config, executor, manifest, files=["1743619600_NOM168363tof.gsa"]) == [
+                "1743619600_NOM168363tof.gsa"
+            ]
+            # the content is not uploaded again, only the alias manifest is read and written
+            assert requests == {"GetObject": 1, "PutObject": 1}
+            assert len(list_keys(bucket)) == 2
+
+            requests.clear()
+            assert scan(config, executor, manifest) == ["1743619479_NOM168364tof.gsa"]
+            assert requests["PutObject"] == 2
+
+        aliases = json.loads(get_client().get_object(Bucket=bucket, Key="utk/aliases/NOM168363tof.json")["Body"].read())
+        assert aliases["run"] == "NOM168363tof.gsa"
+        assert sorted(aliases["aliases"]) == ["1743619477_NOM168363tof.gsa", "1743619600_NOM168363tof.gsa"]
+        assert aliases["aliases"]["1743619600_NOM168363tof.gsa"]["blob"] == f"utk/blobs/{sha256}"
+
+        # the files whose blob was deleted are uploaded again
+        get_client().delete_object(Bucket=bucket, Key=f"utk/blobs/{sha256}")
+        reconcile(config, manifest)
+        assert "utk/bragg/1743619477_NOM168363tof.gsa" not in manifest
+        assert "utk/bragg/1743619479_NOM168364tof.gsa" in manifest
+        manifest.close()
@@ -0,0 +1,95 @@
+"""
+File: test_transfer_limits.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the transfer settings and limits of the storage service.
+"""
+
+from __future__ import annotations
+import time
+import threading
+import pytest
+
+pytest.importorskip("boto3")
+
+from transfer_limits import MB, ByteBudget, RateLimiter, Transfer  # noqa: E402
+
+
+class TestRateLimiter:
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        start = time.monotonic()
+        limiter.acquire(1 << 40)
+        assert time.monotonic() - start < 0.1
+
+    def test_rate(self):
+        # a burst of 10 KB, then 10 KB/s
+        limiter = RateLimiter(10_000)
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.acquire(5_000)
+        assert 0.9 <= time.monotonic() - start < 1.5
+
+    def test_shared_by_threads(self):
+        limiter = RateLimiter(100_000, burst=1)
+        threads = [threading.Thread(target=lambda: [limiter.acquire(5_000) for _ in range(5)]) for _ in range(4)]
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 100 KB at 100 KB/s
+        assert 0.9 <= time.monotonic() - start < 1.5
+
+
+class TestByteBudget:
+    def test_blocks_until_released(self):
+        budget = ByteBudget(10)
+        budget.acquire(6)
+        acquired = threading.Event()
+        t = threading.Thread(target=lambda: (budget.acquire(6), acquired.set()))
+        t.start()
+        assert not acquired.wait(0.1)
+        budget.release(6)
+        assert acquired.wait(1)
+        t.join()
+        assert budget.in_flight == 6
+
+    def test_larger_than_budget(self):
+        budget = ByteBudget(10)
+        with budget.reserve(100):
+            assert budget.in_flight == 100
+        assert budget.in_flight == 0
+
+    def test_unlimited(self):
+        budget = ByteBudget()
+        budget.acquire(1 << 40)
+        budget.acquire(1 << 40)
+        assert budget.in_flight == 2 << 40
+
+
+class TestTransfer:
+    def test_from_config(self):
+        transfer = Transfer.from_config(
+            {
+                "multipart_threshold_mb": 16,
+                "multipart_chunksize_mb": 8,
+                "max_concurrency": 2,
+                "max_bandwidth_mb": 1.5,
+                "max_in_flight_mb": 64,
+                "in_memory_max_mb": 16,
+            }
+        )
+        assert transfer.config.multipart_threshold == 16 * MB
+        assert transfer.config.multipart_chunksize == 8 * MB
+        assert transfer.config.max_concurrency == 2
+        assert transfer.limiter.rate == 1.5 * MB
+        assert transfer.budget.max_bytes == 64 * MB
+        assert transfer.in_memory_max == 16 * MB
+
+    def test_defaults(self):
+        transfer = Transfer.from_config({})
+        assert transfer.config.multipart_threshold == 8 * MB
+        assert not transfer.limiter.rate
+        assert not transfer.budget.max_bytes
+        assert transfer.in_memory_max == 64 * MB
@@ -0,0 +1,72 @@
+"""
+File: test_upload_manifest.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the manifest of the uploaded files.
+"""
+
+from __future__ import annotations
+import os
+import pytest
+from upload_manifest import UploadManifest
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = UploadManifest(str(tmp_path / "manifest.sqlite3"))
+    yield manifest
+    manifest.close()
+
+
+@pytest.fixture
+def gsa(tmp_path):
+    path = tmp_path / "1743619477_NOM168363tof.gsa"
+    path.write_bytes(b"bank 1\n")
+    return path
+
+
+class TestUploadManifest:
+    def test_record(self, manifest, gsa):
+        stat = os.stat(gsa)
+        assert not manifest.is_current("utk/bragg/a.gsa", stat)
+        manifest.record("utk/bragg/a.gsa", stat.st_size, stat.st_mtime_ns, "1234")
+        assert manifest.is_current("utk/bragg/a.gsa", stat)
+        assert manifest.get("utk/bragg/a.gsa")["checksum"] == "1234"
+        assert len(manifest) == 1
+
+    def test_changed_file(self, manifest, gsa):
+        stat = os.stat(gsa)
+        manifest.record("utk/bragg/a.gsa", stat.st_size, stat.st_mtime_ns)
+        gsa.write_bytes(b"bank 1\nbank 2\n")
+        assert not manifest.is_current("utk/bragg/a.gsa", os.stat(gsa))
+
+    def test_persistent(self, tmp_path, gsa):
+        stat = os.stat(gsa)
+        manifest = UploadManifest(str(tmp_path / "manifest.sqlite3"))
+        manifest.record("utk/bragg/a.gsa", stat.st_size, stat.st_mtime_ns)
+        manifest.close()
+        manifest = UploadManifest(str(tmp_path / "manifest.sqlite3"))
+        assert manifest.is_current("utk/bragg/a.gsa", stat)
+        manifest.close()
+
+    def test_reconcile(self, manifest, gsa):
+        stat = os.stat(gsa)
+        manifest.record("utk/bragg/deleted.gsa", 10, 1)
+        manifest.record("utk/bragg/resized.gsa", 10, 1)
+        manifest.record("utk/bragg/same.gsa", 10, 1)
+        manifest.record("utk/transition/other.txt", 10, 1)
+
+        removed, added = manifest.reconcile(
+            "utk/bragg/",
+            {"utk/bragg/resized.gsa": 20, "utk/bragg/same.gsa": 10, "utk/bragg/a.gsa": stat.st_size},
+        )
+        assert (removed, added) == (1, 2)
+        assert "utk/bragg/deleted.gsa" not in manifest
+        assert manifest.get("utk/bragg/resized.gsa")["size"] == 20
+        assert manifest.get("utk/bragg/same.gsa")["mtime_ns"] == 1
+        # the entries outside of the prefix are kept
+        assert "utk/transition/other.txt" in manifest
+
+        # an object listed without a local modification time is current if the sizes match
+        assert manifest.is_current("utk/bragg/a.gsa", stat)
+        assert manifest.get("utk/bragg/a.gsa")["mtime_ns"] == stat.st_mtime_ns
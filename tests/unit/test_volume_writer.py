@@ -0,0 +1,166 @@
+"""
+File: test_volume_writer.py
+Author: NSDF-INTERSECT Team
+License: BSD-3
+Description: Unit tests for the atomic volume writer.
+"""
+
+from __future__ import annotations
+import os
+import errno
+import queue
+import threading
+import time
+import volume_writer
+from volume_writer import write_atomic, link_or_copy, append_record, persist, WriterQueue
+from volume_watcher import InotifyWatcher, inotify_available
+import pytest
+
+
+class TestWriteAtomic:
+    @pytest.mark.parametrize("durability", ["none", "file", "full"])
+    def test_write(self, tmp_path, durability):
+        path = tmp_path / "1743619479_NOM168364tof.gsa"
+        write_atomic(str(path), b"bank 1", durability)
+        write_atomic(str(path), b"bank 2", durability)
+        assert path.read_bytes() == b"bank 2"
+        assert os.listdir(tmp_path) == [path.name]
+
+    def test_failed_write_leaves_no_temp_file(self, tmp_path):
+        with pytest.raises(TypeError):
+            write_atomic(str(tmp_path / "a.gsa"), "not bytes")
+        assert os.listdir(tmp_path) == []
+
+
+class TestLinkOrCopy:
+    def test_link(self, tmp_path):
+        src, dst = tmp_path / "a.gsa", tmp_path / "b.gsa"
+        src.write_bytes(b"bank 1")
+        dst.write_bytes(b"old")
+        assert link_or_copy(str(src), str(dst))
+        assert os.path.samefile(src, dst)
+        assert sorted(os.listdir(tmp_path)) == ["a.gsa", "b.gsa"]
+
+    def test_copy_across_filesystems(self, tmp_path, monkeypatch):
+        def cross_device(src, dst):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        monkeypatch.setattr(os, "link", cross_device)
+        src, dst = tmp_path / "a.gsa", tmp_path / "b.gsa"
+        src.write_bytes(b"bank 1")
+        assert not link_or_copy(str(src), str(dst), durability="full")
+        assert dst.read_bytes() == b"bank 1"
+        assert not os.path.samefile(src, dst)
+
+
+class TestAppendRecord:
+    @pytest.mark.parametrize("durability", ["none", "full"])
+    def test_append(self, tmp_path, durability):
+        path = tmp_path / "c1_transition.txt"
+        append_record(str(path), b"r1,300.0,1.0\n", durability)
+        append_record(str(path), b"r2,310.0,2.0\n", durability)
+        assert path.read_bytes() == b"r1,300.0,1.0\nr2,310.0,2.0\n"
+        assert os.listdir(tmp_path) == [path.name]
+
+    def test_create_without_hardlinks(self, tmp_path, monkeypatch):
+        def not_permitted(src, dst):
+            raise OSError(errno.EPERM, "Operation not permitted")
+
+        monkeypatch.setattr(os, "link", not_permitted)
+        path = tmp_path / "andie.txt"
+        append_record(str(path), b"c1,a1,1743619342,400.0\n")
+        assert path.read_bytes() == b"c1,a1,1743619342,400.0\n"
+        assert os.listdir(tmp_path) == [path.name]
+
+    @pytest.mark.skipif(not inotify_available(), reason="inotify is not available")
+    def test_first_append_is_watched(self, tmp_path):
+        events = queue.Queue()
+        watcher = InotifyWatcher({"andie_volume": str(tmp_path)}, lambda volume, name: name and events.put(name))
+        watcher.start()
+        try:
+            append_record(str(tmp_path / "andie.txt"), b"c1,a1,1743619342,400.0\n")
+            assert events.get(timeout=2.0) == "andie.txt"
+        finally:
+            watcher.stop()
+
+
+class TestPersist:
+    @pytest.mark.parametrize("mode", ["link", "copy"])
+    def test_persist(self, tmp_path, mode):
+        paths = [str(tmp_path / "bragg_volume" / "a.gsa"), str(tmp_path / "scientist_cloud_volume" / "a.gsa")]
+        persist(b"bank 1", paths, mode=mode)
+        for path in paths:
+            with open(path, "rb") as f:
+                assert f.read() == b"bank 1"
+        assert os.path.samefile(*paths) == (mode == "link")
+
+    def test_unknown_mode(self, tmp_path):
+        with pytest.raises(ValueError):
+            persist(b"bank 1", [str(tmp_path / "a.gsa")], mode="reflink")
+        with pytest.raises(ValueError):
+            persist(b"bank 1", [str(tmp_path / "a.gsa")], durability="always")
+
+
+class TestWriterQueue:
+    def test_appends_are_coalesced(self, tmp_path, monkeypatch):
+        writes = []
+        append = volume_writer.append_record
+        monkeypatch.setattr(volume_writer, "append_record", lambda path, record, durability: writes.append(path) or append(path, record))
+
+        writer = WriterQueue(flush_interval=60)
+        path = str(tmp_path / "andie.txt")
+        for i in range(10):
+            writer.append(path, f"c1,a{i},1743619342,400.0\n".encode())
+        assert writer.flush(timeout=5)
+        writer.close()
+        assert writes == [path]
+        with open(path) as f:
+            assert [line.split(",")[1] for line in f] == [f"a{i}" for i in range(10)]
+
+    def test_flush_by_size_and_time(self, tmp_path):
+        path = tmp_path / "c1_transition.txt"
+        writer = WriterQueue(flush_bytes=8, flush_interval=60)
+        writer.append(str(path), b"r1,300.0,1.0\n")
+        writer.append(str(tmp_path / "other.txt"), b"x")
+        time.sleep(0.2)
+        assert path.read_bytes() == b"r1,300.0,1.0\n"
+        writer.close()
+
+        writer = WriterQueue(flush_interval=0.01)
+        writer.append(str(path), b"r2,310.0,2.0\n")
+        time.sleep(0.2)
+        assert path.read_bytes().endswith(b"r2,310.0,2.0\n")
+        writer.close()
+
+    def test_order_is_kept(self, tmp_path):
+        writer = WriterQueue(flush_interval=60)
+        transition, done = tmp_path / "c1_transition.txt", tmp_path / "c1.done"
+        writer.append(str(transition), b"r1,300.0,1.0\n")
+        writer.write(str(done), b" ")
+        writer.close()
+        assert transition.read_bytes() == b"r1,300.0,1.0\n"
+        assert done.stat().st_mtime_ns >= transition.stat().st_mtime_ns
+
+    def test_backpressure(self, tmp_path, monkeypatch):
+        release = threading.Event()
+        monkeypatch.setattr(volume_writer, "write_atomic", lambda path, data, durability: release.wait())
+
+        writer = WriterQueue(max_bytes=8)
+        writer.write(str(tmp_path / "a.gsa"), b"1234")
+        writer.write(str(tmp_path / "b.gsa"), b"1234")
+        with pytest.raises(queue.Full):
+            writer.write(str(tmp_path / "c.gsa"), b"1234", timeout=0.05)
+        release.set()
+        writer.write(str(tmp_path / "c.gsa"), b"1234", timeout=5)
+        writer.close()
+
+    def test_close_drains(self, tmp_path):
+        writer = WriterQueue(flush_interval=60)
+        paths = [tmp_path / "bragg_volume" / "a.gsa", tmp_path / "scientist_cloud_volume" / "a.gsa"]
+        writer.persist(b"bank 1", [str(p) for p in paths])
+        writer.append(str(tmp_path / "andie.txt"), b"c1,a1,1743619342,400.0\n")
+        writer.close()
+        assert paths[1].read_bytes() == b"bank 1"
+        assert (tmp_path / "andie.txt").exists()
+        with pytest.raises(RuntimeError):
+            writer.append(str(tmp_path / "andie.txt"), b"late\n")